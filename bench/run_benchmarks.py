@@ -0,0 +1,312 @@
+# coding:utf-8
+"""
+Benchmarks of EasyCrypt operations.
+
+    python bench/run_benchmarks.py [-g file text tree gcm] [-s 1K,1M,64M,1G] [-r 3] [-b auto] [-o result.json] [-c baseline.json]
+
+Each group of benchmarks runs in its own python process, so that its peak RSS is measured without others:
+
+    file_<size>   encrypt_file / decrypt_file of files of size (sizes of -s) one by one in a key scope,
+                  and encrypt_files / decrypt_files of all of them
+    text          encrypt_file_with_header of a text file of short lines
+    small_tree    zip_dir / unzip_dir / encrypt_dir / decrypt_dir of a tree of many small files
+    large_tree    the same as small_tree with a few large files
+    gcm           gcm backend with one worker (serial) and with cpu_count workers (parallel) on a large file,
+                  whose results have the speedup of parallel over serial
+
+Results are printed and written to -o in json: throughput (MB/s), latency percentiles of each call (ms)
+and time of all calls divided by the number of processed files (ms). The tree benchmarks process a whole tree
+in one call, so that their amortized time per file is not the latency of a file.
+Peak RSS of the process and of its children (openssl, compressing workers) in KB is reported once for each group.
+With -c, results are compared with a baseline json written by -o, and the exit code is 1 if any of them
+is slower than the baseline by more than the threshold.
+Test data is generated from a fixed seed, so the same files are en/decrypted on every run.
+Keys are derived as the library does by default (once per operation, see CipherBackend.key_scope),
+so the cost of the calibrated KDF is included. Only the calibration itself, done once per process, is not measured.
+"""
+import os, sys, json, time, random, shutil, argparse, platform, tempfile, subprocess
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from easy_crypt import EasyCrypt as ec
+from zip_util import ZipUtil
+from cipher_backend import BackendRegistry, CipherBackend, ChunkedGcmBackend
+try:
+    import resource
+except ImportError: # for windows
+    resource = None
+
+BENCH_PSWD = 'bench_mst_pswd'
+SEED = 20161018
+DATA_CHUNK_SIZE = 1024 * 1024
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+DEFAULT_SIZES = '1K,64K,1M,64M'
+# bytes of files of each size benchmark (small files are en/decrypted many times)
+FILE_GROUP_BYTES = 64 * 1024 * 1024
+MAX_FILES = 256
+TEXT_SIZE = 16 * 1024 * 1024
+# (number of files, size of a file) of trees
+SMALL_TREE = (2000, 4 * 1024)
+LARGE_TREE = (4, 32 * 1024 * 1024)
+GCM_SIZE = 256 * 1024 * 1024
+GROUPS = ['file', 'text', 'tree', 'gcm']
+DEFAULT_THRESHOLD = 0.1
+
+def parse_size(size_str):
+    """'64K' -> 65536"""
+    size_str = size_str.strip().upper()
+    if size_str[-1] in SIZE_UNITS: return int(float(size_str[:-1]) * SIZE_UNITS[size_str[-1]])
+    return int(size_str)
+
+def format_size(size):
+    for unit in ['G', 'M', 'K']:
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0: return '{0}{1}'.format(size // SIZE_UNITS[unit], unit)
+    return str(size)
+
+def write_data(file_path, size, rnd):
+    """Write size bytes of pseudo random data (repeated chunk of rnd) to file_path."""
+    chunk = bytes(rnd.getrandbits(8) for i in range(min(size, DATA_CHUNK_SIZE)))
+    with open(file_path, 'wb') as data_file:
+        for pos in range(0, size, len(chunk)):
+            data_file.write(chunk[:size - pos])
+
+def write_text(file_path, size, rnd):
+    """Write text of short csv lines to file_path."""
+    with open(file_path, 'w') as text_file:
+        written = 0
+        while written < size:
+            line = '{0},{1},{2:.6f},item_{3}\n'.format(written, rnd.randint(0, 10 ** 6), rnd.random(), rnd.randint(0, 999))
+            text_file.write(line)
+            written += len(line)
+
+def write_tree(dir_path, file_count, file_size, rnd):
+    for i in range(file_count):
+        # 100 files per directory
+        file_path = os.path.join(dir_path, 'd{0:03d}'.format(i // 100), 'f{0:05d}.bin'.format(i))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_data(file_path, file_size, rnd)
+
+def percentile(sorted_values, ratio):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+def summarize(latencies, total_bytes, file_count):
+    """
+    Result dict of latencies (seconds of each call) which processed total_bytes of file_count files in total.
+    amortized_ms_per_file is the time of all calls divided by file_count.
+    """
+    seconds = sum(latencies)
+    sorted_latencies = sorted(latencies)
+    return {
+        'calls': len(latencies),
+        'files': file_count,
+        'bytes': total_bytes,
+        'seconds': round(seconds, 6),
+        'throughput_mb_s': round(total_bytes / seconds / SIZE_UNITS['M'], 3) if seconds > 0 else None,
+        'amortized_ms_per_file': round(seconds / file_count * 1000, 4),
+        'latency_ms': dict((name, round(percentile(sorted_latencies, ratio) * 1000, 4))
+                for name, ratio in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]),
+    }
+
+def timed(func, *args, **kwargs):
+    """Returns seconds of func call, which has to succeed (for all files if it returns dict of results)."""
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    if res == False or res == None or (isinstance(res, dict) and False in res.values()): raise RuntimeError('{0} failed: {1}'.format(func.__name__, args))
+    return seconds
+
+def remove_path(path):
+    if os.path.isdir(path): shutil.rmtree(path)
+    elif os.path.exists(path): os.remove(path)
+
+def bench_file(work_dir, size, runs, backend):
+    rnd = random.Random(SEED)
+    file_count = max(1, min(MAX_FILES, FILE_GROUP_BYTES // size))
+    raw_paths = [os.path.join(work_dir, 'file{0}.bin'.format(i)) for i in range(file_count)]
+    for raw_path in raw_paths: write_data(raw_path, size, rnd)
+    enc_paths = [raw_path + ec.ENCRYPTED_EXT for raw_path in raw_paths]
+    latencies = dict((name, []) for name in ['encrypt_file', 'decrypt_file', 'encrypt_files', 'decrypt_files'])
+    for run in range(runs):
+        # a loop of single file calls shares keys in a key scope, and the first call derives them
+        with CipherBackend.key_scope():
+            for raw_path in raw_paths:
+                latencies['encrypt_file'].append(timed(ec.encrypt_file, raw_path, BENCH_PSWD, backend=backend))
+        with CipherBackend.key_scope():
+            for enc_path in enc_paths:
+                latencies['decrypt_file'].append(timed(ec.decrypt_file, enc_path, backend=backend,
+                        pswd_input_func=lambda msg: BENCH_PSWD))
+        latencies['encrypt_files'].append(timed(ec.encrypt_files, raw_paths, BENCH_PSWD, backend=backend))
+        latencies['decrypt_files'].append(timed(ec.decrypt_files, enc_paths, BENCH_PSWD, backend=backend))
+    total_bytes = size * file_count * runs
+    return dict((name, summarize(values, total_bytes, file_count * runs)) for name, values in latencies.items())
+
+def bench_text(work_dir, size, runs, backend):
+    raw_path = os.path.join(work_dir, 'lines.csv')
+    write_text(raw_path, size, random.Random(SEED))
+    size = os.path.getsize(raw_path)
+    latencies = [timed(ec.encrypt_file_with_header, raw_path, BENCH_PSWD, backend=backend) for run in range(runs)]
+    return {'encrypt_file_with_header': summarize(latencies, size * runs, runs)}
+
+def bench_tree(work_dir, file_count, file_size, runs, backend):
+    raw_dir_path = os.path.join(work_dir, 'tree')
+    write_tree(raw_dir_path, file_count, file_size, random.Random(SEED))
+    # password is recorded in the directory before measuring
+    ec.get_master_pswd_from_txt(os.path.join(raw_dir_path, ec.MASTER_PASS_TXT), lambda msg: BENCH_PSWD)
+    zip_path = raw_dir_path + ZipUtil.ZIP_EXT
+    enc_path = zip_path + ec.ENCRYPTED_EXT
+    dst_dir_path = os.path.join(work_dir, 'dst')
+    latencies = dict((name, []) for name in ['zip_dir', 'unzip_dir', 'encrypt_dir', 'decrypt_dir'])
+    for run in range(runs):
+        remove_path(zip_path)
+        latencies['zip_dir'].append(timed(ZipUtil.zip_dir, raw_dir_path))
+        remove_path(dst_dir_path)
+        latencies['unzip_dir'].append(timed(ZipUtil.unzip_dir, zip_path, dst_dir_path))
+        remove_path(zip_path)
+        remove_path(enc_path)
+        latencies['encrypt_dir'].append(timed(ec.encrypt_dir, raw_dir_path, backend=backend))
+        remove_path(dst_dir_path)
+        latencies['decrypt_dir'].append(timed(ec.decrypt_dir, enc_path, dst_dir_path, remove_zip=True, backend=backend,
+                pswd_input_func=lambda msg: BENCH_PSWD))
+    total_bytes = file_count * file_size * runs
+    return dict((name, summarize(values, total_bytes, file_count * runs)) for name, values in latencies.items())
+
+def bench_gcm(work_dir, size, runs):
+    raw_path = os.path.join(work_dir, 'large.bin')
+    write_data(raw_path, size, random.Random(SEED))
+    enc_path = raw_path + ec.ENCRYPTED_EXT
+    dec_path = raw_path + '.dec'
+    results = {}
+    # keys are derived before measuring, so that only the cipher is compared
+    with CipherBackend.key_scope():
+        CipherBackend.create_file_header(BENCH_PSWD)
+        for mode, max_workers in [('serial', 1), ('parallel', None)]:
+            backend = ChunkedGcmBackend(max_workers)
+            latencies = {'encrypt': [], 'decrypt': []}
+            for run in range(runs):
+                latencies['encrypt'].append(timed(backend.encrypt_file, raw_path, BENCH_PSWD, enc_path))
+                latencies['decrypt'].append(timed(backend.decrypt_file, enc_path, BENCH_PSWD, dec_path))
+            for name, values in latencies.items():
+                results['{0}_{1}'.format(name, mode)] = summarize(values, size * runs, runs)
+    for name in ['encrypt', 'decrypt']:
+        serial, parallel = results[name + '_serial'], results[name + '_parallel']
+        parallel['speedup'] = round(serial['seconds'] / parallel['seconds'], 3) if parallel['seconds'] > 0 else None
+    return results
+
+def peak_rss_kb(who):
+    """Peak RSS in KB of this process (or of its children), or None if it can not be measured."""
+    if resource == None: return None
+    max_rss = resource.getrusage(who).ru_maxrss
+    # bytes on mac, KB on linux
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+def run_group(group, args):
+    """Run a benchmark group in this process and returns dict of name -> result and dict of peak RSS of the group."""
+    # kdf is calibrated once per process before measuring, but keys are derived as the library does by default
+    CipherBackend.kdf_spec()
+    work_dir = tempfile.mkdtemp(prefix='easycrypt-bench-', dir=args.w)
+    try:
+        if group.startswith('file_'):
+            results = bench_file(work_dir, parse_size(group[len('file_'):]), args.r, args.b)
+        elif group == 'text':
+            results = bench_text(work_dir, TEXT_SIZE, args.r, args.b)
+        elif group == 'gcm':
+            results = bench_gcm(work_dir, GCM_SIZE, args.r)
+        elif group == 'small_tree':
+            results = bench_tree(work_dir, SMALL_TREE[0], SMALL_TREE[1], args.r, args.b)
+        else:
+            results = bench_tree(work_dir, LARGE_TREE[0], LARGE_TREE[1], args.r, args.b)
+    finally:
+        shutil.rmtree(work_dir)
+    rss = {'peak_rss_kb': peak_rss_kb(resource.RUSAGE_SELF) if resource else None,
+            'peak_child_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN) if resource else None}
+    return dict((group + '/' + name, result) for name, result in results.items()), rss
+
+def run_group_process(group, args):
+    """Run a benchmark group in a new python process, so that peak RSS is of the group only. Returns the same as run_group."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--group', group, '-r', str(args.r), '-b', args.b]
+    if args.w != None: cmd += ['-w', args.w]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE)
+    if proc.returncode != 0: raise RuntimeError('benchmark {0} failed'.format(group))
+    output = json.loads(proc.stdout.decode('utf-8'))
+    return output['results'], output['rss']
+
+def select_groups(args):
+    groups = []
+    if 'file' in args.g: groups += ['file_' + format_size(parse_size(size)) for size in args.s.split(',')]
+    if 'text' in args.g: groups.append('text')
+    if 'tree' in args.g: groups += ['small_tree', 'large_tree']
+    if 'gcm' in args.g and ChunkedGcmBackend.is_available(): groups.append('gcm')
+    return groups
+
+def environment(args):
+    result = ec.exec_command_get_result(['openssl', 'version'])
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': args.b,
+        'openssl': result.strip() if result != None else None,
+        'runs': args.r,
+    }
+
+def compare(results, baseline_results, threshold):
+    """Print ratios to baseline and returns names of results which are slower by more than threshold."""
+    regressions = []
+    print('\n{0:<40} {1:>12} {2:>12}'.format('compared with baseline', 'throughput', 'p50'))
+    for name, result in results.items():
+        base = baseline_results.get(name)
+        if base == None or base['throughput_mb_s'] in (None, 0) or result['throughput_mb_s'] == None: continue
+        throughput_ratio = result['throughput_mb_s'] / base['throughput_mb_s']
+        p50_ratio = result['latency_ms']['p50'] / base['latency_ms']['p50'] if base['latency_ms']['p50'] > 0 else 1.0
+        regressed = throughput_ratio < 1 - threshold or p50_ratio > 1 + threshold
+        if regressed: regressions.append(name)
+        print('{0:<40} {1:>11.2f}x {2:>11.2f}x{3}'.format(name, throughput_ratio, p50_ratio, '  REGRESSION' if regressed else ''))
+    return regressions
+
+def print_results(results, groups):
+    print('{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8}'.format('benchmark', 'MB/s', 'p50 ms', 'p99 ms', 'ms/file', 'speedup'))
+    for name, result in results.items():
+        print('{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8}'.format(name, result['throughput_mb_s'],
+                result['latency_ms']['p50'], result['latency_ms']['p99'], result['amortized_ms_per_file'],
+                result.get('speedup', '')))
+    print('\n{0:<40} {1:>12} {2:>12}'.format('group', 'peak RSS KB', 'children KB'))
+    for group, rss in groups.items():
+        print('{0:<40} {1:>12} {2:>12}'.format(group, rss['peak_rss_kb'], rss['peak_child_rss_kb']))
+
+def run_benchmarks(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of EasyCrypt operations.')
+    parser.add_argument('-g', type=str, nargs='+', default=GROUPS, choices=GROUPS, help='Groups of benchmarks to run.')
+    parser.add_argument('-s', type=str, metavar='sizes', default=DEFAULT_SIZES,
+            help='Comma separated sizes of file benchmarks (e.g. 1K,1M,1G,4G).')
+    parser.add_argument('-r', type=int, metavar='runs', default=3, help='Number of runs of each benchmark.')
+    parser.add_argument('-b', type=str, metavar='backend', default=BackendRegistry.DEFAULT_BACKEND, choices=BackendRegistry.names(),
+            help='Cipher backend.')
+    parser.add_argument('-w', type=str, metavar='work_dir', help='Directory of test data (temporary directory if not specified).')
+    parser.add_argument('-o', type=str, metavar='result_json', help='Write results to json file.')
+    parser.add_argument('-c', type=str, metavar='baseline_json', help='Compare results with json file written by -o.')
+    parser.add_argument('-t', type=float, metavar='threshold', default=DEFAULT_THRESHOLD,
+            help='Ratio of slowdown to the baseline which is reported as regression.')
+    parser.add_argument('--group', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.group != None:
+        # child process of a group
+        results, rss = run_group(args.group, args)
+        print(json.dumps({'results': results, 'rss': rss}))
+        return True
+    results = {}
+    groups = {}
+    for group in select_groups(args):
+        results_of_group, groups[group] = run_group_process(group, args)
+        results.update(results_of_group)
+    print_results(results, groups)
+    if args.o != None:
+        with open(args.o, 'w') as result_file:
+            json.dump({'environment': environment(args), 'results': results, 'groups': groups}, result_file, indent=2, sort_keys=True)
+    if args.c != None:
+        with open(args.c, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        return len(compare(results, baseline['results'], args.t)) == 0
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if run_benchmarks() else 1)
@@ -0,0 +1,343 @@
+# coding:utf-8
+import os, sys, time, shutil, getpass, asyncio, inspect, functools, threading
+from easy_crypt import EasyCrypt
+from executor import CommandExecutor
+from cipher_backend import BackendRegistry, CipherBackend, OpensslBackend, DecryptError, DecryptStream, EncryptStream
+from metrics import Metrics
+
+class OperationCancelled(Exception):
+    """Raised in worker threads of AsyncEasyCrypt when the operation has been cancelled."""
+    pass
+
+class AsyncEasyCrypt:
+    """
+    asyncio counterparts of EasyCrypt operations, so that one event loop can drive many en/decryptions.
+
+    With openssl backend, files are en/decrypted by openssl processes started as asyncio subprocesses.
+    In-process backends and directories (archiving, extracting) run EasyCrypt operations in the default executor
+    of the loop, where data goes through the streams of the backend chunk by chunk.
+    Every operation can be cancelled: openssl is killed (or the worker stops at the next chunk)
+    and partial output is removed before CancelledError is raised.
+
+    limiter is an asyncio.Semaphore (or any async context manager) which bounds the number of operations
+    running at the same time, and can be shared among operations.
+    pswd_input_func can be a coroutine function (async password provider) as well as a normal function,
+    and it is always called on the event loop.
+    """
+
+    @staticmethod
+    async def getpass_async(msg):
+        """Default password provider, which asks password in the default executor without blocking the loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, getpass.getpass, msg)
+
+    @staticmethod
+    async def encrypt_file(raw_file_path, master_pswd, encrypted_file_path=None, backend=None, output_format=None,
+            limiter=None):
+        """Async EasyCrypt.encrypt_file. Returns True if success, otherwise returns False."""
+        if os.path.exists(raw_file_path) == False: return False
+        if encrypted_file_path == None: encrypted_file_path = raw_file_path + EasyCrypt.ENCRYPTED_EXT
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        async with AsyncEasyCrypt._limit(limiter):
+            if isinstance(cipher_backend, OpensslBackend):
+                return await AsyncEasyCrypt._encrypt_file_openssl(raw_file_path, master_pswd, encrypted_file_path,
+                        output_format)
+            return await AsyncEasyCrypt._run_in_thread(EasyCrypt.encrypt_file, cipher_backend, None,
+                    raw_file_path, master_pswd, encrypted_file_path, output_format=output_format)
+
+    @staticmethod
+    async def decrypt_file(encrypted_file_path, raw_file_path=None, failed_act=None, remove_enc_file=False,
+            pswd_input_func=None, backend=None, limiter=None):
+        """
+        Async EasyCrypt.decrypt_file, which asks password by pswd_input_func until the file is decrypted.
+        Returns True if success and False if not.
+        """
+        if pswd_input_func == None: pswd_input_func = AsyncEasyCrypt.getpass_async
+        if os.path.exists(encrypted_file_path) == False: return False
+        if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False:
+            print('Decryption is only possible for {0} file'.format(EasyCrypt.ENCRYPTED_EXT))
+            return False # unsupported extension
+        if raw_file_path == None: raw_file_path = EasyCrypt.rm_ext_from_path(encrypted_file_path)
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        if isinstance(cipher_backend, OpensslBackend) == False:
+            async with AsyncEasyCrypt._limit(limiter):
+                return await AsyncEasyCrypt._run_in_thread(EasyCrypt.decrypt_file, cipher_backend, pswd_input_func,
+                        encrypted_file_path, raw_file_path, failed_act, remove_enc_file)
+        while True:
+            master_pswd = await AsyncEasyCrypt._input_pswd(pswd_input_func, 'Input master password: ')
+            async with AsyncEasyCrypt._limit(limiter):
+                res = await AsyncEasyCrypt._decrypt_file_openssl(encrypted_file_path, master_pswd, raw_file_path)
+            if res != None:
+                if remove_enc_file: os.remove(encrypted_file_path)
+                return True
+            if failed_act != None: failed_act()
+
+    @staticmethod
+    async def get_decrypted_txt(encrypted_file_path, failed_act=None, pswd_input_func=None, backend=None,
+            encode='utf-8', limiter=None):
+        """Async EasyCrypt.get_decrypted_txt. Returns decrypted text if success, else returns None."""
+        if pswd_input_func == None: pswd_input_func = AsyncEasyCrypt.getpass_async
+        if os.path.exists(encrypted_file_path) == False: return None
+        if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False:
+            if sys.flags.debug: print('Unsupported extension. The file has to be *' + EasyCrypt.ENCRYPTED_EXT + ' file')
+            return None # unsupported extension
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return None
+        if isinstance(cipher_backend, OpensslBackend) == False:
+            async with AsyncEasyCrypt._limit(limiter):
+                return await AsyncEasyCrypt._run_in_thread(EasyCrypt.get_decrypted_txt, cipher_backend, pswd_input_func,
+                        encrypted_file_path, failed_act, encode=encode)
+        while True:
+            master_pswd = await AsyncEasyCrypt._input_pswd(pswd_input_func, 'Input master password: ')
+            async with AsyncEasyCrypt._limit(limiter):
+                decrypted_bytes = await AsyncEasyCrypt._decrypt_file_openssl(encrypted_file_path, master_pswd)
+            if decrypted_bytes != None: return decrypted_bytes.decode(encode)
+            if failed_act != None: failed_act()
+
+    @staticmethod
+    async def encrypt_dir(raw_dir_path, encrypted_dir_path=None, pswd_input_func=None, backend=None,
+            archive_format=EasyCrypt.ZIP_FORMAT, output_format=None, compression=None, walker=None, limiter=None):
+        """Async EasyCrypt.encrypt_dir (always streamed). Returns True if succeeded, otherwise returns False."""
+        if pswd_input_func == None: pswd_input_func = AsyncEasyCrypt.getpass_async
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        async with AsyncEasyCrypt._limit(limiter):
+            return await AsyncEasyCrypt._run_in_thread(EasyCrypt.encrypt_dir, cipher_backend, pswd_input_func,
+                    raw_dir_path, encrypted_dir_path, archive_format=archive_format, output_format=output_format,
+                    compression=compression, walker=walker)
+
+    @staticmethod
+    async def decrypt_dir(encrypted_dir_path, dst_dir_path=None, remove_enc_file=False, remove_zip=False,
+            pswd_input_func=None, backend=None, limiter=None):
+        """Async EasyCrypt.decrypt_dir. Returns True if succeeded, else False."""
+        if pswd_input_func == None: pswd_input_func = AsyncEasyCrypt.getpass_async
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        async with AsyncEasyCrypt._limit(limiter):
+            return await AsyncEasyCrypt._run_in_thread(EasyCrypt.decrypt_dir, cipher_backend, pswd_input_func,
+                    encrypted_dir_path, dst_dir_path, remove_enc_file, remove_zip)
+
+    @staticmethod
+    def _limit(limiter):
+        return limiter if limiter != None else _NoLimit()
+
+    @staticmethod
+    async def _input_pswd(pswd_input_func, msg):
+        pswd = pswd_input_func(msg)
+        if inspect.isawaitable(pswd): pswd = await pswd
+        return pswd
+
+    @staticmethod
+    async def _encrypt_file_openssl(raw_file_path, master_pswd, encrypted_file_path, output_format=None):
+        # key derivation may take a while for the first file
+        header, file_pswd = await asyncio.get_running_loop().run_in_executor(None, CipherBackend.create_file_header,
+                master_pswd)
+        args = CommandExecutor.build_openssl_args('-e', raw_file_path, file_pswd, None,
+                CipherBackend.is_base64_format(output_format))
+        start = time.perf_counter()
+        try:
+            # openssl appends its output to the header
+            with open(encrypted_file_path, 'wb') as efile:
+                efile.write(header)
+                efile.flush()
+                res = await AsyncEasyCrypt._run_openssl(args, stdout_file=efile) != None
+        except OSError:
+            return False
+        except BaseException:
+            if os.path.exists(encrypted_file_path): os.remove(encrypted_file_path)
+            raise
+        Metrics.record(Metrics.CIPHER, time.perf_counter() - start, os.path.getsize(raw_file_path), res, op='encrypt_file')
+        if res == False: os.remove(encrypted_file_path)
+        return res
+
+    @staticmethod
+    async def _decrypt_file_openssl(encrypted_file_path, master_pswd, raw_file_path=None):
+        """
+        Decrypt encrypted_file_path to raw_file_path (or to stdout if None) with openssl.
+        Returns stdout bytes (b'' if raw_file_path is given) if succeeded, else None without partial output.
+        """
+        try:
+            efile, file_pswd = await asyncio.get_running_loop().run_in_executor(None,
+                    CipherBackend.open_encrypted_file, encrypted_file_path, master_pswd)
+        except (OSError, DecryptError):
+            return None
+        with efile:
+            base64_flg = CipherBackend.detect_format(encrypted_file_path) == CipherBackend.BASE64_FORMAT
+            args = CommandExecutor.build_openssl_args('-d', None, file_pswd, raw_file_path, base64_flg)
+            start = time.perf_counter()
+            try:
+                res = await AsyncEasyCrypt._run_openssl(args, stdin_file=efile)
+            except BaseException:
+                if raw_file_path != None and os.path.exists(raw_file_path): os.remove(raw_file_path)
+                raise
+        Metrics.record(Metrics.CIPHER, time.perf_counter() - start, os.path.getsize(encrypted_file_path), res != None,
+                op='decrypt_file')
+        if res == None and raw_file_path != None and os.path.exists(raw_file_path): os.remove(raw_file_path)
+        return res
+
+    @staticmethod
+    async def _run_openssl(args, stdin_file=None, stdout_file=None):
+        """
+        Run openssl as asyncio subprocess and returns stdout bytes (b'' if stdout_file is given) if succeeded, else None.
+        The process is killed if the operation is cancelled.
+        """
+        if sys.flags.debug: print(' '.join(args))
+        # stages of Metrics are per thread and can not be used across await
+        start = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(*args,
+                    stdin=stdin_file if stdin_file != None else asyncio.subprocess.DEVNULL,
+                    stdout=stdout_file if stdout_file != None else asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            if sys.flags.debug: print('[error]: ' + str(e))
+            return None
+        Metrics.record(Metrics.SPAWN, time.perf_counter() - start, command=CommandExecutor.OPENSSL)
+        try:
+            stdout_bytes, stderr_bytes = await proc.communicate()
+        except BaseException:
+            if proc.returncode == None: proc.kill()
+            # wait for the process so that its output can be removed
+            await asyncio.shield(proc.wait())
+            raise
+        if proc.returncode == 0: return stdout_bytes or b''
+        if sys.flags.debug: print('[error]: ' + stderr_bytes.decode('utf-8', 'replace'))
+        return None
+
+    @staticmethod
+    async def _run_in_thread(func, cipher_backend, pswd_input_func, *args, **kwargs):
+        """
+        Run EasyCrypt func in the default executor with cancellable backend, and with pswd_input_func
+        which is called on the loop (if not None). If cancelled, waits until the worker stops.
+        """
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        # password requests waiting for pswd_input_func
+        pending = set()
+        kwargs['backend'] = _CancellableBackend(cipher_backend, cancel_event)
+        if pswd_input_func != None:
+            def thread_pswd_input_func(msg):
+                if cancel_event.is_set(): raise OperationCancelled('cancelled')
+                future = asyncio.run_coroutine_threadsafe(AsyncEasyCrypt._input_pswd(pswd_input_func, msg), loop)
+                pending.add(future)
+                try:
+                    return future.result()
+                finally:
+                    pending.discard(future)
+            kwargs['pswd_input_func'] = thread_pswd_input_func
+        future = loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            for pswd_future in list(pending): pswd_future.cancel()
+            # the worker removes partial output when it stops
+            try:
+                await future
+            except Exception as e:
+                if sys.flags.debug: print('[cancelled]: ' + repr(e))
+            raise
+
+class _NoLimit:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+class _CancellableBackend(CipherBackend):
+    """
+    Backend which en/decrypts through the streams of backend, and raises OperationCancelled at the next chunk
+    once cancel_event is set. Partial output is removed as when the operation fails.
+    """
+
+    def __init__(self, backend, cancel_event):
+        self.backend = backend
+        self.name = backend.name
+        self.cancel_event = cancel_event
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set(): raise OperationCancelled('cancelled')
+
+    def encrypt_file(self, raw_file_path, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        self.check_cancelled()
+        try:
+            raw_file = open(raw_file_path, 'rb')
+        except OSError:
+            return False
+        with raw_file:
+            enc_stream = self.open_encrypt_stream(master_pswd, encrypted_file_path, output_format, key_check)
+            try:
+                shutil.copyfileobj(raw_file, enc_stream, EasyCrypt.STREAM_CHUNK_SIZE)
+            except BaseException:
+                enc_stream.abort()
+                raise
+        enc_stream.close()
+        return enc_stream.succeeded
+
+    def decrypt_file(self, encrypted_file_path, master_pswd, raw_file_path):
+        try:
+            dec_stream = self.open_decrypt_stream(master_pswd, encrypted_file_path)
+        except (OSError, DecryptError):
+            return False
+        try:
+            with dec_stream, open(raw_file_path, 'wb') as raw_file:
+                shutil.copyfileobj(dec_stream, raw_file, EasyCrypt.STREAM_CHUNK_SIZE)
+        except (OSError, DecryptError):
+            if os.path.exists(raw_file_path): os.remove(raw_file_path)
+            return False
+        except BaseException:
+            if os.path.exists(raw_file_path): os.remove(raw_file_path)
+            raise
+        return True
+
+    def decrypt_bytes(self, encrypted_file_path, master_pswd):
+        try:
+            with self.open_decrypt_stream(master_pswd, encrypted_file_path) as dec_stream:
+                return dec_stream.readall()
+        except (OSError, DecryptError):
+            return None
+
+    def open_encrypt_stream(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        self.check_cancelled()
+        return _CancellableEncryptStream(self,
+                self.backend.open_encrypt_stream(master_pswd, encrypted_file_path, output_format, key_check))
+
+    def open_decrypt_stream(self, master_pswd, encrypted_file_path):
+        self.check_cancelled()
+        return _CancellableDecryptStream(self, self.backend.open_decrypt_stream(master_pswd, encrypted_file_path))
+
+class _CancellableEncryptStream(EncryptStream):
+
+    def __init__(self, backend, enc_stream):
+        super().__init__(enc_stream.encrypted_file_path)
+        self._backend = backend
+        self._enc_stream = enc_stream
+
+    def _write(self, data):
+        self._backend.check_cancelled()
+        self._enc_stream.write(data)
+
+    def _finish(self):
+        self._enc_stream.close()
+        return self._enc_stream.succeeded
+
+    def _abort(self):
+        self._enc_stream.abort()
+
+class _CancellableDecryptStream(DecryptStream):
+
+    def __init__(self, backend, dec_stream):
+        super().__init__()
+        self._backend = backend
+        self._dec_stream = dec_stream
+
+    def _next_chunk(self):
+        self._backend.check_cancelled()
+        return self._dec_stream.read(EasyCrypt.STREAM_CHUNK_SIZE)
+
+    def close(self):
+        if self.closed == False: self._dec_stream.close()
+        super().close()
@@ -0,0 +1,1288 @@
+# coding:utf-8
+import os, sys, io, hmac, time, base64, binascii, hashlib, shutil, struct, tempfile, threading, itertools, functools
+import subprocess as sps
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from executor import CommandExecutor, Deadline, OperationTimeout
+from metrics import Metrics
+from key_agent import KeyCache
+# cryptography is optional. If it is not installed, openssl command is used instead.
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    Cipher = None
+
+class CipherBackend:
+    """
+    Base class of cipher backends used by EasyCrypt.
+    All backends read and write the same format as "openssl aes-256-cbc -k" (raw binary or -base64),
+    so files encrypted by one backend can be decrypted by the other.
+    Binary files start with SALT_MAGIC and base64 files do not, so decryption detects the format by itself.
+
+    By default the openssl data is preceded by one line of envelope header:
+
+        ENVELOPE_MAGIC <kdf spec> <hex kdf salt> <hex nonce> <hex wrapped file key> <hex tag> (padded)\n
+
+    The data is encrypted with a random file key (as the password of openssl, see file_key_pswd),
+    and only the file key is wrapped under the master password. So a wrong password is rejected
+    before decrypting the whole file, and the master password can be changed by rewriting the header
+    (rotate_key) without re-encrypting the data.
+    The wrapping key is derived from the master password by the key derivation function of kdf spec
+    (e.g. pbkdf2-sha256-600000 or scrypt-32768-8-1), whose cost is calibrated to KDF_SECONDS on the machine
+    which encrypts the file (see kdf_spec). Files encrypted by one process share the kdf salt and differ in nonce,
+    so the costly derivation is done once per operation on many files (see key_scope) instead of once per file,
+    or once per process if KEY_CACHE is set.
+    Files with the older key check header (KEY_CHECK_MAGIC <hex salt> <hex key check value>\n),
+    whose data is encrypted with the master password itself, and files without header
+    (e.g. encrypted by openssl command) can be decrypted as well.
+    Files with the envelope header can be decrypted by openssl command after removing the first line
+    with the password given by read_file_key.
+    """
+    name = None
+    # False if the backend must not be selected by 'auto' of BackendRegistry
+    auto_selectable = True
+    SALT_MAGIC = b'Salted__'
+    # output formats of encrypted files
+    BINARY_FORMAT = 'binary'
+    BASE64_FORMAT = 'base64'
+    DEFAULT_FORMAT = BINARY_FORMAT
+    KEY_CHECK_MAGIC = b'EasyCryptKCV1 '
+    KEY_CHECK_SALT_LEN = 16
+    KEY_CHECK_LEN = 16
+    # the key check value must not be easier to brute force than the cipher itself (one round of EVP_BytesToKey)
+    KEY_CHECK_DIGEST = 'sha256'
+    KEY_CHECK_ITERATIONS = 1000
+    KEY_CHECK_HEADER_LEN = len(KEY_CHECK_MAGIC) + KEY_CHECK_SALT_LEN * 2 + 1 + KEY_CHECK_LEN * 2 + 1
+    ENVELOPE_MAGIC = b'EasyCryptEnv2 '
+    FILE_KEY_LEN = 32
+    ENVELOPE_NONCE_LEN = 16
+    ENVELOPE_TAG_LEN = 16
+    # headers are padded to fixed length, so that the header can be rewritten in place with any kdf spec
+    ENVELOPE_HEADER_LEN = 256
+    KDF_SPEC_MAX_LEN = 64
+    # key derivation functions of the master password
+    KDF_PBKDF2 = 'pbkdf2'
+    KDF_SCRYPT = 'scrypt'
+    KDFS = (KDF_PBKDF2, KDF_SCRYPT)
+    KDF_DIGEST = 'sha256'
+    # KDF and target seconds to derive a key on this machine, used for new headers
+    KDF = KDF_PBKDF2
+    KDF_SECONDS = 0.2
+    # bounds of calibrated parameters, and of parameters accepted from headers
+    PBKDF2_MIN_ITERATIONS = 100000
+    PBKDF2_MAX_ITERATIONS = 100000000
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+    SCRYPT_MIN_N = 2 ** 14
+    SCRYPT_MAX_N = 2 ** 20
+    SCRYPT_MAX_R = 32
+    SCRYPT_MAX_P = 16
+    # key_agent.KeyCache or KeyAgentClient which keeps derived keys, so that they are not derived again.
+    # None (no cache) by default, so that no key is kept in memory longer than an operation unless the caller opts in.
+    KEY_CACHE = None
+    # kdf spec -> calibrated spec, and kdf salt of this process
+    _CALIBRATED_SPECS = {}
+    _SESSION_SALT = None
+    _KDF_LOCK = threading.Lock()
+    # KeyCache of running key scopes (used while KEY_CACHE is None) and the number of them
+    _SCOPE_CACHE = None
+    _SCOPE_COUNT = 0
+    # cache key -> lock of the derivation in progress
+    _DERIVING = {}
+
+    @staticmethod
+    def is_available():
+        """Returns whether this backend can be used in current environment."""
+        return True
+
+    @staticmethod
+    def detect_format(encrypted_file_path):
+        """Returns BINARY_FORMAT or BASE64_FORMAT according to the beginning of encrypted_file_path."""
+        with open(encrypted_file_path, 'rb', buffering=0) as efile:
+            if CipherBackend.read_envelope_header(efile) == None: CipherBackend.read_key_check_header(efile)
+            return CipherBackend._detect_format_of_file(efile)
+
+    @staticmethod
+    def _detect_format_of_file(efile):
+        """detect_format of file object from its current position, which is kept as is."""
+        pos = efile.tell()
+        head = efile.read(len(CipherBackend.SALT_MAGIC))
+        efile.seek(pos)
+        if head in (CipherBackend.SALT_MAGIC,) + ChunkedGcmBackend.GCM_MAGICS: return CipherBackend.BINARY_FORMAT
+        return CipherBackend.BASE64_FORMAT
+
+    @staticmethod
+    def key_check_value(master_pswd, salt):
+        """Value stored in key check header, derived from password and salt independently of the cipher key."""
+        return hashlib.pbkdf2_hmac(CipherBackend.KEY_CHECK_DIGEST, master_pswd.encode('utf-8'), salt,
+                CipherBackend.KEY_CHECK_ITERATIONS, CipherBackend.KEY_CHECK_LEN)
+
+    @staticmethod
+    def create_key_check_header(master_pswd):
+        """
+        Returns key check header line (bytes) for master_pswd with new random salt.
+        New files have envelope header instead, and this is kept for files written by older versions.
+        """
+        salt = os.urandom(CipherBackend.KEY_CHECK_SALT_LEN)
+        check_value = CipherBackend.key_check_value(master_pswd, salt)
+        return CipherBackend.KEY_CHECK_MAGIC + binascii.hexlify(salt) + b' ' + binascii.hexlify(check_value) + b'\n'
+
+    @staticmethod
+    def read_key_check_header(efile):
+        """
+        Read key check header at the current position of file object efile and returns (salt, key check value).
+        efile is left just after the header. If there is no header, returns None and efile is left as it was.
+        """
+        return CipherBackend._read_header_line(efile, CipherBackend.KEY_CHECK_MAGIC, CipherBackend.KEY_CHECK_HEADER_LEN, 2)
+
+    @staticmethod
+    def key_scope():
+        """
+        Context manager of an operation on many files (e.g. "with CipherBackend.key_scope():").
+        While KEY_CACHE is None, keys derived in the block are kept in memory until the last running block ends,
+        so that the calibrated KDF runs once per operation instead of once per file.
+        """
+        return _KeyScope()
+
+    @staticmethod
+    def key_scoped(func):
+        """Decorator which runs func in key_scope()."""
+        @functools.wraps(func)
+        def scoped_func(*args, **kwargs):
+            with _KeyScope():
+                return func(*args, **kwargs)
+        return scoped_func
+
+    @staticmethod
+    def derive_key_cached(kdf_name, pswd, salt, derive_func):
+        """
+        Returns key derived from pswd and salt by derive_func(), or the one in KEY_CACHE (or in the cache of
+        the running key scopes if it is None) if it has been derived already.
+        kdf_name identifies the derivation including its parameters.
+        Threads which need the same key wait for the one deriving it instead of deriving it at the same time.
+        """
+        cache = CipherBackend.KEY_CACHE
+        if cache == None: cache = CipherBackend._SCOPE_CACHE
+        if cache == None: return derive_func()
+        # KeyCache stores entries under HMAC of this with its own secret, so stored keys do not verify passwords
+        cache_key = hashlib.sha256(kdf_name.encode('utf-8') + b'\0' + salt + pswd.encode('utf-8')).hexdigest()
+        key = cache.get(cache_key)
+        if key != None: return key
+        with CipherBackend._KDF_LOCK:
+            lock = CipherBackend._DERIVING.setdefault(cache_key, threading.Lock())
+        try:
+            with lock:
+                key = cache.get(cache_key)
+                if key == None:
+                    key = derive_func()
+                    cache.put(cache_key, key)
+        finally:
+            with CipherBackend._KDF_LOCK:
+                if CipherBackend._DERIVING.get(cache_key) == lock: del CipherBackend._DERIVING[cache_key]
+        return key
+
+    @staticmethod
+    def parse_kdf_spec(kdf_spec):
+        """
+        Returns (kdf, tuple of int parameters) of kdf spec string.
+        Raises ValueError if it is invalid or too costly (headers may be crafted).
+        """
+        fields = kdf_spec.split('-')
+        if len(kdf_spec) > CipherBackend.KDF_SPEC_MAX_LEN: raise ValueError('too long kdf spec')
+        if fields[0] == CipherBackend.KDF_PBKDF2 and len(fields) == 3 and fields[1] == CipherBackend.KDF_DIGEST:
+            iterations = int(fields[2])
+            if 1 <= iterations <= CipherBackend.PBKDF2_MAX_ITERATIONS: return CipherBackend.KDF_PBKDF2, (iterations,)
+        elif fields[0] == CipherBackend.KDF_SCRYPT and len(fields) == 4:
+            n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+            if (2 <= n <= CipherBackend.SCRYPT_MAX_N and n & (n - 1) == 0 and 1 <= r <= CipherBackend.SCRYPT_MAX_R
+                    and 1 <= p <= CipherBackend.SCRYPT_MAX_P):
+                return CipherBackend.KDF_SCRYPT, (n, r, p)
+        raise ValueError('invalid kdf spec: {0}'.format(kdf_spec))
+
+    @staticmethod
+    def derive_kdf_key(kdf_spec, master_pswd, salt):
+        """Key derived from master_pswd and salt by kdf spec (in KEY_CACHE if it has been derived already)."""
+        kdf, params = CipherBackend.parse_kdf_spec(kdf_spec)
+        pswd_bytes = master_pswd.encode('utf-8')
+        if kdf == CipherBackend.KDF_PBKDF2:
+            derive_func = lambda: hashlib.pbkdf2_hmac(CipherBackend.KDF_DIGEST, pswd_bytes, salt, params[0], CipherBackend.FILE_KEY_LEN)
+        else:
+            n, r, p = params
+            derive_func = lambda: hashlib.scrypt(pswd_bytes, salt=salt, n=n, r=r, p=p,
+                    maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=CipherBackend.FILE_KEY_LEN)
+        return CipherBackend.derive_key_cached(kdf_spec, master_pswd, salt, derive_func)
+
+    @staticmethod
+    def calibrate_kdf(kdf=KDF_PBKDF2, seconds=KDF_SECONDS):
+        """
+        Returns kdf spec whose derivation takes about seconds on this machine.
+        Costs are not lowered below PBKDF2_MIN_ITERATIONS or SCRYPT_MIN_N (nor raised above the max).
+        """
+        pswd_bytes, salt = b'calibration', os.urandom(CipherBackend.KEY_CHECK_SALT_LEN)
+        if kdf == CipherBackend.KDF_PBKDF2:
+            probe_iterations = 10000
+            start_time = time.perf_counter()
+            hashlib.pbkdf2_hmac(CipherBackend.KDF_DIGEST, pswd_bytes, salt, probe_iterations, CipherBackend.FILE_KEY_LEN)
+            elapsed = max(time.perf_counter() - start_time, 1e-6)
+            iterations = int(probe_iterations * seconds / elapsed) // 1000 * 1000
+            iterations = min(max(iterations, CipherBackend.PBKDF2_MIN_ITERATIONS), CipherBackend.PBKDF2_MAX_ITERATIONS)
+            return '{0}-{1}-{2}'.format(CipherBackend.KDF_PBKDF2, CipherBackend.KDF_DIGEST, iterations)
+        if kdf != CipherBackend.KDF_SCRYPT or hasattr(hashlib, 'scrypt') == False:
+            raise ValueError('unsupported kdf: {0}'.format(kdf))
+        r, p = CipherBackend.SCRYPT_R, CipherBackend.SCRYPT_P
+        # memory and time are proportional to n, which has to be a power of 2
+        n = CipherBackend.SCRYPT_MIN_N
+        while n < CipherBackend.SCRYPT_MAX_N:
+            start_time = time.perf_counter()
+            hashlib.scrypt(pswd_bytes, salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + 1024 * 1024,
+                    dklen=CipherBackend.FILE_KEY_LEN)
+            if (time.perf_counter() - start_time) * 2 > seconds: break
+            n *= 2
+        return '{0}-{1}-{2}-{3}'.format(CipherBackend.KDF_SCRYPT, n, r, p)
+
+    @staticmethod
+    def kdf_spec():
+        """kdf spec of new headers: KDF calibrated to KDF_SECONDS, once per process."""
+        with CipherBackend._KDF_LOCK:
+            key = (CipherBackend.KDF, CipherBackend.KDF_SECONDS)
+            if key not in CipherBackend._CALIBRATED_SPECS:
+                CipherBackend._CALIBRATED_SPECS[key] = CipherBackend.calibrate_kdf(*key)
+                if sys.flags.debug: print('kdf: ' + CipherBackend._CALIBRATED_SPECS[key])
+            return CipherBackend._CALIBRATED_SPECS[key]
+
+    @staticmethod
+    def session_salt():
+        """kdf salt of headers written by this process."""
+        with CipherBackend._KDF_LOCK:
+            if CipherBackend._SESSION_SALT == None: CipherBackend._SESSION_SALT = os.urandom(CipherBackend.KEY_CHECK_SALT_LEN)
+            return CipherBackend._SESSION_SALT
+
+    @staticmethod
+    def envelope_keys(kdf_key, nonce):
+        """Returns (key stream for wrapping a file key, key of the tag) of a header with nonce."""
+        key_stream = hmac.new(kdf_key, b'wrap' + nonce, hashlib.sha256).digest()[:CipherBackend.FILE_KEY_LEN]
+        tag_key = hmac.new(kdf_key, b'tag' + nonce, hashlib.sha256).digest()
+        return key_stream, tag_key
+
+    @staticmethod
+    def wrap_file_key(master_pswd, file_key, kdf_spec=None):
+        """
+        Returns envelope header line (bytes) of file_key wrapped under master_pswd with new random nonce.
+        kdf_spec is the one calibrated on this machine (see kdf_spec()) if None.
+        """
+        if kdf_spec == None: kdf_spec = CipherBackend.kdf_spec()
+        salt = CipherBackend.session_salt()
+        nonce = os.urandom(CipherBackend.ENVELOPE_NONCE_LEN)
+        key_stream, tag_key = CipherBackend.envelope_keys(CipherBackend.derive_kdf_key(kdf_spec, master_pswd, salt), nonce)
+        wrapped_key = bytes(a ^ b for a, b in zip(file_key, key_stream))
+        tag = CipherBackend._envelope_tag(tag_key, kdf_spec, salt, wrapped_key)
+        CipherBackend._pswd_accepted(master_pswd)
+        header = b' '.join([kdf_spec.encode('ascii')] + [binascii.hexlify(field) for field in [salt, nonce, wrapped_key, tag]])
+        return CipherBackend.ENVELOPE_MAGIC + header.ljust(CipherBackend.ENVELOPE_HEADER_LEN - len(CipherBackend.ENVELOPE_MAGIC) - 1) + b'\n'
+
+    @staticmethod
+    def unwrap_file_key(master_pswd, envelope):
+        """
+        Returns file key of envelope (kdf spec, kdf salt, nonce, wrapped key, tag) read by read_envelope_header,
+        or None if master_pswd is wrong.
+        """
+        kdf_spec, salt, nonce, wrapped_key, tag = envelope
+        try:
+            kdf_key = CipherBackend.derive_kdf_key(kdf_spec, master_pswd, salt)
+        except ValueError:
+            return None
+        key_stream, tag_key = CipherBackend.envelope_keys(kdf_key, nonce)
+        if hmac.compare_digest(CipherBackend._envelope_tag(tag_key, kdf_spec, salt, wrapped_key), tag) == False: return None
+        CipherBackend._pswd_accepted(master_pswd)
+        return bytes(a ^ b for a, b in zip(wrapped_key, key_stream))
+
+    @staticmethod
+    def _pswd_accepted(master_pswd):
+        """
+        Tell KEY_CACHE that a header has accepted master_pswd or has been written with it,
+        so that KeyAgentClient gives typed passwords to the agent only when they are correct.
+        """
+        accept_pswd = getattr(CipherBackend.KEY_CACHE, 'accept_pswd', None)
+        if accept_pswd != None: accept_pswd(master_pswd)
+
+    @staticmethod
+    def _envelope_tag(tag_key, kdf_spec, salt, wrapped_key):
+        return hmac.new(tag_key, kdf_spec.encode('ascii') + b'\0' + salt + wrapped_key,
+                hashlib.sha256).digest()[:CipherBackend.ENVELOPE_TAG_LEN]
+
+    @staticmethod
+    def file_key_pswd(file_key):
+        """Password of the openssl data (or of the data of ChunkedGcmBackend) encrypted with file_key."""
+        return binascii.hexlify(file_key).decode('ascii')
+
+    @staticmethod
+    def create_file_header(master_pswd, key_check=True):
+        """
+        Returns (header line, password of the data) of a new encrypted file.
+        If key_check is False, there is no header and the data is encrypted with master_pswd as openssl command does.
+        """
+        if key_check == False: return b'', master_pswd
+        file_key = os.urandom(CipherBackend.FILE_KEY_LEN)
+        return CipherBackend.wrap_file_key(master_pswd, file_key), CipherBackend.file_key_pswd(file_key)
+
+    @staticmethod
+    def read_envelope_header(efile):
+        """
+        Read envelope header at the current position of file object efile
+        and returns (kdf spec, kdf salt, nonce, wrapped key, tag).
+        efile is left just after the header. If there is no header, returns None and efile is left as it was.
+        """
+        pos = efile.tell()
+        header = efile.read(CipherBackend.ENVELOPE_HEADER_LEN)
+        if header.startswith(CipherBackend.ENVELOPE_MAGIC) and header.endswith(b'\n'):
+            fields = header[len(CipherBackend.ENVELOPE_MAGIC):-1].split()
+            try:
+                if len(fields) == 5: return (fields[0].decode('ascii'),) + tuple(binascii.unhexlify(field) for field in fields[1:])
+            except (binascii.Error, ValueError):
+                pass
+        efile.seek(pos)
+        return None
+
+    @staticmethod
+    def _read_header_line(efile, magic, header_len, field_count):
+        pos = efile.tell()
+        header = efile.read(header_len)
+        if header.startswith(magic) and header.endswith(b'\n'):
+            fields = header[len(magic):-1].split(b' ')
+            try:
+                if len(fields) == field_count: return tuple(binascii.unhexlify(field) for field in fields)
+            except (binascii.Error, ValueError):
+                pass
+        efile.seek(pos)
+        return None
+
+    @staticmethod
+    def _read_file_pswd(efile, master_pswd):
+        """
+        Skip header of file object efile and returns the password of its data, which is master_pswd if the file
+        has no envelope header. Returns False if master_pswd is rejected by the header.
+        """
+        envelope = CipherBackend.read_envelope_header(efile)
+        if envelope != None:
+            file_key = CipherBackend.unwrap_file_key(master_pswd, envelope)
+            if file_key == None: return False
+            return CipherBackend.file_key_pswd(file_key)
+        key_check = CipherBackend.read_key_check_header(efile)
+        if key_check != None:
+            salt, check_value = key_check
+            if hmac.compare_digest(CipherBackend.key_check_value(master_pswd, salt), check_value) == False: return False
+            CipherBackend._pswd_accepted(master_pswd)
+        return master_pswd
+
+    @staticmethod
+    def check_key(encrypted_file_path, master_pswd):
+        """
+        Check master_pswd against the header of encrypted_file_path without decrypting it.
+        Returns True or False, or None if the file has no header.
+        """
+        with open(encrypted_file_path, 'rb', buffering=0) as efile:
+            pos = efile.tell()
+            file_pswd = CipherBackend._read_file_pswd(efile, master_pswd)
+            if efile.tell() == pos: return None
+        return file_pswd != False
+
+    @staticmethod
+    def read_file_key(encrypted_file_path, master_pswd):
+        """
+        Returns the password of the data of encrypted_file_path (after the first line),
+        with which openssl command can decrypt it. Returns None if master_pswd is wrong.
+        """
+        with open(encrypted_file_path, 'rb', buffering=0) as efile:
+            file_pswd = CipherBackend._read_file_pswd(efile, master_pswd)
+        return file_pswd if file_pswd != False else None
+
+    @staticmethod
+    def rotate_key(encrypted_file_path, old_pswd, new_pswd):
+        """
+        Change master password of encrypted_file_path by rewriting its envelope header in place,
+        so that it takes the same time regardless of the file size. The new header has the kdf spec of this machine.
+        Returns True if succeeded, False if old_pswd is wrong,
+        or None if the file has no envelope header (the data has to be encrypted again).
+        """
+        with open(encrypted_file_path, 'r+b', buffering=0) as efile:
+            envelope = CipherBackend.read_envelope_header(efile)
+            if envelope == None: return None
+            file_key = CipherBackend.unwrap_file_key(old_pswd, envelope)
+            if file_key == None: return False
+            efile.seek(0)
+            efile.write(CipherBackend.wrap_file_key(new_pswd, file_key))
+            os.fsync(efile.fileno())
+        return True
+
+    @staticmethod
+    def open_encrypted_file(encrypted_file_path, master_pswd):
+        """
+        Open encrypted_file_path (unbuffered, so that its position can be passed to openssl), skip its header
+        and returns (file object, password of the data).
+        Raises DecryptError at once if master_pswd is rejected by the header.
+        """
+        efile = open(encrypted_file_path, 'rb', buffering=0)
+        try:
+            file_pswd = CipherBackend._read_file_pswd(efile, master_pswd)
+        except BaseException:
+            efile.close()
+            raise
+        if file_pswd == False:
+            efile.close()
+            raise DecryptError('wrong password')
+        return efile, file_pswd
+
+    @staticmethod
+    def is_base64_format(output_format):
+        """Whether output_format (DEFAULT_FORMAT if None) is BASE64_FORMAT."""
+        if output_format == None: output_format = CipherBackend.DEFAULT_FORMAT
+        return output_format == CipherBackend.BASE64_FORMAT
+
+    def encrypt_file(self, raw_file_path, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        """
+        Encrypt raw_file_path to encrypted_file_path. Returns True if succeeded.
+        output_format is BINARY_FORMAT or BASE64_FORMAT (DEFAULT_FORMAT if None).
+        If key_check is False, envelope header is not written and the output is exactly the one of openssl.
+        """
+        raise NotImplementedError
+
+    def decrypt_file(self, encrypted_file_path, master_pswd, raw_file_path):
+        """
+        Decrypt encrypted_file_path to raw_file_path. Returns True if succeeded.
+        If the password is rejected by the header, returns False without creating raw_file_path.
+        All backends raise OperationTimeout (without partial output) if the deadline (see executor.Deadline) passes.
+        """
+        raise NotImplementedError
+
+    def decrypt_bytes(self, encrypted_file_path, master_pswd):
+        """Decrypt encrypted_file_path and returns decrypted bytes, or None if failed."""
+        raise NotImplementedError
+
+    def open_encrypt_stream(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        """
+        Returns EncryptStream. Plaintext written to the stream is encrypted into encrypted_file_path
+        with bounded buffers, so that no plaintext needs to be written to disk.
+        """
+        raise NotImplementedError
+
+    def open_decrypt_stream(self, master_pswd, encrypted_file_path):
+        """
+        Returns DecryptStream of plaintext of encrypted_file_path which is decrypted while it is read.
+        Raises DecryptError at once if the password is rejected by the header.
+        Otherwise wrong password may be noticed only at the end of the file, and read() raises DecryptError then.
+        """
+        raise NotImplementedError
+
+class _KeyScope:
+
+    def __enter__(self):
+        with CipherBackend._KDF_LOCK:
+            if CipherBackend._SCOPE_COUNT == 0: CipherBackend._SCOPE_CACHE = KeyCache()
+            CipherBackend._SCOPE_COUNT += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with CipherBackend._KDF_LOCK:
+            CipherBackend._SCOPE_COUNT -= 1
+            if CipherBackend._SCOPE_COUNT == 0:
+                CipherBackend._SCOPE_CACHE.clear()
+                CipherBackend._SCOPE_CACHE = None
+        return False
+
+class DecryptError(Exception):
+    """Raised from DecryptStream when encrypted file can not be decrypted (e.g. wrong password)."""
+    pass
+
+class DecryptStream(io.RawIOBase):
+    """
+    Readable stream returned by CipherBackend.open_decrypt_stream.
+    Subclasses implement _next_chunk() which returns b'' at the end.
+    Time spent in decryption is recorded as Metrics.CIPHER when the stream is closed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buf = b''
+        self._eof = False
+        self._timer = Metrics.timer(Metrics.CIPHER, op='decrypt_stream')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buf) == 0 and self._eof == False:
+            try:
+                with self._timer.measure():
+                    self._buf = self._next_chunk()
+            except DecryptError:
+                self._timer.ok = False
+                raise
+            self._timer.add_bytes(len(self._buf))
+            if len(self._buf) == 0: self._eof = True
+        size = min(len(b), len(self._buf))
+        b[:size] = self._buf[:size]
+        self._buf = self._buf[size:]
+        return size
+
+    def _next_chunk(self):
+        raise NotImplementedError
+
+    def close(self):
+        self._timer.close()
+        super().close()
+
+class EncryptStream(io.RawIOBase):
+    """
+    Writable stream returned by CipherBackend.open_encrypt_stream.
+    After close(), succeeded tells whether encryption has finished properly.
+    If it has not (or abort() is called, or the deadline passes), the encrypted output is removed.
+    Time spent in encryption is recorded as Metrics.CIPHER when the stream is closed.
+    """
+
+    def __init__(self, encrypted_file_path):
+        super().__init__()
+        self.encrypted_file_path = encrypted_file_path
+        self.succeeded = False
+        self._timer = Metrics.timer(Metrics.CIPHER, op='encrypt_stream')
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        Deadline.check()
+        with self._timer.measure():
+            self._write(bytes(data))
+        self._timer.add_bytes(len(data))
+        return len(data)
+
+    def close(self):
+        if self.closed: return
+        try:
+            with self._timer.measure():
+                self.succeeded = self._finish()
+        finally:
+            super().close()
+            if self.succeeded == False: self._remove_output()
+            self._timer.close(self.succeeded)
+
+    def abort(self):
+        """Stop encryption and remove the output."""
+        if self.closed: return
+        try:
+            self._abort()
+        finally:
+            super().close()
+            self._remove_output()
+            self._timer.close(False)
+
+    def _remove_output(self):
+        if os.path.exists(self.encrypted_file_path): os.remove(self.encrypted_file_path)
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _abort(self):
+        raise NotImplementedError
+
+class OpensslBackend(CipherBackend):
+    """Backend that spawns openssl command for each operation."""
+    name = 'openssl'
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def encrypt_file(self, raw_file_path, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        base64_flg = CipherBackend.is_base64_format(output_format)
+        if key_check == False:
+            args = CommandExecutor.build_openssl_args('-e', raw_file_path, master_pswd, encrypted_file_path, base64_flg)
+            return OpensslBackend._run(args, out_path=encrypted_file_path) != None
+        if os.path.exists(raw_file_path) == False: return False
+        header, file_pswd = CipherBackend.create_file_header(master_pswd)
+        args = CommandExecutor.build_openssl_args('-e', raw_file_path, file_pswd, None, base64_flg)
+        # openssl appends its output to the header
+        try:
+            with open(encrypted_file_path, 'wb') as efile:
+                efile.write(header)
+                efile.flush()
+                res = OpensslBackend._run(args, stdout_file=efile) != None
+        except OSError:
+            return False
+        except OperationTimeout:
+            os.remove(encrypted_file_path)
+            raise
+        if res == False: os.remove(encrypted_file_path)
+        return res
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_file(self, encrypted_file_path, master_pswd, raw_file_path):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        except (OSError, DecryptError):
+            return False
+        with efile:
+            args = OpensslBackend._build_decrypt_args(efile, file_pswd, raw_file_path)
+            return OpensslBackend._run(args, stdin_file=efile, out_path=raw_file_path) != None
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_bytes(self, encrypted_file_path, master_pswd):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        except (OSError, DecryptError):
+            return None
+        with efile:
+            args = OpensslBackend._build_decrypt_args(efile, file_pswd)
+            return OpensslBackend._run(args, stdin_file=efile)
+
+    def open_encrypt_stream(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        return _OpensslEncryptStream(master_pswd, encrypted_file_path, output_format, key_check)
+
+    def open_decrypt_stream(self, master_pswd, encrypted_file_path):
+        return _OpensslDecryptStream(master_pswd, encrypted_file_path)
+
+    @staticmethod
+    def _build_decrypt_args(efile, file_pswd, raw_file_path=None):
+        """
+        Build argv list of openssl for decrypting file object efile from its current position (given to stdin)
+        with password of its data.
+        """
+        base64_flg = CipherBackend._detect_format_of_file(efile) == CipherBackend.BASE64_FORMAT
+        return CommandExecutor.build_openssl_args('-d', None, file_pswd, raw_file_path, base64_flg)
+
+    @staticmethod
+    def _run(args, stdin_file=None, stdout_file=None, out_path=None):
+        """
+        Run openssl and returns stdout bytes (b'' if stdout_file is given) if succeeded, else None.
+        out_path (-out of args) is removed if openssl is killed at the deadline.
+        """
+        try:
+            result = CommandExecutor.run(args, stdin_file=stdin_file, stdout_file=stdout_file)
+        except OperationTimeout:
+            if out_path != None and os.path.exists(out_path): os.remove(out_path)
+            raise
+        if result.succeeded: return result.stdout_bytes
+        if sys.flags.debug: print('[error]: ' + result.stderr_bytes.decode('utf-8', 'replace'))
+        return None
+
+class _OpensslEncryptStream(EncryptStream):
+    """EncryptStream which pipes plaintext into stdin of openssl."""
+
+    def __init__(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        super().__init__(encrypted_file_path)
+        header, file_pswd = CipherBackend.create_file_header(master_pswd, key_check)
+        args = CommandExecutor.build_openssl_args('-e', None, file_pswd, None,
+                CipherBackend.is_base64_format(output_format))
+        if sys.flags.debug: print(' '.join(args))
+        # openssl appends its output to the header. The file is closed here since openssl has its own descriptor.
+        with open(encrypted_file_path, 'wb') as efile:
+            efile.write(header)
+            efile.flush()
+            with Metrics.stage(Metrics.SPAWN, command=CommandExecutor.OPENSSL):
+                self._proc = sps.Popen(args, stdin=sps.PIPE, stdout=efile, stderr=sps.PIPE)
+        # openssl which stops reading stdin would block write() forever
+        self._watcher = Deadline.watch(self._proc)
+
+    def _write(self, data):
+        try:
+            self._proc.stdin.write(data)
+        except BrokenPipeError:
+            if self._watcher.expired: raise OperationTimeout('openssl did not finish before the deadline')
+            raise
+
+    def _finish(self):
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr_bytes = self._proc.stderr.read()
+        self._proc.wait()
+        self._watcher.cancel()
+        if self._watcher.expired: raise OperationTimeout('openssl did not finish before the deadline')
+        if self._proc.returncode != 0 and sys.flags.debug: print('[error]: ' + stderr_bytes.decode('utf-8', 'replace'))
+        return self._proc.returncode == 0
+
+    def _abort(self):
+        self._watcher.cancel()
+        self._proc.kill()
+        self._proc.wait()
+
+class _OpensslDecryptStream(DecryptStream):
+    """DecryptStream reading stdout of openssl."""
+
+    def __init__(self, master_pswd, encrypted_file_path):
+        super().__init__()
+        efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        with efile:
+            args = OpensslBackend._build_decrypt_args(efile, file_pswd)
+            if sys.flags.debug: print(' '.join(args))
+            # stderr goes to a file so that openssl never blocks on it while stdout is read
+            self._stderr_file = tempfile.TemporaryFile()
+            with Metrics.stage(Metrics.SPAWN, command=CommandExecutor.OPENSSL):
+                self._proc = sps.Popen(args, stdin=efile, stdout=sps.PIPE, stderr=self._stderr_file)
+        self._watcher = Deadline.watch(self._proc)
+
+    def _next_chunk(self):
+        chunk = self._proc.stdout.read(CryptographyBackend.CHUNK_SIZE)
+        if len(chunk) > 0: return chunk
+        self._proc.wait()
+        if self._watcher.expired: raise OperationTimeout('openssl did not finish before the deadline')
+        if self._proc.returncode != 0:
+            self._stderr_file.seek(0)
+            raise DecryptError(self._stderr_file.read().decode('utf-8', 'replace'))
+        return b''
+
+    def close(self):
+        if self.closed: return
+        self._watcher.cancel()
+        if self._proc.poll() == None: self._proc.kill()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._stderr_file.close()
+        super().close()
+
+class CryptographyBackend(CipherBackend):
+    """
+    In-process backend on top of cryptography package.
+    Key and iv are derived in the same way as "openssl enc -k" (EVP_BytesToKey, one round of KDF_DIGEST).
+    """
+    name = 'cryptography'
+    SALT_LEN = 8
+    KEY_LEN = 32
+    IV_LEN = 16
+    KDF_DIGEST = 'sha256' # same as CommandExecutor.OPENSSL_DIGEST
+    CHUNK_SIZE = 64 * 1024
+    # openssl -base64 writes lines of 64 characters, i.e. 48 bytes of binary data
+    BASE64_LINE_BYTES = 48
+
+    @staticmethod
+    def is_available():
+        return Cipher != None
+
+    @staticmethod
+    def evp_bytes_to_key(master_pswd, salt, digest=KDF_DIGEST):
+        """Derive (key, iv) from password and salt like openssl EVP_BytesToKey with one iteration."""
+        pswd_bytes = master_pswd.encode('utf-8')
+        derived, block = b'', b''
+        while len(derived) < CryptographyBackend.KEY_LEN + CryptographyBackend.IV_LEN:
+            block = hashlib.new(digest, block + pswd_bytes + salt).digest()
+            derived += block
+        return derived[:CryptographyBackend.KEY_LEN], derived[CryptographyBackend.KEY_LEN:CryptographyBackend.KEY_LEN + CryptographyBackend.IV_LEN]
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def encrypt_file(self, raw_file_path, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        if os.path.exists(raw_file_path) == False: return False
+        stream = self.open_encrypt_stream(master_pswd, encrypted_file_path, output_format, key_check)
+        try:
+            with open(raw_file_path, 'rb') as rfile:
+                shutil.copyfileobj(rfile, stream, CryptographyBackend.CHUNK_SIZE)
+        except BaseException:
+            stream.abort()
+            raise
+        stream.close()
+        return stream.succeeded
+
+    def open_encrypt_stream(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        return _CryptographyEncryptStream(master_pswd, encrypted_file_path, output_format, key_check)
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_file(self, encrypted_file_path, master_pswd, raw_file_path):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        except (OSError, DecryptError):
+            return False
+        try:
+            with efile, open(raw_file_path, 'wb') as rfile:
+                for chunk in CryptographyBackend._iter_decrypted(efile, file_pswd):
+                    rfile.write(chunk)
+        except DecryptError:
+            # do not leave partial output like openssl does
+            os.remove(raw_file_path)
+            return False
+        except BaseException:
+            if os.path.exists(raw_file_path): os.remove(raw_file_path)
+            raise
+        return True
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_bytes(self, encrypted_file_path, master_pswd):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+            with efile:
+                return b''.join(CryptographyBackend._iter_decrypted(efile, file_pswd))
+        except (OSError, DecryptError):
+            return None
+
+    def open_decrypt_stream(self, master_pswd, encrypted_file_path):
+        efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        return _IterDecryptStream(CryptographyBackend._iter_decrypted(efile, file_pswd), efile.close)
+
+    @staticmethod
+    def _iter_decrypted(efile, file_pswd):
+        """
+        Decrypt file object (binary or base64 format, after the header) with password of its data and yield decrypted chunks.
+        Files of ChunkedGcmBackend are decrypted by it, so that they can be decrypted without selecting the backend.
+        Raises DecryptError if password or file is invalid.
+        """
+        if ChunkedGcmBackend.is_chunked_file(efile):
+            yield from ChunkedGcmBackend().iter_decrypted(efile, file_pswd)
+            return
+        magic = efile.read(len(CryptographyBackend.SALT_MAGIC))
+        if magic == CryptographyBackend.SALT_MAGIC:
+            chunks = itertools.chain([magic], iter(lambda: efile.read(CryptographyBackend.CHUNK_SIZE), b''))
+        else:
+            chunks = _Base64Reader(efile, magic).iter_chunks(CryptographyBackend.CHUNK_SIZE)
+        head_len = len(CryptographyBackend.SALT_MAGIC) + CryptographyBackend.SALT_LEN
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= head_len: break
+        head, rest = head[:head_len], head[head_len:]
+        if len(head) < head_len or head.startswith(CryptographyBackend.SALT_MAGIC) == False:
+            raise DecryptError('bad magic number')
+        key, iv = CryptographyBackend.evp_bytes_to_key(file_pswd, head[len(CryptographyBackend.SALT_MAGIC):])
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        try:
+            yield unpadder.update(decryptor.update(rest))
+            for chunk in chunks:
+                Deadline.check()
+                yield unpadder.update(decryptor.update(chunk))
+            yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
+        except ValueError:
+            raise DecryptError('bad decrypt')
+
+class _IterDecryptStream(DecryptStream):
+    """DecryptStream reading from an iterator of decrypted chunks."""
+
+    def __init__(self, chunks, close_func):
+        super().__init__()
+        self._chunks = chunks
+        self._close_func = close_func
+
+    def _next_chunk(self):
+        for chunk in self._chunks:
+            if len(chunk) > 0: return chunk
+        return b''
+
+    def close(self):
+        if self.closed: return
+        # generators release their resources (e.g. worker threads) when closed
+        if hasattr(self._chunks, 'close'): self._chunks.close()
+        self._close_func()
+        super().close()
+
+class _CryptographyEncryptStream(EncryptStream):
+    """EncryptStream which encrypts in-process in the format of openssl."""
+
+    def __init__(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        super().__init__(encrypted_file_path)
+        header, file_pswd = CipherBackend.create_file_header(master_pswd, key_check)
+        salt = os.urandom(CryptographyBackend.SALT_LEN)
+        key, iv = CryptographyBackend.evp_bytes_to_key(file_pswd, salt)
+        self._encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        self._padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self._efile = open(encrypted_file_path, 'wb')
+        self._efile.write(header)
+        self._writer = _Base64Writer(self._efile) if CipherBackend.is_base64_format(output_format) else _RawWriter(self._efile)
+        self._writer.write(CryptographyBackend.SALT_MAGIC + salt)
+
+    def _write(self, data):
+        self._writer.write(self._encryptor.update(self._padder.update(data)))
+
+    def _finish(self):
+        with self._efile:
+            self._writer.write(self._encryptor.update(self._padder.finalize()) + self._encryptor.finalize())
+            self._writer.close()
+        return True
+
+    def _abort(self):
+        self._efile.close()
+
+class _RawWriter:
+    """Writes binary data as is. Counterpart of _Base64Writer."""
+
+    def __init__(self, out_file):
+        self._out_file = out_file
+
+    def write(self, data):
+        self._out_file.write(data)
+
+    def close(self):
+        pass
+
+class _Base64Writer:
+    """Writes binary data in the base64 format of openssl (64 characters per line)."""
+
+    def __init__(self, out_file):
+        self._out_file = out_file
+        self._buf = b''
+
+    def write(self, data):
+        self._buf += data
+        full_len = len(self._buf) - len(self._buf) % CryptographyBackend.BASE64_LINE_BYTES
+        if full_len == 0: return
+        lines = []
+        for i in range(0, full_len, CryptographyBackend.BASE64_LINE_BYTES):
+            lines.append(base64.b64encode(self._buf[i:i + CryptographyBackend.BASE64_LINE_BYTES]) + b'\n')
+        self._out_file.write(b''.join(lines))
+        self._buf = self._buf[full_len:]
+
+    def close(self):
+        if len(self._buf) > 0: self._out_file.write(base64.b64encode(self._buf) + b'\n')
+        self._buf = b''
+
+class _Base64Reader:
+    """Reads base64 data written by openssl (or _Base64Writer) and yields decoded chunks."""
+
+    def __init__(self, in_file, head=b''):
+        self._in_file = in_file
+        # data which has already been read from in_file
+        self._head = head
+
+    def iter_chunks(self, chunk_size):
+        rest = b''.join(self._head.split())
+        for chunk in iter(lambda: self._in_file.read(chunk_size), b''):
+            rest += b''.join(chunk.split())
+            decodable_len = len(rest) - len(rest) % 4
+            if decodable_len > 0:
+                yield base64.b64decode(rest[:decodable_len])
+                rest = rest[decodable_len:]
+        if len(rest) > 0:
+            yield base64.b64decode(rest + b'=' * (-len(rest) % 4))
+
+class ChunkedGcmBackend(CipherBackend):
+    """
+    In-process backend which encrypts files in independent chunks of AES-256-GCM,
+    so that the chunks of one file are en/decrypted in parallel by a pool of max_workers threads.
+    AESGCM releases the GIL while it en/decrypts, and chunks are given to the threads without being copied.
+    This format can not be decrypted by openssl command. After the envelope header it is:
+
+        GCM_FILE_KEY_MAGIC | salt (SALT_LEN) | chunk size (4 bytes, big endian) | chunk 0 | chunk 1 | ...
+
+    where each chunk is AES-GCM ciphertext of chunk size bytes (the last one may be shorter) followed by its tag.
+    The key is derived with the salt of each file, so the index of a chunk can be used as its nonce.
+    Since the file key of the envelope header is random, the key is derived from it by one step of HKDF (derive_file_key).
+    Files without envelope header (key_check False) start with GCM_MAGIC and their key is derived from the password
+    by PBKDF2 (derive_key).
+    The header, the index and whether the chunk is the last one are authenticated as associated data,
+    so that reordered, truncated or extended files are rejected.
+    """
+    name = 'gcm'
+    # its format is not compatible with openssl command
+    auto_selectable = False
+    GCM_MAGIC = b'EzCrGCM1'
+    GCM_FILE_KEY_MAGIC = b'EzCrGCM2'
+    GCM_MAGICS = (GCM_MAGIC, GCM_FILE_KEY_MAGIC)
+    SALT_LEN = 16
+    KEY_LEN = 32
+    NONCE_LEN = 12
+    TAG_LEN = 16
+    HEADER_LEN = len(GCM_MAGIC) + SALT_LEN + 4
+    KDF_DIGEST = 'sha256'
+    KDF_ITERATIONS = 100000
+    HKDF_INFO = b'EasyCrypt gcm data key'
+    DEFAULT_CHUNK_SIZE = 1024 * 1024
+    # chunks on the fly per worker thread, which bounds memory usage
+    PENDING_CHUNKS_PER_WORKER = 2
+
+    def __init__(self, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if max_workers == None: max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def is_available():
+        return Cipher != None
+
+    @staticmethod
+    def is_chunked_file(efile):
+        """Whether file object efile (binary or base64 format) is in the format of this backend. Its position is kept."""
+        pos = efile.tell()
+        # 12 characters of base64 are 9 bytes, which include whole GCM_MAGIC
+        head = efile.read(12)
+        efile.seek(pos)
+        if head.startswith(ChunkedGcmBackend.GCM_MAGICS): return True
+        try:
+            return base64.b64decode(head).startswith(ChunkedGcmBackend.GCM_MAGICS)
+        except (binascii.Error, ValueError):
+            return False
+
+    @staticmethod
+    def derive_key(master_pswd, salt):
+        """Key of files starting with GCM_MAGIC. It is not kept in KEY_CACHE since the salt differs in each file."""
+        return hashlib.pbkdf2_hmac(ChunkedGcmBackend.KDF_DIGEST, master_pswd.encode('utf-8'), salt,
+                ChunkedGcmBackend.KDF_ITERATIONS, ChunkedGcmBackend.KEY_LEN)
+
+    @staticmethod
+    def derive_file_key(file_pswd, salt):
+        """
+        Key of files starting with GCM_FILE_KEY_MAGIC, derived from the random file key of the envelope header
+        (file_pswd, see file_key_pswd) by HKDF-SHA256 (RFC 5869) which needs only one block of output.
+        """
+        prk = hmac.new(salt, binascii.unhexlify(file_pswd), hashlib.sha256).digest()
+        return hmac.new(prk, ChunkedGcmBackend.HKDF_INFO + b'\x01', hashlib.sha256).digest()[:ChunkedGcmBackend.KEY_LEN]
+
+    @staticmethod
+    def chunk_nonce_and_aad(header, index, last_flg):
+        """Nonce and associated data of index-th chunk of the file with header."""
+        nonce = index.to_bytes(ChunkedGcmBackend.NONCE_LEN, 'big')
+        return nonce, header + nonce + (b'\x01' if last_flg else b'\x00')
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def encrypt_file(self, raw_file_path, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        if os.path.exists(raw_file_path) == False: return False
+        stream = self.open_encrypt_stream(master_pswd, encrypted_file_path, output_format, key_check)
+        try:
+            with open(raw_file_path, 'rb') as rfile:
+                shutil.copyfileobj(rfile, stream, self.chunk_size)
+        except BaseException:
+            stream.abort()
+            raise
+        stream.close()
+        return stream.succeeded
+
+    def open_encrypt_stream(self, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        return _GcmEncryptStream(self, master_pswd, encrypted_file_path, output_format, key_check)
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_file(self, encrypted_file_path, master_pswd, raw_file_path):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        except (OSError, DecryptError):
+            return False
+        try:
+            with efile, open(raw_file_path, 'wb') as rfile:
+                for chunk in self.iter_decrypted(efile, file_pswd):
+                    rfile.write(chunk)
+        except DecryptError:
+            os.remove(raw_file_path)
+            return False
+        except BaseException:
+            if os.path.exists(raw_file_path): os.remove(raw_file_path)
+            raise
+        return True
+
+    @Metrics.timed(Metrics.CIPHER, path_arg=1)
+    def decrypt_bytes(self, encrypted_file_path, master_pswd):
+        try:
+            efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+            with efile:
+                return b''.join(self.iter_decrypted(efile, file_pswd))
+        except (OSError, DecryptError):
+            return None
+
+    def open_decrypt_stream(self, master_pswd, encrypted_file_path):
+        efile, file_pswd = CipherBackend.open_encrypted_file(encrypted_file_path, master_pswd)
+        return _IterDecryptStream(self.iter_decrypted(efile, file_pswd), efile.close)
+
+    def iter_decrypted(self, efile, file_pswd):
+        """
+        Decrypt file object (binary or base64 format, after the header) with password of its data
+        and yield decrypted chunks in order.
+        Raises DecryptError if password or file is invalid.
+        """
+        pos = efile.tell()
+        base64_flg = efile.read(len(ChunkedGcmBackend.GCM_MAGIC)) not in ChunkedGcmBackend.GCM_MAGICS
+        efile.seek(pos)
+        if base64_flg:
+            reader = _ExactReader(_Base64Reader(efile).iter_chunks(CryptographyBackend.CHUNK_SIZE))
+        else:
+            reader = _ExactReader(iter(lambda: efile.read(CryptographyBackend.CHUNK_SIZE), b''))
+        header = reader.read(ChunkedGcmBackend.HEADER_LEN)
+        if len(header) < ChunkedGcmBackend.HEADER_LEN or header.startswith(ChunkedGcmBackend.GCM_MAGICS) == False:
+            raise DecryptError('bad magic number')
+        salt = header[len(ChunkedGcmBackend.GCM_MAGIC):len(ChunkedGcmBackend.GCM_MAGIC) + ChunkedGcmBackend.SALT_LEN]
+        chunk_size = struct.unpack('>I', header[-4:])[0]
+        if header.startswith(ChunkedGcmBackend.GCM_FILE_KEY_MAGIC):
+            try:
+                key = ChunkedGcmBackend.derive_file_key(file_pswd, salt)
+            except (binascii.Error, ValueError):
+                # not a file key of envelope header
+                raise DecryptError('bad decrypt')
+        else:
+            key = ChunkedGcmBackend.derive_key(file_pswd, salt)
+        aead = AESGCM(key)
+        record_len = chunk_size + ChunkedGcmBackend.TAG_LEN
+        pool = _OrderedPool(self.max_workers, self.max_workers * ChunkedGcmBackend.PENDING_CHUNKS_PER_WORKER)
+        try:
+            index = 0
+            record = reader.read(record_len)
+            while True:
+                # the last chunk is the one which is followed by nothing
+                next_record = reader.read(record_len) if len(record) == record_len else b''
+                last_flg = len(next_record) == 0
+                if len(record) < ChunkedGcmBackend.TAG_LEN: raise DecryptError('truncated file')
+                Deadline.check()
+                nonce, aad = ChunkedGcmBackend.chunk_nonce_and_aad(header, index, last_flg)
+                submit = pool.submit_last if last_flg else pool.submit
+                for chunk in submit(_gcm_decrypt_chunk, aead, nonce, aad, record):
+                    if chunk == None: raise DecryptError('bad decrypt')
+                    yield chunk
+                if last_flg: break
+                record = next_record
+                index += 1
+        finally:
+            pool.shutdown()
+
+def _gcm_encrypt_chunk(aead, nonce, aad, data):
+    """Encrypt one chunk of ChunkedGcmBackend with AESGCM aead, which can be shared among threads."""
+    return aead.encrypt(nonce, data, aad)
+
+def _gcm_decrypt_chunk(aead, nonce, aad, data):
+    """Decrypt one chunk of ChunkedGcmBackend. Returns None if it is not authentic (e.g. wrong password)."""
+    try:
+        return aead.decrypt(nonce, data, aad)
+    except InvalidTag:
+        return None
+
+class _OrderedPool:
+    """
+    Runs jobs on a thread pool, which is created when the second job is given, and returns results in order.
+    At most max_pending jobs are on the fly, so that memory usage is bounded for files of any size.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self._max_workers = max_workers
+        self._max_pending = max(max_pending, 1)
+        self._pool = None
+        self._pending = deque()
+
+    def submit(self, func, *args):
+        """Schedule job and returns list of results which are ready in order (possibly empty)."""
+        if self._max_workers <= 1: return [func(*args)]
+        if self._pool == None: self._pool = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._pending.append(self._pool.submit(func, *args))
+        results = []
+        while len(self._pending) >= self._max_pending:
+            results.append(self._pending.popleft().result())
+        return results
+
+    def submit_last(self, func, *args):
+        """Run the last job and returns all remaining results. A single job is run in this thread."""
+        if self._pool == None: return [func(*args)]
+        results = self.submit(func, *args)
+        while len(self._pending) > 0:
+            results.append(self._pending.popleft().result())
+        return results
+
+    def shutdown(self):
+        for future in self._pending: future.cancel()
+        self._pending.clear()
+        if self._pool != None: self._pool.shutdown(wait=True)
+        self._pool = None
+
+class _ExactReader:
+    """Reads exactly requested size (less only at the end) from an iterator of chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buf = bytearray()
+
+    def read(self, size):
+        while len(self._buf) < size:
+            chunk = next(self._chunks, b'')
+            if len(chunk) == 0: break
+            self._buf += chunk
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+class _GcmEncryptStream(EncryptStream):
+    """EncryptStream of ChunkedGcmBackend. Full chunks are encrypted on worker threads while more data is written."""
+
+    def __init__(self, backend, master_pswd, encrypted_file_path, output_format=None, key_check=True):
+        super().__init__(encrypted_file_path)
+        header, file_pswd = CipherBackend.create_file_header(master_pswd, key_check)
+        salt = os.urandom(ChunkedGcmBackend.SALT_LEN)
+        if key_check:
+            key = ChunkedGcmBackend.derive_file_key(file_pswd, salt)
+            magic = ChunkedGcmBackend.GCM_FILE_KEY_MAGIC
+        else:
+            key = ChunkedGcmBackend.derive_key(file_pswd, salt)
+            magic = ChunkedGcmBackend.GCM_MAGIC
+        self._aead = AESGCM(key)
+        self._chunk_size = backend.chunk_size
+        self._header = magic + salt + struct.pack('>I', self._chunk_size)
+        self._index = 0
+        self._buf = bytearray()
+        self._pool = _OrderedPool(backend.max_workers, backend.max_workers * ChunkedGcmBackend.PENDING_CHUNKS_PER_WORKER)
+        self._efile = open(encrypted_file_path, 'wb')
+        self._efile.write(header)
+        self._writer = _Base64Writer(self._efile) if CipherBackend.is_base64_format(output_format) else _RawWriter(self._efile)
+        self._writer.write(self._header)
+
+    def _write(self, data):
+        self._buf += data
+        # a chunk is sent only when more data follows, since the last chunk is marked
+        while len(self._buf) > self._chunk_size:
+            chunk = bytes(self._buf[:self._chunk_size])
+            del self._buf[:self._chunk_size]
+            self._write_records(self._pool.submit(_gcm_encrypt_chunk, *self._next_chunk_args(chunk, False)))
+
+    def _next_chunk_args(self, chunk, last_flg):
+        nonce, aad = ChunkedGcmBackend.chunk_nonce_and_aad(self._header, self._index, last_flg)
+        self._index += 1
+        return self._aead, nonce, aad, chunk
+
+    def _write_records(self, records):
+        for record in records: self._writer.write(record)
+
+    def _finish(self):
+        try:
+            with self._efile:
+                self._write_records(self._pool.submit_last(_gcm_encrypt_chunk, *self._next_chunk_args(bytes(self._buf), True)))
+                self._writer.close()
+        finally:
+            self._pool.shutdown()
+        return True
+
+    def _abort(self):
+        self._pool.shutdown()
+        self._efile.close()
+
+class BackendRegistry:
+    """
+    Registry of cipher backends which can be selected by name.
+    'auto' selects the first available backend whose auto_selectable is True in registration order,
+    so that in-process backend is used if possible and openssl command is kept as a fallback.
+    """
+    AUTO = 'auto'
+    BACKENDS = OrderedDict()
+    DEFAULT_BACKEND = AUTO
+
+    @staticmethod
+    def register(backend_cls, name=None):
+        """Register backend class with its name (backend_cls.name if None)."""
+        if name == None: name = backend_cls.name
+        BackendRegistry.BACKENDS[name] = backend_cls
+
+    @staticmethod
+    def names():
+        """Names of registered backends including 'auto'."""
+        return [BackendRegistry.AUTO] + list(BackendRegistry.BACKENDS.keys())
+
+    @staticmethod
+    def get(name=None):
+        """
+        Returns backend instance of given name (DEFAULT_BACKEND if None).
+        A CipherBackend instance is returned as is.
+        Returns None if the backend is unknown or not available.
+        """
+        if isinstance(name, CipherBackend): return name
+        if name == None: name = BackendRegistry.DEFAULT_BACKEND
+        if name == BackendRegistry.AUTO:
+            for backend_cls in BackendRegistry.BACKENDS.values():
+                if backend_cls.auto_selectable and backend_cls.is_available(): return backend_cls()
+            return None
+        backend_cls = BackendRegistry.BACKENDS.get(name)
+        if backend_cls == None or backend_cls.is_available() == False:
+            if sys.flags.debug: print('Backend {0} is not available.'.format(name))
+            return None
+        return backend_cls()
+
+BackendRegistry.register(CryptographyBackend)
+BackendRegistry.register(OpensslBackend)
+BackendRegistry.register(ChunkedGcmBackend)
@@ -0,0 +1,225 @@
+# coding:utf-8
+import os, sys, json, uuid, hashlib
+from executor import CommandExecutor
+from cipher_backend import BackendRegistry, CipherBackend
+from tree_walker import TreeWalker
+
+class DirContainer:
+    """
+    Updatable container of an encrypted directory.
+
+    A container is a directory which has an encrypted manifest (MANIFEST_NAME) and
+    one encrypted object file per file of the original directory:
+
+        <dir>.encdir/manifest.enc
+        <dir>.encdir/objects/<random id>.enc
+
+    The manifest records path, size, mtime, sha256 and object id of every file,
+    so that update() re-encrypts only the files which have been changed since the last run,
+    and extract() decrypts only the requested members (in time proportional to their size).
+    Names of object files are random and do not reveal original paths.
+    """
+    CONTAINER_EXT = '.encdir'
+    MANIFEST_NAME = 'manifest.enc'
+    OBJECTS_DIR_NAME = 'objects'
+    OBJECT_EXT = '.enc'
+    MANIFEST_VERSION = 1
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def manifest_path(container_path):
+        return os.path.join(container_path, DirContainer.MANIFEST_NAME)
+
+    @staticmethod
+    def object_path(container_path, object_id):
+        return os.path.join(container_path, DirContainer.OBJECTS_DIR_NAME, object_id + DirContainer.OBJECT_EXT)
+
+    @staticmethod
+    def file_hash(file_path):
+        """sha256 hex digest of the content of file_path."""
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as rfile:
+            for chunk in iter(lambda: rfile.read(DirContainer.HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def read_manifest(container_path, master_pswd, backend=None):
+        """
+        Decrypt and return manifest dict of container_path.
+        Returns empty manifest if there is no container yet, and None if it can not be decrypted (e.g. wrong password).
+        """
+        manifest_path = DirContainer.manifest_path(container_path)
+        if os.path.exists(manifest_path) == False:
+            return {'version': DirContainer.MANIFEST_VERSION, 'files': {}}
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return None
+        manifest_bytes = cipher_backend.decrypt_bytes(manifest_path, master_pswd)
+        if manifest_bytes == None: return None
+        try:
+            return json.loads(manifest_bytes.decode('utf-8'))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def write_manifest(container_path, manifest, master_pswd, backend=None):
+        """Encrypt manifest dict to container_path. The old manifest is replaced atomically."""
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        manifest_path = DirContainer.manifest_path(container_path)
+        tmp_manifest_path = manifest_path + '.tmp'
+        enc_stream = cipher_backend.open_encrypt_stream(master_pswd, tmp_manifest_path)
+        try:
+            enc_stream.write(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+        except BaseException:
+            enc_stream.abort()
+            raise
+        enc_stream.close()
+        if enc_stream.succeeded == False: return False
+        os.replace(tmp_manifest_path, manifest_path)
+        return True
+
+    @staticmethod
+    def scan_dir(raw_dir_path, ignore_hidden_files=True, walker=None):
+        """
+        Returns dict of relative path (separated by '/') -> os.stat_result of files under raw_dir_path.
+        walker is a TreeWalker which selects files (all files except hidden ones if ignore_hidden_files) if None.
+        """
+        if walker == None: walker = TreeWalker(ignore_hidden_files=ignore_hidden_files)
+        return walker.scan(raw_dir_path)
+
+    @staticmethod
+    @CipherBackend.key_scoped
+    def update(raw_dir_path, container_path, master_pswd, backend=None, executor=None, ignore_hidden_files=True,
+            output_format=None, walker=None):
+        """
+        Encrypt files of raw_dir_path which were added or changed since the last update into container_path,
+        and remove objects of deleted files. Files whose size and mtime are unchanged are skipped without reading,
+        and files whose content hash is unchanged are not re-encrypted.
+        output_format is the format of new objects (binary or base64, see CipherBackend).
+        walker is a TreeWalker which selects files to encrypt. Files which are not walked are removed from the container.
+        Returns dict of lists of relative paths ('added', 'updated', 'removed', 'unchanged'), or None if failed.
+        """
+        if os.path.isdir(raw_dir_path) == False: return None
+        manifest = DirContainer.read_manifest(container_path, master_pswd, backend)
+        if manifest == None: return None
+        old_files = manifest['files']
+        new_files = {}
+        summary = {'added': [], 'updated': [], 'removed': [], 'unchanged': []}
+        to_encrypt = []
+        for rel_path, stat in sorted(DirContainer.scan_dir(raw_dir_path, ignore_hidden_files, walker).items()):
+            old_entry = old_files.get(rel_path)
+            if old_entry != None and old_entry['size'] == stat.st_size and old_entry['mtime_ns'] == stat.st_mtime_ns:
+                new_files[rel_path] = old_entry
+                summary['unchanged'].append(rel_path)
+                continue
+            file_path = os.path.join(raw_dir_path, *rel_path.split('/'))
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': DirContainer.file_hash(file_path)}
+            if old_entry != None and old_entry['sha256'] == entry['sha256']:
+                # only metadata has been changed
+                entry['object'] = old_entry['object']
+                new_files[rel_path] = entry
+                summary['unchanged'].append(rel_path)
+                continue
+            # changed files get new objects, so that the old container stays valid until the manifest is replaced
+            entry['object'] = uuid.uuid4().hex
+            new_files[rel_path] = entry
+            summary['added' if old_entry == None else 'updated'].append(rel_path)
+            to_encrypt.append((file_path, entry['object']))
+        summary['removed'] = sorted(set(old_files.keys()) - set(new_files.keys()))
+
+        os.makedirs(os.path.join(container_path, DirContainer.OBJECTS_DIR_NAME), exist_ok=True)
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return None
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [executor.submit_func(cipher_backend.encrypt_file, file_path, master_pswd,
+                    DirContainer.object_path(container_path, object_id), output_format) for file_path, object_id in to_encrypt]
+            results = [future.result() for future in futures]
+        finally:
+            if own_executor: executor.shutdown()
+        if False in results or DirContainer.write_manifest(container_path, {'version': DirContainer.MANIFEST_VERSION,
+                'files': new_files}, master_pswd, backend) == False:
+            # remove new objects and keep the old container
+            for file_path, object_id in to_encrypt:
+                object_path = DirContainer.object_path(container_path, object_id)
+                if os.path.exists(object_path): os.remove(object_path)
+            return None
+        # objects which are no longer referenced
+        used_objects = set(entry['object'] for entry in new_files.values())
+        for entry in old_files.values():
+            if entry['object'] not in used_objects:
+                object_path = DirContainer.object_path(container_path, entry['object'])
+                if os.path.exists(object_path): os.remove(object_path)
+        if sys.flags.debug: print(summary)
+        return summary
+
+    @staticmethod
+    @CipherBackend.key_scoped
+    def restore(container_path, dst_dir_path, master_pswd, backend=None, executor=None):
+        """
+        Decrypt all files of container_path into dst_dir_path (which must not exist) with their mtime.
+        Returns True if succeeded. If the password is wrong, returns False without creating dst_dir_path.
+        """
+        if os.path.exists(dst_dir_path): return False
+        if os.path.exists(DirContainer.manifest_path(container_path)) == False: return False
+        manifest = DirContainer.read_manifest(container_path, master_pswd, backend)
+        if manifest == None: return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        os.makedirs(dst_dir_path)
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [executor.submit_func(DirContainer._restore_file, cipher_backend, container_path, dst_dir_path,
+                    rel_path, entry, master_pswd) for rel_path, entry in manifest['files'].items()]
+            results = [future.result() for future in futures]
+        finally:
+            if own_executor: executor.shutdown()
+        return False not in results
+
+    @staticmethod
+    def list_files(container_path, master_pswd, backend=None, manifest=None):
+        """
+        Returns sorted list of (relative path, size) of files in container_path, or None if failed.
+        manifest can be given if it has already been read.
+        """
+        if manifest == None:
+            if os.path.exists(DirContainer.manifest_path(container_path)) == False: return None
+            manifest = DirContainer.read_manifest(container_path, master_pswd, backend)
+        if manifest == None: return None
+        return sorted((rel_path, entry['size']) for rel_path, entry in manifest['files'].items())
+
+    @staticmethod
+    @CipherBackend.key_scoped
+    def extract(container_path, member_path, dst_dir_path, master_pswd, backend=None, manifest=None):
+        """
+        Decrypt only the file member_path (relative path separated by '/'), or files under the directory member_path,
+        from container_path into dst_dir_path keeping their relative paths. Existing files are not overwritten.
+        manifest can be given if it has already been read.
+        Returns True if succeeded, False if there is no such member or it can not be decrypted.
+        """
+        if manifest == None: manifest = DirContainer.read_manifest(container_path, master_pswd, backend)
+        if manifest == None: return False
+        member_path = member_path.replace(os.sep, '/').strip('/')
+        entries = [(rel_path, entry) for rel_path, entry in manifest['files'].items()
+                if rel_path == member_path or rel_path.startswith(member_path + '/')]
+        if len(entries) == 0: return False
+        for rel_path, entry in entries:
+            if os.path.exists(os.path.join(dst_dir_path, *rel_path.split('/'))): return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        for rel_path, entry in entries:
+            if DirContainer._restore_file(cipher_backend, container_path, dst_dir_path, rel_path, entry, master_pswd) == False:
+                return False
+        return True
+
+    @staticmethod
+    def _restore_file(cipher_backend, container_path, dst_dir_path, rel_path, entry, master_pswd):
+        raw_file_path = os.path.join(dst_dir_path, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(raw_file_path), exist_ok=True)
+        if cipher_backend.decrypt_file(DirContainer.object_path(container_path, entry['object']), master_pswd, raw_file_path) == False:
+            return False
+        os.utime(raw_file_path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        return True
@@ -1,8 +1,11 @@
 # !/usr/bin/python
 # -*- coding: utf-8 -*-
-import os, sys, getpass, random, string, json
-import subprocess as sps
+import os, sys, io, getpass, random, string, json, shutil, functools, itertools
 from zip_util import ZipUtil
+from executor import CommandExecutor, Deadline
+from cipher_backend import BackendRegistry, CipherBackend, DecryptError
+from dir_container import DirContainer
+from metrics import Metrics
 
 # for python3
 class EasyCrypt:
@@ -19,16 +22,34 @@ class EasyCrypt:
     and make sure the command properly works from command prompt.
 
     If you use python debug flag (-d), some of the outputs of this script are printed.
+
+    Functions which en/decrypt take keyword argument timeout (seconds). If they do not finish in time,
+    openssl processes are killed, partial outputs are removed and OperationTimeout (executor.py) is raised.
+    Functions which ask password until it is correct take max_attempts, after which they fail as with other errors.
     """
-    # This script uses AES 256bit by default and encrypted files are exported in Base64 format.
-    OPENSSL_CMD = 'openssl aes-256-cbc {0} -base64 -in "{1}" -k "{2}"'
-    OPENSSL_CMD_WITH_OUTPUT = OPENSSL_CMD + ' -out "{3}"'
-    OPENSSL_CHECK_CMD = 'openssl version'
+    # This script uses AES 256bit by default and encrypted files are exported in raw binary (or Base64) format.
+    # En/decryption is done by a backend of cipher_backend.BackendRegistry (in-process if available, otherwise openssl).
+    # Commands are built as argv lists by CommandExecutor.build_openssl_args and run without shell.
+    OPENSSL_CHECK_CMD = ['openssl', 'version']
     # Extension for encrypted files. Change if any.
     ENCRYPTED_EXT = '.enc'
+    # output formats of encrypted files
+    BINARY_FORMAT = CipherBackend.BINARY_FORMAT
+    BASE64_FORMAT = CipherBackend.BASE64_FORMAT
+    # archive formats of encrypt_dir
+    ZIP_FORMAT = 'zip'
+    TAR_FORMAT = 'tar'
+    CONTAINER_FORMAT = 'encdir'
+    MIRROR_FORMAT = 'files'
+    # directory of MIRROR_FORMAT, which has the same tree as the original one with encrypted files
+    MIRROR_EXT = '.encfiles'
     # password file that created for encrypting directory
     MASTER_PASS_TXT = 'master_pass.txt'
     HEADER_VERSION = 0.1
+    # header is a json string in the first line of text file, which never gets this long
+    HEADER_MAX_LEN = 64 * 1024
+    # buffer size for streaming data into a cipher
+    STREAM_CHUNK_SIZE = 64 * 1024
 
     @staticmethod
     def create_header(master_pswd, version_dbl=HEADER_VERSION):
@@ -81,7 +102,8 @@ class EasyCrypt:
         header = EasyCrypt.read_header_of_file(raw_file_path)
         # header already exists in raw_file
         header_exists = (header != None)
-        with open(raw_file_path, 'r') as rfile, open(raw_file_with_header_path, 'w') as hdfile:
+        with Metrics.stage(Metrics.TMP_WRITE, nbytes=os.path.getsize(raw_file_path)), \
+                open(raw_file_path, 'r') as rfile, open(raw_file_with_header_path, 'w') as hdfile:
             print(header_json_str, file=hdfile)
             for line in rfile:
                 # ignore first line
@@ -92,6 +114,22 @@ class EasyCrypt:
                 print(line.rstrip(), file=hdfile)
         return True
 
+    @staticmethod
+    def _cleanup(path):
+        """Remove temporary or partial output (a file or a directory tree), recording it as Metrics.CLEANUP."""
+        with Metrics.stage(Metrics.CLEANUP):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    @staticmethod
+    def _attempts(max_attempts=None):
+        """Yield numbers of password attempts until max_attempts (forever if None) or the deadline (see Deadline)."""
+        for attempt in itertools.count() if max_attempts == None else range(max_attempts):
+            Deadline.check()
+            yield attempt
+
     @staticmethod
     def rm_ext_from_path(abs_path):
         """Remove extension from absolute path and return absolute path without extension."""
@@ -100,43 +138,30 @@ class EasyCrypt:
         return os.path.join(dirname, basename)
 
     @staticmethod
-    def exec_command(cmd_str, failed_act = None, encode='utf-8'):
+    @Deadline.bounded
+    def exec_command(cmd, failed_act = None, encode='utf-8'):
         """
-        Execute shell command, returns True if succeeded otherwise returns False.
+        Execute command (argv list or command string which is split without shell),
+        returns True if succeeded otherwise returns False.
         """
-        if sys.flags.debug: print(cmd_str)
-        result_flg = False
-        try:
-            proc = sps.Popen(cmd_str, shell=True, stderr=sps.PIPE, stdout=sps.PIPE) # these are for getting output strings
-            stdout_bytes, stderr_bytes = proc.communicate()
-            
-            # if error occurs, stderr_bytes will be > 0 length
-            if len(stderr_bytes) == 0:
-                result_flg = True
-            else:
-                if failed_act != None: failed_act()
-                if sys.flags.debug: print('[error]: ' + stderr_bytes.decode(encode))
-        except(sps.CalledProcessError):
-            print('Failed Unexpectedly. Try again.')
-        return result_flg
+        result = CommandExecutor.run(cmd)
+        if result.succeeded:
+            return True
+        if failed_act != None: failed_act()
+        if sys.flags.debug: print('[error]: ' + result.stderr_bytes.decode(encode, 'replace'))
+        return False
 
     @staticmethod
-    def exec_command_get_result(cmd_str, failed_act=None, encode='utf-8'):
-        """Execute shell command, returns stdout of result if succeeded otherwise return None or raise exception."""
-        if sys.flags.debug: print(cmd_str)
-        try:
-            proc = sps.Popen(cmd_str, shell=True, stderr=sps.PIPE, stdout=sps.PIPE) # these are for getting output strings
-            stdout_bytes, stderr_bytes = proc.communicate()
-            # if error occurs, stderr_bytes will be > 0 length
-            if len(stderr_bytes) == 0:
-                decrypted_txt = stdout_bytes.decode(encode) # may be supported only by Python3
-                if sys.flags.debug: print('[success]: ' + decrypted_txt)
-                return decrypted_txt # returns decrypted text
-            else:
-                if failed_act != None: failed_act()
-                if sys.flags.debug: print('[error]: ' + stderr_bytes.decode(encode))
-        except(sps.CalledProcessError):
-            print('Failed Unexpectedly. Try again.')
+    @Deadline.bounded
+    def exec_command_get_result(cmd, failed_act=None, encode='utf-8'):
+        """Execute command, returns stdout of result if succeeded otherwise return None."""
+        result = CommandExecutor.run(cmd)
+        if result.succeeded:
+            decrypted_txt = result.stdout_bytes.decode(encode)
+            if sys.flags.debug: print('[success]: ' + decrypted_txt)
+            return decrypted_txt # returns decrypted text
+        if failed_act != None: failed_act()
+        if sys.flags.debug: print('[error]: ' + result.stderr_bytes.decode(encode, 'replace'))
         return None
 
     @staticmethod
@@ -174,41 +199,95 @@ class EasyCrypt:
         return confirmed_pass
 
     @staticmethod
-    def encrypt_file_with_header(raw_file_path, master_pswd, encrypted_file_path=None):
+    @Deadline.bounded
+    def encrypt_file_with_header(raw_file_path, master_pswd, encrypted_file_path=None, backend=None, stream=True,
+            output_format=None):
         """
-        Encrypt file with header using openssl command.
+        Encrypt file with header using openssl command or in-process backend.
         Returns True if success, otherwise returns False.
         If encrypted_file_path is None, new file is generated in the same directory as raw_file_path.
+        If stream is True, header and body are fed directly into the cipher with bounded buffers
+        and no plaintext temporary file is written. The body is copied as is.
+        If stream is False, a temporary file with header is written next to raw_file_path and encrypted
+        (trailing whitespaces of each line are removed in this case).
         """
-        header = EasyCrypt.read_header_of_file(raw_file_path)
         header_json_str = EasyCrypt.create_header(master_pswd)
+        # if encrypted_file_path is not specified, then write to raw_file_path + '.enc'
+        if encrypted_file_path == None:
+            encrypted_file_path = raw_file_path + EasyCrypt.ENCRYPTED_EXT
+        if stream:
+            return EasyCrypt._encrypt_file_with_header_stream(raw_file_path, master_pswd, header_json_str,
+                    encrypted_file_path, backend, output_format)
         tmp_raw_file_path = raw_file_path + '.tmp'
         # create tmp file that header info is appended
-        res = False
         res = EasyCrypt.write_header_to_file(raw_file_path, header_json_str, tmp_raw_file_path)
         if res:
-            # if encrypted_file_path is not specified, then write to raw_file_path + '.enc'
-            if encrypted_file_path == None:
-                encrypted_file_path = raw_file_path + '.enc'
-                res = EasyCrypt.encrypt_file(tmp_raw_file_path, master_pswd, encrypted_file_path)
-            else:
-                res = EasyCrypt.encrypt_file(tmp_raw_file_path, master_pswd, encrypted_file_path)
-            if res: os.remove(tmp_raw_file_path)
+            try:
+                res = EasyCrypt.encrypt_file(tmp_raw_file_path, master_pswd, encrypted_file_path, backend, output_format)
+            except BaseException:
+                EasyCrypt._cleanup(tmp_raw_file_path)
+                raise
+            if res: EasyCrypt._cleanup(tmp_raw_file_path)
         return res
-    
+
+    @staticmethod
+    def _encrypt_file_with_header_stream(raw_file_path, master_pswd, header_json_str, encrypted_file_path, backend=None,
+            output_format=None):
+        """Write header and body of raw_file_path (without its old header) into encrypt stream."""
+        if os.path.exists(raw_file_path) == False: return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        with open(raw_file_path, 'rb') as rfile:
+            # a line longer than HEADER_MAX_LEN can not be a header
+            first_line = rfile.readline(EasyCrypt.HEADER_MAX_LEN)
+            enc_stream = cipher_backend.open_encrypt_stream(master_pswd, encrypted_file_path, output_format)
+            try:
+                enc_stream.write((header_json_str + os.linesep).encode('utf-8'))
+                # ignore first line if header already exists in raw_file
+                if EasyCrypt.read_header(first_line.decode('utf-8', 'replace')) == None:
+                    enc_stream.write(first_line)
+                shutil.copyfileobj(rfile, enc_stream, EasyCrypt.STREAM_CHUNK_SIZE)
+            except BaseException:
+                enc_stream.abort()
+                raise
+        enc_stream.close()
+        return enc_stream.succeeded
+
     @staticmethod
-    def encrypt_file(raw_file_path, master_pswd, encrypted_file_path=None):
+    @Deadline.bounded
+    def encrypt_file(raw_file_path, master_pswd, encrypted_file_path=None, backend=None, output_format=None):
         """
-        Encrypt file using openssl command.
+        Encrypt file using openssl command or in-process backend.
         Returns True if success, otherwise returns False.
         If encrypted_file_path is None, new file is generated in the same directory as raw_file_path.
+        backend is a name in BackendRegistry ('auto', 'cryptography', 'openssl') or a CipherBackend instance.
+        output_format is BINARY_FORMAT (default) or BASE64_FORMAT for text-safe transport.
+        Decryption detects the format by itself.
         """
         if os.path.exists(raw_file_path) == False: return False
         if encrypted_file_path == None:
             encrypted_file_path = raw_file_path + EasyCrypt.ENCRYPTED_EXT
-        cmd = EasyCrypt.OPENSSL_CMD_WITH_OUTPUT.format('-e', raw_file_path, master_pswd, encrypted_file_path)
-        res = EasyCrypt.exec_command(cmd) # if error happens, this func will raise exception
-        return res
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        return cipher_backend.encrypt_file(raw_file_path, master_pswd, encrypted_file_path, output_format)
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def encrypt_files(raw_file_paths, master_pswd, executor=None, backend=None, output_format=None):
+        """
+        Encrypt many files with the same master password over a bounded pool of workers.
+        Each file is encrypted to raw_file_path + ENCRYPTED_EXT.
+        If executor (CommandExecutor) is None, a temporary one with cpu_count workers is used.
+        Returns dict of raw_file_path -> True/False in the same order as raw_file_paths.
+        """
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [(path, executor.submit_func(EasyCrypt.encrypt_file, path, master_pswd, None, backend, output_format)) for path in raw_file_paths]
+            return dict((path, future.result()) for path, future in futures)
+        finally:
+            if own_executor: executor.shutdown()
 
     @staticmethod
     def get_master_pswd_from_txt(master_pass_file_path, pswd_input_func=lambda msg: getpass.getpass(msg)):
@@ -237,11 +316,33 @@ class EasyCrypt:
         return master_pswd
 
     @staticmethod
-    def encrypt_dir(raw_dir_path, encrypted_dir_path=None, pswd_input_func=lambda msg: getpass.getpass(msg)):
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def encrypt_dir(raw_dir_path, encrypted_dir_path=None, pswd_input_func=lambda msg: getpass.getpass(msg), backend=None,
+            stream=True, archive_format=ZIP_FORMAT, output_format=None, compression=None, walker=None):
         """
-        Encrypt directory by zip and encrypt using openssl command.
+        Encrypt directory by zip and encrypt using openssl command or in-process backend.
+        If stream is True, the zip archive is written directly into the cipher, so that plaintext archive
+        never lands on disk and zipping overlaps with encryption.
+        If stream is False, <raw_dir_path>.zip is written first and then encrypted (the zip file is left).
+        compression is a compression method of zip members (see ZipUtil.COMPRESSIONS), which are compressed in parallel.
+        walker is a TreeWalker which selects files to encrypt (include/exclude patterns, size, age and symlinks).
+        If archive_format is TAR_FORMAT, the directory is archived in tar format to <raw_dir_path>.tar.enc
+        (always streamed), which decrypt_dir can extract while decrypting it.
+        If archive_format is CONTAINER_FORMAT, files are encrypted independently into <raw_dir_path>.encdir
+        (see encrypt_dir_incremental), from which a single file can be listed and extracted.
+        If archive_format is MIRROR_FORMAT, files are encrypted in parallel into a mirrored tree <raw_dir_path>.encfiles
+        (see encrypt_dir_files).
+        The working directory is not changed, so encrypt_dir can be called for different directories
+        from many threads at the same time.
         It returns True if succeeded, otherwise returns False.
         """
+        if archive_format == EasyCrypt.CONTAINER_FORMAT:
+            return EasyCrypt.encrypt_dir_incremental(raw_dir_path, encrypted_dir_path, pswd_input_func, backend,
+                    output_format=output_format, walker=walker)
+        if archive_format == EasyCrypt.MIRROR_FORMAT:
+            return EasyCrypt.encrypt_dir_files(raw_dir_path, encrypted_dir_path, pswd_input_func, backend,
+                    output_format=output_format, walker=walker)
         if os.path.exists(raw_dir_path) == False: return False
         # has to be a directory
         if os.path.isdir(raw_dir_path) == False: return False
@@ -249,34 +350,281 @@ class EasyCrypt:
         # check whether there is master pass file in working dir path and get master password.
         master_pswd = EasyCrypt.get_master_pswd_from_txt(master_pass_file_path, pswd_input_func)
         if master_pswd == None: return False
-        ZipUtil.zip_dir(raw_dir_path)
         # remove final slash that is included in in_dir_path if exists.
         if raw_dir_path.endswith(os.sep): raw_dir_path = raw_dir_path[0:-1]
-        zip_file_path = raw_dir_path + '.zip'
-        EasyCrypt.encrypt_file(zip_file_path, master_pswd, encrypted_dir_path)
+        if archive_format == EasyCrypt.TAR_FORMAT:
+            if encrypted_dir_path == None: encrypted_dir_path = raw_dir_path + ZipUtil.TAR_EXT + EasyCrypt.ENCRYPTED_EXT
+            return EasyCrypt._encrypt_dir_stream(raw_dir_path, master_pswd, encrypted_dir_path, backend,
+                    functools.partial(ZipUtil.tar_dir, walker=walker), output_format)
+        zip_file_path = raw_dir_path + ZipUtil.ZIP_EXT
+        if encrypted_dir_path == None: encrypted_dir_path = zip_file_path + EasyCrypt.ENCRYPTED_EXT
+        if stream:
+            return EasyCrypt._encrypt_dir_stream(raw_dir_path, master_pswd, encrypted_dir_path, backend,
+                    functools.partial(ZipUtil.zip_dir, compression=compression, walker=walker), output_format)
+        if ZipUtil.zip_dir(raw_dir_path, compression=compression, walker=walker) == False: return False
+        return EasyCrypt.encrypt_file(zip_file_path, master_pswd, encrypted_dir_path, backend, output_format)
+
+    @staticmethod
+    def _encrypt_dir_stream(raw_dir_path, master_pswd, encrypted_dir_path, backend=None, archive_func=ZipUtil.zip_dir,
+            output_format=None):
+        """Archive raw_dir_path with archive_func (zip_dir or tar_dir) into encrypt stream of encrypted_dir_path."""
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        enc_stream = cipher_backend.open_encrypt_stream(master_pswd, os.path.abspath(encrypted_dir_path), output_format)
+        try:
+            # archivers write small pieces, so buffer them before passing to the cipher
+            buffered_stream = io.BufferedWriter(enc_stream, EasyCrypt.STREAM_CHUNK_SIZE)
+            res = archive_func(raw_dir_path, dst=buffered_stream)
+            buffered_stream.flush()
+            buffered_stream.detach()
+        except BaseException:
+            enc_stream.abort()
+            raise
+        if res == False:
+            enc_stream.abort()
+            return False
+        enc_stream.close()
+        return enc_stream.succeeded
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def encrypt_dir_files(raw_dir_path, encrypted_dir_path=None, pswd_input_func=lambda msg: getpass.getpass(msg),
+            backend=None, executor=None, output_format=None, ignore_hidden_files=True, walker=None):
+        """
+        Encrypt each file under raw_dir_path independently into a mirrored tree encrypted_dir_path
+        (<raw_dir_path>.encfiles if None), where <dir>/<file> is encrypted to <dir>/<file>.enc.
+        Password is asked once and files are encrypted over a bounded pool of workers (CommandExecutor),
+        so that trees of many small files are not bound to one archive writer.
+        walker is a TreeWalker which selects files to encrypt.
+        encrypted_dir_path must not exist. Returns True if succeeded, otherwise returns False (without output).
+        """
+        if os.path.isdir(raw_dir_path) == False: return False
+        if raw_dir_path.endswith(os.sep): raw_dir_path = raw_dir_path[0:-1]
+        if encrypted_dir_path == None: encrypted_dir_path = raw_dir_path + EasyCrypt.MIRROR_EXT
+        if os.path.exists(encrypted_dir_path): return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        master_pass_file_path = os.path.join(raw_dir_path, EasyCrypt.MASTER_PASS_TXT)
+        master_pswd = EasyCrypt.get_master_pswd_from_txt(master_pass_file_path, pswd_input_func)
+        if master_pswd == None: return False
+        jobs = []
+        for rel_path in sorted(DirContainer.scan_dir(raw_dir_path, ignore_hidden_files, walker).keys()):
+            rel_parts = rel_path.split('/')
+            jobs.append((os.path.join(raw_dir_path, *rel_parts),
+                    os.path.join(encrypted_dir_path, *rel_parts) + EasyCrypt.ENCRYPTED_EXT))
+        # directories are created beforehand so that workers only write files
+        os.makedirs(encrypted_dir_path)
+        for enc_dir_path in set(os.path.dirname(enc_path) for raw_path, enc_path in jobs):
+            os.makedirs(enc_dir_path, exist_ok=True)
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [executor.submit_func(cipher_backend.encrypt_file, raw_path, master_pswd, enc_path, output_format)
+                    for raw_path, enc_path in jobs]
+            results = [future.result() for future in futures]
+        except BaseException:
+            EasyCrypt._cleanup(encrypted_dir_path)
+            raise
+        finally:
+            if own_executor: executor.shutdown()
+        if False in results:
+            EasyCrypt._cleanup(encrypted_dir_path)
+            return False
         return True
 
     @staticmethod
-    def get_decrypted_txt(encrypted_file_path, failed_act=None, pswd_input_func=lambda msg: getpass.getpass(msg)):
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def decrypt_dir_files(encrypted_dir_path, dst_dir_path=None, pswd_input_func=lambda msg: getpass.getpass(msg),
+            backend=None, executor=None, max_attempts=None):
+        """
+        Decrypt tree made by encrypt_dir_files to dst_dir_path (encrypted_dir_path without extension if None).
+        Password is asked until the first file is decrypted, then the others are decrypted over a pool of workers.
+        Returns True if succeeded, else False (without output).
+        """
+        if os.path.isdir(encrypted_dir_path) == False: return False
+        if encrypted_dir_path.endswith(os.sep): encrypted_dir_path = encrypted_dir_path[0:-1]
+        if dst_dir_path == None: dst_dir_path = EasyCrypt.rm_ext_from_path(encrypted_dir_path)
+        if os.path.exists(dst_dir_path): return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        jobs = []
+        for rel_path in sorted(DirContainer.scan_dir(encrypted_dir_path, ignore_hidden_files=False).keys()):
+            if rel_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False: continue
+            rel_parts = rel_path[:-len(EasyCrypt.ENCRYPTED_EXT)].split('/')
+            jobs.append((os.path.join(encrypted_dir_path, *rel_path.split('/')), os.path.join(dst_dir_path, *rel_parts)))
+        os.makedirs(dst_dir_path)
+        for raw_dir_path in set(os.path.dirname(raw_path) for enc_path, raw_path in jobs):
+            os.makedirs(raw_dir_path, exist_ok=True)
+        if len(jobs) == 0: return True
+        try:
+            res = EasyCrypt._decrypt_dir_files_jobs(jobs, pswd_input_func, cipher_backend, executor, max_attempts)
+        except BaseException:
+            EasyCrypt._cleanup(dst_dir_path)
+            raise
+        if res == False: EasyCrypt._cleanup(dst_dir_path)
+        return res
+
+    @staticmethod
+    def _decrypt_dir_files_jobs(jobs, pswd_input_func, cipher_backend, executor=None, max_attempts=None):
+        """Decrypt the first of jobs (list of (enc_path, raw_path)) until password is correct, then the others in parallel."""
+        first_enc_path, first_raw_path = jobs[0]
+        for attempt in EasyCrypt._attempts(max_attempts):
+            master_pswd = pswd_input_func('Input master password: ')
+            if cipher_backend.decrypt_file(first_enc_path, master_pswd, first_raw_path): break
+            if os.path.exists(first_raw_path): os.remove(first_raw_path)
+        else:
+            return False
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [executor.submit_func(cipher_backend.decrypt_file, enc_path, master_pswd, raw_path)
+                    for enc_path, raw_path in jobs[1:]]
+            results = [future.result() for future in futures]
+        finally:
+            if own_executor: executor.shutdown()
+        return False not in results
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def encrypt_dir_incremental(raw_dir_path, container_path=None, pswd_input_func=lambda msg: getpass.getpass(msg),
+            backend=None, executor=None, output_format=None, walker=None):
+        """
+        Encrypt directory into an updatable container (<raw_dir_path>.encdir) file by file.
+        On the following runs, only files changed since the last run are re-encrypted (see DirContainer).
+        walker is a TreeWalker which selects files to encrypt.
+        Returns True if succeeded, otherwise returns False.
+        """
+        if os.path.isdir(raw_dir_path) == False: return False
+        master_pass_file_path = os.path.join(raw_dir_path, EasyCrypt.MASTER_PASS_TXT)
+        master_pswd = EasyCrypt.get_master_pswd_from_txt(master_pass_file_path, pswd_input_func)
+        if master_pswd == None: return False
+        if raw_dir_path.endswith(os.sep): raw_dir_path = raw_dir_path[0:-1]
+        if container_path == None: container_path = raw_dir_path + DirContainer.CONTAINER_EXT
+        summary = DirContainer.update(raw_dir_path, container_path, master_pswd, backend, executor,
+                output_format=output_format, walker=walker)
+        return summary != None
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def decrypt_dir_incremental(container_path, dst_dir_path=None, pswd_input_func=lambda msg: getpass.getpass(msg),
+            backend=None, executor=None, max_attempts=None):
+        """
+        Decrypt container made by encrypt_dir_incremental to dst_dir_path (container_path without extension if None).
+        Returns True if succeeded, else False.
+        """
+        if container_path.endswith(os.sep): container_path = container_path[0:-1]
+        if dst_dir_path == None: dst_dir_path = EasyCrypt.rm_ext_from_path(container_path)
+        if os.path.exists(dst_dir_path): return False
+        master_pswd, manifest = EasyCrypt._read_container_manifest(container_path, pswd_input_func, backend, max_attempts)
+        if manifest == None: return False
+        try:
+            return DirContainer.restore(container_path, dst_dir_path, master_pswd, backend, executor)
+        except BaseException:
+            if os.path.exists(dst_dir_path): EasyCrypt._cleanup(dst_dir_path)
+            raise
+
+    @staticmethod
+    @Deadline.bounded
+    def list_container(container_path, pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, max_attempts=None):
+        """
+        List files in container made by encrypt_dir_incremental without decrypting them.
+        Returns sorted list of (relative path, size), or None if failed.
+        """
+        master_pswd, manifest = EasyCrypt._read_container_manifest(container_path, pswd_input_func, backend, max_attempts)
+        if manifest == None: return None
+        return DirContainer.list_files(container_path, master_pswd, backend, manifest)
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def extract_from_container(container_path, member_path, dst_dir_path=None,
+            pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, max_attempts=None):
+        """
+        Decrypt only member_path (a file or a directory, relative to the encrypted directory) from container
+        made by encrypt_dir_incremental into dst_dir_path (directory of container_path if None).
+        Returns True if succeeded, else False.
+        """
+        if container_path.endswith(os.sep): container_path = container_path[0:-1]
+        if dst_dir_path == None: dst_dir_path = os.path.dirname(os.path.abspath(container_path))
+        master_pswd, manifest = EasyCrypt._read_container_manifest(container_path, pswd_input_func, backend, max_attempts)
+        if manifest == None: return False
+        return DirContainer.extract(container_path, member_path, dst_dir_path, master_pswd, backend, manifest)
+
+    @staticmethod
+    def _read_container_manifest(container_path, pswd_input_func=lambda msg: getpass.getpass(msg), backend=None,
+            max_attempts=None):
+        """Make user to input password until manifest of container is decrypted. Returns (master_pswd, manifest)."""
+        if os.path.exists(DirContainer.manifest_path(container_path)) == False: return None, None
+        if BackendRegistry.get(backend) == None: return None, None
+        for attempt in EasyCrypt._attempts(max_attempts):
+            master_pswd = pswd_input_func('Input master password: ')
+            manifest = DirContainer.read_manifest(container_path, master_pswd, backend)
+            if manifest != None: return master_pswd, manifest
+        return None, None
+
+    @staticmethod
+    @Deadline.bounded
+    def get_decrypted_txt(encrypted_file_path, failed_act=None, pswd_input_func=lambda msg: getpass.getpass(msg),
+            backend=None, encode='utf-8', max_attempts=None):
         """
-        Decrypt file using openssl command.
+        Decrypt file using openssl command or in-process backend.
         Returns decrypted text if success, else returns None.
+        The whole text is kept in memory. Use iter_decrypted_txt for large files.
         """
         if os.path.exists(encrypted_file_path) == False: return None
         if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False:
             if sys.flags.debug: print('Unsupported extension. The file has to be *' + EasyCrypt.ENCRYPTED_EXT + ' file')
             return None # unsupported extension
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return None
         # make user to input password until it gets correct password.
-        while True:
+        for attempt in EasyCrypt._attempts(max_attempts):
             master_pswd = pswd_input_func('Input master password: ')
-            cmd = EasyCrypt.OPENSSL_CMD.format('-d', encrypted_file_path, master_pswd)
-            decrypted_txt = EasyCrypt.exec_command_get_result(cmd, failed_act)
-            if decrypted_txt != None:
-                return decrypted_txt
+            decrypted_bytes = cipher_backend.decrypt_bytes(encrypted_file_path, master_pswd)
+            if decrypted_bytes != None:
+                return decrypted_bytes.decode(encode)
+            if failed_act != None: failed_act()
+        return None
+
+    @staticmethod
+    def open_decrypted_txt(encrypted_file_path, master_pswd, backend=None, encode='utf-8'):
+        """
+        Open encrypted text file as a text stream which is decrypted while it is read,
+        so that memory usage does not depend on the size of the file. Line endings are kept as they are.
+        Raises DecryptError if the password is rejected by the key check. Otherwise a wrong password is noticed
+        while reading, by DecryptError or UnicodeDecodeError of the garbage.
+        Returns None if the backend is not available.
+        """
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return None
+        dec_stream = cipher_backend.open_decrypt_stream(master_pswd, encrypted_file_path)
+        return io.TextIOWrapper(io.BufferedReader(dec_stream, EasyCrypt.STREAM_CHUNK_SIZE), encoding=encode, newline='')
+
+    @staticmethod
+    def iter_decrypted_txt(encrypted_file_path, master_pswd, backend=None, encode='utf-8', lines=False,
+            chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Yield decrypted text of encrypted_file_path in chunks of chunk_size characters, or line by line if lines is True.
+        Text is yielded before the end of the file is decrypted, so a wrong password may be noticed (see open_decrypted_txt)
+        after some garbage has been yielded.
+        """
+        txt_stream = EasyCrypt.open_decrypted_txt(encrypted_file_path, master_pswd, backend, encode)
+        if txt_stream == None: return
+        with txt_stream:
+            if lines:
+                yield from txt_stream
+            else:
+                yield from iter(lambda: txt_stream.read(chunk_size), '')
 
     @staticmethod
+    @Deadline.bounded
     def decrypt_txt_file(encrypted_file_path, raw_file_path=None, handle_decrpyted_txt_func=None, 
-            remove_enc_file=False, pswd_input_func=lambda msg: getpass.getpass(msg)):
+            remove_enc_file=False, pswd_input_func=lambda msg: getpass.getpass(msg), backend=None,
+            handle_decrypted_chunk_func=None, lines=False, encode='utf-8', max_attempts=None):
         """
         WARNING:
         This function should only be used for encrypted text file.
@@ -284,29 +632,109 @@ class EasyCrypt:
         If you want to decrypt other kinds of files, use "decrypt_file" function.
 
         Decrypt text file using openssl command.
-        You can handle decrypted text file by putting handle_decrpyted_txt_func in the args.
+        You can handle decrypted text file by putting handle_decrpyted_txt_func in the args,
+        which gets the whole decrypted text at once (so the whole file is loaded in memory).
+        Otherwise the file is decrypted and written chunk by chunk in bounded memory, and
+        handle_decrypted_chunk_func gets each chunk (or each line if lines is True) and returns the text to write.
         Decrypted file is exported in same dir of encrypted_file_path, if raw_file_path is not specified.
         Returns True if success and False if not.
         """
         if raw_file_path == None: raw_file_path = EasyCrypt.rm_ext_from_path(encrypted_file_path)
-        # Existence of path is checked here.
-        decrypted_txt = EasyCrypt.get_decrypted_txt(encrypted_file_path, 
-            failed_act=lambda: print('Failed to decrypt. May be miss typing?'),
-            pswd_input_func=pswd_input_func)
-        # Failed to decrypt
-        if decrypted_txt == None: return False
-        if sys.flags.debug: print('Decryption Success!')
-        # method for handling raw text files
-        if handle_decrpyted_txt_func != None: decrypted_txt = handle_decrpyted_txt_func(decrypted_txt)
-        with open(raw_file_path, 'w+') as raw_file:
-            raw_file.write(decrypted_txt)
+        if handle_decrpyted_txt_func != None:
+            # Existence of path is checked here.
+            decrypted_txt = EasyCrypt.get_decrypted_txt(encrypted_file_path, 
+                failed_act=lambda: print('Failed to decrypt. May be miss typing?'),
+                pswd_input_func=pswd_input_func, backend=backend, encode=encode, max_attempts=max_attempts)
+            # Failed to decrypt
+            if decrypted_txt == None: return False
+            if sys.flags.debug: print('Decryption Success!')
+            # method for handling raw text files
+            decrypted_txt = handle_decrpyted_txt_func(decrypted_txt)
+            with open(raw_file_path, 'w+') as raw_file:
+                raw_file.write(decrypted_txt)
+        else:
+            if os.path.exists(encrypted_file_path) == False: return False
+            if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False:
+                if sys.flags.debug: print('Unsupported extension. The file has to be *' + EasyCrypt.ENCRYPTED_EXT + ' file')
+                return False # unsupported extension
+            if BackendRegistry.get(backend) == None: return False
+            for attempt in EasyCrypt._attempts(max_attempts):
+                master_pswd = pswd_input_func('Input master password: ')
+                if EasyCrypt._write_decrypted_txt(encrypted_file_path, master_pswd, raw_file_path, backend,
+                        handle_decrypted_chunk_func, lines, encode):
+                    break
+                print('Failed to decrypt. May be miss typing?')
+            else:
+                return False
+            if sys.flags.debug: print('Decryption Success!')
         if remove_enc_file: os.remove(encrypted_file_path)
         return True
 
     @staticmethod
-    def decrypt_file(encrypted_file_path, raw_file_path=None, failed_act=None, remove_enc_file=False, pswd_input_func=lambda msg: getpass.getpass(msg)):
+    def _write_decrypted_txt(encrypted_file_path, master_pswd, raw_file_path, backend=None,
+            handle_decrypted_chunk_func=None, lines=False, encode='utf-8'):
+        """
+        Write decrypted text into a temporary file which replaces raw_file_path only if decryption succeeded.
+        Returns False if the password is wrong.
+        """
+        tmp_raw_file_path = raw_file_path + '.tmp'
+        chunks = EasyCrypt.iter_decrypted_txt(encrypted_file_path, master_pswd, backend, encode, lines)
+        try:
+            with open(tmp_raw_file_path, 'w', encoding=encode, newline='') as raw_file:
+                try:
+                    for chunk in chunks:
+                        if handle_decrypted_chunk_func != None: chunk = handle_decrypted_chunk_func(chunk)
+                        raw_file.write(chunk)
+                finally:
+                    chunks.close()
+        except DecryptError:
+            os.remove(tmp_raw_file_path)
+            return False
+        except UnicodeDecodeError:
+            os.remove(tmp_raw_file_path)
+            # garbage of wrong password, unless the rest of the file is decrypted properly
+            try:
+                with EasyCrypt.open_decrypted_txt(encrypted_file_path, master_pswd, backend, 'latin-1') as txt_stream:
+                    while len(txt_stream.read(EasyCrypt.STREAM_CHUNK_SIZE)) > 0: pass
+            except DecryptError:
+                return False
+            raise
+        except BaseException:
+            if os.path.exists(tmp_raw_file_path): os.remove(tmp_raw_file_path)
+            raise
+        os.replace(tmp_raw_file_path, raw_file_path)
+        return True
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def decrypt_txt_files(encrypted_file_paths, master_pswd, executor=None, backend=None):
         """
-        Decrypt file using openssl command. It can be used for any types of file format.
+        Decrypt many encrypted text files with the same master password over a bounded pool of workers
+        (see decrypt_files). Each file is decrypted next to its encrypted file without the extension.
+        Returns dict of encrypted_file_path -> True/False in the same order as encrypted_file_paths.
+        """
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [(path, executor.submit_func(EasyCrypt._decrypt_txt_file_once, path, master_pswd, backend)) for path in encrypted_file_paths]
+            return dict((path, future.result()) for path, future in futures)
+        finally:
+            if own_executor: executor.shutdown()
+
+    @staticmethod
+    def _decrypt_txt_file_once(encrypted_file_path, master_pswd, backend=None):
+        if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False: return False
+        if os.path.exists(encrypted_file_path) == False: return False
+        if BackendRegistry.get(backend) == None: return False
+        return EasyCrypt._write_decrypted_txt(encrypted_file_path, master_pswd, EasyCrypt.rm_ext_from_path(encrypted_file_path), backend)
+
+    @staticmethod
+    @Deadline.bounded
+    def decrypt_file(encrypted_file_path, raw_file_path=None, failed_act=None, remove_enc_file=False,
+            pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, max_attempts=None):
+        """
+        Decrypt file using openssl command or in-process backend. It can be used for any types of file format.
         Decrypted file is exported in same dir of encrypted_file_path, if raw_file_path is not specified.
         Returns True if success and False if not.
         """
@@ -316,31 +744,250 @@ class EasyCrypt:
             return False # unsupported extension
         if raw_file_path == None:
             raw_file_path = EasyCrypt.rm_ext_from_path(encrypted_file_path)
-        while True:
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        for attempt in EasyCrypt._attempts(max_attempts):
             master_pswd = pswd_input_func('Input master password: ')
-            cmd = EasyCrypt.OPENSSL_CMD_WITH_OUTPUT.format('-d', encrypted_file_path, master_pswd, raw_file_path)
-            if EasyCrypt.exec_command(cmd, failed_act):
+            if cipher_backend.decrypt_file(encrypted_file_path, master_pswd, raw_file_path):
                 if remove_enc_file: os.remove(encrypted_file_path)
                 return True
+            if failed_act != None: failed_act()
+        return False
+
+    @staticmethod
+    def _decrypt_file_once(encrypted_file_path, master_pswd, backend=None):
+        """Decrypt .enc file with given password only once and remove partial output on failure."""
+        if encrypted_file_path.endswith(EasyCrypt.ENCRYPTED_EXT) == False: return False
+        if os.path.exists(encrypted_file_path) == False: return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        raw_file_path = EasyCrypt.rm_ext_from_path(encrypted_file_path)
+        if cipher_backend.decrypt_file(encrypted_file_path, master_pswd, raw_file_path): return True
+        if os.path.exists(raw_file_path): os.remove(raw_file_path)
+        return False
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def decrypt_files(encrypted_file_paths, master_pswd, executor=None, backend=None):
+        """
+        Decrypt many .enc files with the same master password over a bounded pool of workers.
+        Each file is decrypted next to its encrypted file without the extension.
+        There is only one attempt per file because the password is not prompted.
+        Returns dict of encrypted_file_path -> True/False in the same order as encrypted_file_paths.
+        """
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [(path, executor.submit_func(EasyCrypt._decrypt_file_once, path, master_pswd, backend)) for path in encrypted_file_paths]
+            return dict((path, future.result()) for path, future in futures)
+        finally:
+            if own_executor: executor.shutdown()
+
+    @staticmethod
+    def list_encrypted_files(encrypted_path):
+        """Returns [encrypted_path] if it is a file, or sorted .enc files under it if it is a directory (.encdir, .encfiles ...)."""
+        if os.path.isdir(encrypted_path):
+            return [os.path.join(encrypted_path, *rel_path.split('/'))
+                    for rel_path in sorted(DirContainer.scan_dir(encrypted_path, ignore_hidden_files=False).keys())
+                    if rel_path.endswith(EasyCrypt.ENCRYPTED_EXT)]
+        if os.path.exists(encrypted_path): return [encrypted_path]
+        return []
 
     @staticmethod
-    def decrypt_dir(encrypted_dir_path, dst_dir_path=None, remove_enc_file=False, remove_zip=False, pswd_input_func=lambda msg: getpass.getpass(msg)):
+    @Deadline.bounded
+    def input_pswd(encrypted_paths, pswd_input_func=lambda msg: getpass.getpass(msg), failed_act=None, max_attempts=None):
         """
-        Decrypt .zip.enc file using openssl command.
+        Ask master password until the header of the first encrypted file of encrypted_paths (files or directories)
+        accepts it, so that many files can be decrypted with one password.
+        Files without header can not be checked and accept any password.
+        Returns None if there is no encrypted file or no password is accepted in max_attempts.
+        """
+        for encrypted_path in encrypted_paths:
+            encrypted_file_paths = EasyCrypt.list_encrypted_files(encrypted_path)
+            if len(encrypted_file_paths) > 0: break
+        else:
+            return None
+        for attempt in EasyCrypt._attempts(max_attempts):
+            master_pswd = pswd_input_func('Input master password: ')
+            if CipherBackend.check_key(encrypted_file_paths[0], master_pswd) != False: return master_pswd
+            if failed_act != None: failed_act()
+        return None
+
+    @staticmethod
+    def once_pswd_input_func(master_pswd):
+        """
+        Returns pswd_input_func which gives master_pswd at the first call and raises DecryptError when it is asked again
+        (i.e. master_pswd was wrong), so that functions asking password until it is correct can be run without prompt.
+        """
+        state = {'first': True}
+        def once_pswd_input_func(msg):
+            if state['first'] == False: raise DecryptError('wrong password')
+            state['first'] = False
+            return master_pswd
+        return once_pswd_input_func
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def rotate_pswd(encrypted_path, pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, executor=None,
+            max_attempts=None):
+        """
+        Change master password of an encrypted file, or of all .enc files under a directory (.encdir, .encfiles ...).
+        Current password is asked until the first file accepts it, and then new password is confirmed.
+        Files with envelope header get only their headers rewritten, so it takes the same time regardless of
+        the size of the files (see rotate_files).
+        Passwords recorded in raw files (master_pass.txt, header of text files) are not changed.
+        Returns True if succeeded for all files.
+        """
+        encrypted_file_paths = EasyCrypt.list_encrypted_files(encrypted_path)
+        if len(encrypted_file_paths) == 0: return False
+        old_pswd = EasyCrypt.input_pswd(encrypted_file_paths, pswd_input_func, max_attempts=max_attempts)
+        if old_pswd == None: return False
+        new_pswd = EasyCrypt.confirm_pswd(pswd_input_func)
+        results = EasyCrypt.rotate_files(encrypted_file_paths, old_pswd, new_pswd, executor, backend)
+        return False not in results.values()
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def rotate_files(encrypted_file_paths, old_pswd, new_pswd, executor=None, backend=None):
+        """
+        Change master password of many encrypted files over a bounded pool of workers.
+        Envelope headers are rewritten in place (CipherBackend.rotate_key). Files without envelope header
+        (encrypted by older versions or openssl command) are decrypted and encrypted again with envelope header
+        in the same format, so that they can be rotated in place from the next time.
+        Returns dict of encrypted_file_path -> True/False in the same order as encrypted_file_paths.
+        """
+        own_executor = executor == None
+        if own_executor: executor = CommandExecutor()
+        try:
+            futures = [(path, executor.submit_func(EasyCrypt._rotate_file, path, old_pswd, new_pswd, backend)) for path in encrypted_file_paths]
+            return dict((path, future.result()) for path, future in futures)
+        finally:
+            if own_executor: executor.shutdown()
+
+    @staticmethod
+    def _rotate_file(encrypted_file_path, old_pswd, new_pswd, backend=None):
+        """Change master password of one file, encrypting it again only if it has no envelope header."""
+        try:
+            res = CipherBackend.rotate_key(encrypted_file_path, old_pswd, new_pswd)
+        except OSError:
+            return False
+        if res != None: return res
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        tmp_encrypted_file_path = encrypted_file_path + '.tmp'
+        try:
+            dec_stream = cipher_backend.open_decrypt_stream(old_pswd, encrypted_file_path)
+        except (OSError, DecryptError):
+            return False
+        enc_stream = cipher_backend.open_encrypt_stream(new_pswd, tmp_encrypted_file_path,
+                CipherBackend.detect_format(encrypted_file_path))
+        try:
+            with dec_stream:
+                shutil.copyfileobj(dec_stream, enc_stream, EasyCrypt.STREAM_CHUNK_SIZE)
+        except DecryptError:
+            enc_stream.abort()
+            return False
+        except BaseException:
+            enc_stream.abort()
+            raise
+        enc_stream.close()
+        if enc_stream.succeeded == False: return False
+        os.replace(tmp_encrypted_file_path, encrypted_file_path)
+        return True
+
+    @staticmethod
+    @Deadline.bounded
+    def get_file_key(encrypted_file_path, pswd_input_func=lambda msg: getpass.getpass(msg), max_attempts=None):
+        """
+        Returns password of the data of encrypted_file_path (after its first line), with which openssl command
+        can decrypt it (see CipherBackend.read_file_key). Returns None if the file does not exist
+        or no password is accepted in max_attempts.
+        """
+        if os.path.exists(encrypted_file_path) == False: return None
+        for attempt in EasyCrypt._attempts(max_attempts):
+            master_pswd = pswd_input_func('Input master password: ')
+            file_pswd = CipherBackend.read_file_key(encrypted_file_path, master_pswd)
+            if file_pswd != None: return file_pswd
+        return None
+
+    @staticmethod
+    @Deadline.bounded
+    @CipherBackend.key_scoped
+    def decrypt_dir(encrypted_dir_path, dst_dir_path=None, remove_enc_file=False, remove_zip=False,
+            pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, max_attempts=None):
+        """
+        Decrypt .zip.enc or .tar.enc file using openssl command or in-process backend.
+        .tar.enc file is extracted member by member while it is decrypted, so that no archive is written to disk.
+        .zip.enc file is decrypted to a temporary .zip file first (removed if remove_zip is True) and then unzipped
+        by parallel workers (see ZipUtil.unzip_dir).
+        .encdir container is decrypted by decrypt_dir_incremental (remove_enc_file removes the container).
+        .encfiles tree is decrypted by decrypt_dir_files (remove_enc_file removes the tree).
         Returns True if succeeded, else False.
         """
+        if encrypted_dir_path.rstrip(os.sep).endswith(DirContainer.CONTAINER_EXT):
+            res = EasyCrypt.decrypt_dir_incremental(encrypted_dir_path, dst_dir_path, pswd_input_func, backend,
+                    max_attempts=max_attempts)
+            if res and remove_enc_file: EasyCrypt._cleanup(encrypted_dir_path)
+            return res
+        if encrypted_dir_path.rstrip(os.sep).endswith(EasyCrypt.MIRROR_EXT):
+            res = EasyCrypt.decrypt_dir_files(encrypted_dir_path, dst_dir_path, pswd_input_func, backend,
+                    max_attempts=max_attempts)
+            if res and remove_enc_file: EasyCrypt._cleanup(encrypted_dir_path)
+            return res
         if os.path.isdir(encrypted_dir_path): return False
         tmp_zip_file_path = EasyCrypt.rm_ext_from_path(encrypted_dir_path)
-        if EasyCrypt.decrypt_file(encrypted_dir_path, raw_file_path=tmp_zip_file_path, pswd_input_func=pswd_input_func) == False: return False
+        if tmp_zip_file_path.endswith(ZipUtil.TAR_EXT) and encrypted_dir_path.endswith(EasyCrypt.ENCRYPTED_EXT):
+            if dst_dir_path == None: dst_dir_path = EasyCrypt.rm_ext_from_path(tmp_zip_file_path)
+            return EasyCrypt._decrypt_dir_stream(encrypted_dir_path, dst_dir_path, remove_enc_file, pswd_input_func, backend,
+                    max_attempts)
+        if EasyCrypt.decrypt_file(encrypted_dir_path, raw_file_path=tmp_zip_file_path, pswd_input_func=pswd_input_func,
+                backend=backend, max_attempts=max_attempts) == False: return False
         if dst_dir_path == None: dst_dir_path = EasyCrypt.rm_ext_from_path(tmp_zip_file_path)
         # whether to succeed in unzipping to a directory
         if ZipUtil.unzip_dir(tmp_zip_file_path, dst_dir_path):
-            if remove_enc_file: os.remove(encrypted_dir_path)
-            if remove_zip: os.remove(tmp_zip_file_path)
+            if remove_enc_file: EasyCrypt._cleanup(encrypted_dir_path)
+            if remove_zip: EasyCrypt._cleanup(tmp_zip_file_path)
             return True
         else:
             return False
 
+    @staticmethod
+    def _decrypt_dir_stream(encrypted_dir_path, dst_dir_path, remove_enc_file=False,
+            pswd_input_func=lambda msg: getpass.getpass(msg), backend=None, max_attempts=None):
+        """Extract tar archive from decrypt stream of encrypted_dir_path to dst_dir_path."""
+        if os.path.exists(encrypted_dir_path) == False or os.path.exists(dst_dir_path): return False
+        cipher_backend = BackendRegistry.get(backend)
+        if cipher_backend == None: return False
+        for attempt in EasyCrypt._attempts(max_attempts):
+            master_pswd = pswd_input_func('Input master password: ')
+            try:
+                dec_stream = cipher_backend.open_decrypt_stream(master_pswd, encrypted_dir_path)
+            except DecryptError:
+                # rejected by key check before extracting anything
+                continue
+            buffered_stream = io.BufferedReader(dec_stream, EasyCrypt.STREAM_CHUNK_SIZE)
+            try:
+                res = ZipUtil.untar_stream(buffered_stream, dst_dir_path)
+                # wrong password may be noticed only at the end of the stream
+                while res and len(buffered_stream.read(EasyCrypt.STREAM_CHUNK_SIZE)) > 0: pass
+            except DecryptError:
+                res = False
+            except BaseException:
+                if os.path.exists(dst_dir_path): EasyCrypt._cleanup(dst_dir_path)
+                raise
+            finally:
+                buffered_stream.detach()
+                dec_stream.close()
+            if res:
+                if remove_enc_file: EasyCrypt._cleanup(encrypted_dir_path)
+                return True
+            # remove partially extracted files
+            if os.path.exists(dst_dir_path): EasyCrypt._cleanup(dst_dir_path)
+        return False
+
     @staticmethod
     def gen_rnd_pswd(length=8, include_simbols=True, rnd_seed=None):
         """Generate random password with specified length. Used for salting passwords."""
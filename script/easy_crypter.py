@@ -1,76 +1,229 @@
 # coding:utf-8
 # for python3
-import sys, argparse
+import os, sys, glob, argparse, getpass
 from easy_crypt import EasyCrypt as ec
+from cipher_backend import BackendRegistry, CipherBackend, DecryptError
+from key_agent import KeyCache, KeyAgentClient
+from executor import CommandExecutor
+from metrics import Metrics, MemorySink, JsonLinesSink, PrometheusTextfileSink
+from zip_util import ZipUtil
+from tree_walker import TreeWalker
+
+DAY_SECONDS = 24 * 60 * 60
+# options which take many paths
+BATCH_ARGS = ['e', 'd', 'et', 'dt', 'ed', 'dd']
+
+def expand_paths(patterns):
+    """Paths of patterns without duplicates. Globs are expanded here for shells which do not expand them (e.g. cmd.exe)."""
+    paths = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern, recursive=True)) if any(c in pattern for c in '*?[') else []
+        paths.extend(matched if len(matched) > 0 else [pattern])
+    return list(dict.fromkeys(paths))
 
 def check_paths(args):
     exists_args = []
-    if args.e != None: exists_args.append(args.e)
-    if args.d != None: exists_args.append(args.d)
-    if args.et != None: exists_args.append(args.et)
-    if args.dt != None: exists_args.append(args.dt)
-    if args.ed != None: exists_args.append(args.ed)
-    if args.dd != None: exists_args.append(args.dd)
+    for batch_arg in BATCH_ARGS:
+        paths = getattr(args, batch_arg)
+        if paths != None:
+            setattr(args, batch_arg, expand_paths(paths))
+            exists_args.extend(getattr(args, batch_arg))
+    if args.ei != None: exists_args.append(args.ei)
+    if args.di != None: exists_args.append(args.di)
+    if args.l != None: exists_args.append(args.l)
+    if args.x != None: exists_args.append(args.x[0])
+    if args.r != None: exists_args.append(args.r)
+    if args.k != None: exists_args.append(args.k)
     for arg in exists_args:
         ec.path_exists_or_exit(arg)
 
+def create_walker(args):
+    """TreeWalker of files to encrypt in directories given by options (default if there is no option)."""
+    min_age = args.minage * DAY_SECONDS if args.minage != None else None
+    max_age = args.maxage * DAY_SECONDS if args.maxage != None else None
+    return TreeWalker(include=args.include, exclude=args.exclude, min_size=args.minsize, max_size=args.maxsize,
+            min_age=min_age, max_age=max_age, symlinks=args.symlinks)
+
+def run_batch(func, paths, executor):
+    """Run func(path) for each path over executor. Returns dict of path -> True/False in the same order as paths."""
+    futures = [(path, executor.submit_func(func, path)) for path in paths]
+    results = {}
+    for path, future in futures:
+        try:
+            results[path] = future.result() == True
+        except DecryptError as e:
+            # password of the batch was wrong for path (see EasyCrypt.once_pswd_input_func)
+            if sys.flags.debug: print('[error]: ' + str(e))
+            results[path] = False
+    return results
+
+def print_summary(results):
+    """Print result of each path and the number of succeeded and failed paths, if there are many paths."""
+    if len(results) < 2: return
+    for path, res in results.items():
+        print('{0}\t{1}'.format('ok' if res else 'failed', path))
+    failed_count = list(results.values()).count(False)
+    print('{0} succeeded, {1} failed.'.format(len(results) - failed_count, failed_count))
+
+def run_batch_args(args, executor, pswd_input_func, backend, output_format):
+    """Run the option of BATCH_ARGS for all paths. Returns dict of path -> True/False, or None if no password is given."""
+    failed_act = lambda: print('Decryption failed. Try again.')
+    # Just en/decrypting files with any extensions
+    if args.e != None:
+        # create master password
+        master_pswd = ec.confirm_pswd_print()
+        if master_pswd == None:
+            print('Invalid master password. Please retry.')
+            return None
+        return ec.encrypt_files(args.e, master_pswd, executor, backend, output_format)
+    if args.d != None:
+        master_pswd = ec.input_pswd(args.d, pswd_input_func, failed_act)
+        if master_pswd == None: return None
+        return ec.decrypt_files(args.d, master_pswd, executor, backend)
+    # En/decrypt txt file.
+    if args.et != None:
+        # read master password from header, and create new one for files without it
+        master_pswds = dict((path, ec.read_master_pswd(path)) for path in args.et)
+        if None in master_pswds.values():
+            new_pswd = ec.confirm_pswd_print()
+            master_pswds = dict((path, new_pswd if pswd == None else pswd) for path, pswd in master_pswds.items())
+        return run_batch(lambda path: ec.encrypt_file_with_header(path, master_pswds[path], backend=backend,
+                output_format=output_format), args.et, executor)
+    if args.dt != None:
+        master_pswd = ec.input_pswd(args.dt, pswd_input_func, failed_act)
+        if master_pswd == None: return None
+        return ec.decrypt_txt_files(args.dt, master_pswd, executor, backend)
+    # En/decrypt dir using zip
+    if args.ed != None:
+        # directories without master_pass.txt get the same new password
+        dir_pswd_input_func = pswd_input_func
+        if any(os.path.exists(os.path.join(path, ec.MASTER_PASS_TXT)) == False for path in args.ed):
+            new_pswd = ec.confirm_pswd_print()
+            dir_pswd_input_func = lambda msg: new_pswd
+        walker = create_walker(args)
+        return run_batch(lambda path: ec.encrypt_dir(path, pswd_input_func=dir_pswd_input_func, backend=backend,
+                archive_format=args.a, output_format=output_format, compression=args.z, walker=walker), args.ed, executor)
+    master_pswd = ec.input_pswd(args.dd, pswd_input_func, failed_act)
+    if master_pswd == None: return None
+    return run_batch(lambda path: ec.decrypt_dir(path, pswd_input_func=ec.once_pswd_input_func(master_pswd),
+            backend=backend), args.dd, executor)
+
+def add_stats_sinks(args):
+    """Add sinks of Metrics given by --stats options and returns them."""
+    sinks = []
+    if args.stats: sinks.append(MemorySink())
+    if args.stats_json != None: sinks.append(JsonLinesSink(args.stats_json))
+    if args.stats_prom != None: sinks.append(PrometheusTextfileSink(args.stats_prom))
+    for sink in sinks: Metrics.add_sink(sink)
+    return sinks
+
 def easy_crypter():
     if sys.flags.debug: ec.check_openssl_availability()
     parser = argparse.ArgumentParser(description='This is a python encrypter using AES-256-CBC algorithm of openssl.')
     parser.add_argument('-g', action='store_true', help='Generate random password.')
-    parser.add_argument('-e',  type=str, metavar='plane_txt_file', help='Encrypt specified file to .enc file. This function does not record your password. Do not forget it.')
-    parser.add_argument('-d',  type=str, metavar='enc_file', help='Decrypt .enc file with password')
-    parser.add_argument('-et', type=str, metavar='plane_txt_file', help='Encrypt specified text file (.txt, .csv ...) to .enc file and record your password inside the text file.')
-    parser.add_argument('-dt', type=str, metavar='enc_file', help='Decrypt .enc file to text file.')
-    parser.add_argument('-ed', type=str, metavar='dir_path', help='Encrypt directory by zipping and encrypt to .zip.enc file.')
-    parser.add_argument('-dd', type=str, metavar='zip_enc_file', help='Decrypt .zip.enc file to a directory.')
+    parser.add_argument('-e',  type=str, nargs='+', metavar='plane_txt_file', help='Encrypt specified files to .enc files. This function does not record your password. Do not forget it.')
+    parser.add_argument('-d',  type=str, nargs='+', metavar='enc_file', help='Decrypt .enc files with password')
+    parser.add_argument('-et', type=str, nargs='+', metavar='plane_txt_file', help='Encrypt specified text files (.txt, .csv ...) to .enc files and record your password inside the text files.')
+    parser.add_argument('-dt', type=str, nargs='+', metavar='enc_file', help='Decrypt .enc files to text files.')
+    parser.add_argument('-ed', type=str, nargs='+', metavar='dir_path', help='Encrypt directories by zipping and encrypt to .zip.enc files.')
+    parser.add_argument('-dd', type=str, nargs='+', metavar='zip_enc_file', help='Decrypt .zip.enc (or .tar.enc, .encdir, .encfiles) files to directories.')
+    parser.add_argument('-ei', type=str, metavar='dir_path', help='Encrypt directory file by file to .encdir container. Only changed files are encrypted again on the next run.')
+    parser.add_argument('-di', type=str, metavar='encdir_path', help='Decrypt .encdir container to a directory.')
+    parser.add_argument('-l', type=str, metavar='encdir_path', help='List files in .encdir container.')
+    parser.add_argument('-x', type=str, nargs=2, metavar=('encdir_path', 'member_path'), help='Decrypt only a file (or a directory) in .encdir container.')
+    parser.add_argument('-r', type=str, metavar='enc_path', help='Change password of .enc file, or of all .enc files in a directory (.encdir, .encfiles). Files are not encrypted again.')
+    parser.add_argument('-k', type=str, metavar='enc_file', help='Print the key of .enc file, with which openssl command can decrypt the file without its first line.')
+    parser.add_argument('-j', type=int, metavar='workers', help='Number of files (or directories) of -e, -d, -et, -dt, -ed, -dd processed at the same time (number of CPUs by default).')
+    parser.add_argument('-b64', action='store_true', help='Write encrypted files in base64 (text-safe) format instead of raw binary. Decryption detects the format by itself.')
+    parser.add_argument('-a', type=str, metavar='archive_format', default=ec.ZIP_FORMAT, choices=[ec.ZIP_FORMAT, ec.TAR_FORMAT, ec.CONTAINER_FORMAT, ec.MIRROR_FORMAT],
+            help='Archive format of -ed (zip, tar, encdir or files). .tar.enc file is extracted while it is decrypted. Files in .encdir container can be extracted one by one. "files" encrypts each file in parallel into a mirrored .encfiles directory.')
+    parser.add_argument('-z', type=str, metavar='compression', default=ZipUtil.STORED, choices=sorted(ZipUtil.COMPRESSIONS.keys()),
+            help='Compression of zip archive of -ed ({0}). Files are compressed on all CPU cores.'.format(', '.join(sorted(ZipUtil.COMPRESSIONS.keys()))))
+    parser.add_argument('-in', dest='include', type=str, action='append', metavar='pattern',
+            help='Encrypt only files in directories matching gitignore-style pattern (can be repeated).')
+    parser.add_argument('-ex', dest='exclude', type=str, action='append', metavar='pattern',
+            help='Do not encrypt files in directories matching gitignore-style pattern (can be repeated, "!pattern" includes again).')
+    parser.add_argument('-minsize', type=int, metavar='bytes', help='Skip files in directories smaller than bytes.')
+    parser.add_argument('-maxsize', type=int, metavar='bytes', help='Skip files in directories larger than bytes.')
+    parser.add_argument('-minage', type=float, metavar='days', help='Skip files in directories modified within days.')
+    parser.add_argument('-maxage', type=float, metavar='days', help='Skip files in directories not modified for days.')
+    parser.add_argument('-symlinks', type=str, default=TreeWalker.SYMLINK_FILES, choices=TreeWalker.SYMLINK_POLICIES,
+            help='How to handle symlinks in directories (skip, files: follow links to files only, follow: follow all links).')
+    parser.add_argument('-kdf', type=str, metavar='kdf', default=CipherBackend.KDF, choices=CipherBackend.KDFS,
+            help='Key derivation function of the password of new files ({0}).'.format(', '.join(CipherBackend.KDFS)))
+    parser.add_argument('-kdfs', type=float, metavar='seconds', default=CipherBackend.KDF_SECONDS,
+            help='Time to derive a key from the password on this machine, to which the cost of -kdf is calibrated. It is paid once per command, not per file.')
+    parser.add_argument('-b', type=str, metavar='backend', default=BackendRegistry.DEFAULT_BACKEND, choices=BackendRegistry.names(),
+            help='Cipher backend ({0}). "auto" uses in-process cipher if available, otherwise openssl command.'.format(', '.join(BackendRegistry.names())))
+    parser.add_argument('--stats', action='store_true',
+            help='Print time and bytes of each stage (walk, zip, tmp_write, spawn, cipher, unzip, cleanup) to stderr.')
+    parser.add_argument('--stats-json', type=str, metavar='jsonl_path', help='Append a json line of each measured stage to file.')
+    parser.add_argument('--stats-prom', type=str, metavar='prom_path', help='Write totals of stages to file in Prometheus text format.')
     args = parser.parse_args()
     # if using debug mode in python
     if sys.flags.debug: print(args)
     check_paths(args)
     result = False
-    
+    backend = args.b
+    output_format = ec.BASE64_FORMAT if args.b64 else ec.BINARY_FORMAT
+    CipherBackend.KDF = args.kdf
+    CipherBackend.KDF_SECONDS = args.kdfs
+    # passwords and derived keys are kept by key_agent.py if it is running
+    pswd_input_func = lambda msg: getpass.getpass(msg)
+    new_pswd_input_func = pswd_input_func
+    agent_client = KeyAgentClient.from_env()
+    if agent_client != None:
+        CipherBackend.KEY_CACHE = agent_client
+        new_pswd_input_func = agent_client.new_pswd_input_func(pswd_input_func)
+        pswd_input_func = agent_client.pswd_input_func(pswd_input_func)
+    else:
+        # keys are derived once for all files of this command, and dropped when it exits
+        CipherBackend.KEY_CACHE = KeyCache()
+    stats_sinks = add_stats_sinks(args)
+
     if args.g:
         print(ec.gen_rnd_pswd())
         result = True
     # Just en/decrypting files with any extensions
-    elif args.e != None:
-        raw_file_path = args.e
-        # create master password
-        master_pswd = ec.confirm_pswd_print()
-        if master_pswd == None:
-            print('Invalid master password. Please retry.')
-            return False
-        result = ec.encrypt_file(raw_file_path, master_pswd)
-    elif args.d != None:
-        encrypted_file_path = args.d
-        result = ec.decrypt_file(encrypted_file_path, failed_act=lambda: print('Decryption failed. Try again.'))
-    # En/decrypt txt file.
-    elif args.et != None:
-        raw_text_path = args.et
-        # read master password from header
-        master_pswd = ec.read_master_pswd(raw_text_path)
-        # if master password doesn't exists create new one
-        if master_pswd == None:
-            master_pswd = ec.confirm_pswd_print()
-        result = ec.encrypt_file_with_header(raw_text_path, master_pswd)
-    elif args.dt != None:
-        encrypted_text_path = args.dt
-        result = ec.decrypt_txt_file(encrypted_text_path)
-    # En/decrypt dir using zip
-    elif args.ed != None:
-        raw_dir_path = args.ed
-        result = ec.encrypt_dir(raw_dir_path)
-    elif args.dd != None:
-        encrypted_dir_path = args.dt
-        result = ec.decrypt_dir(encrypted_dir_path)
+    elif any(getattr(args, batch_arg) != None for batch_arg in BATCH_ARGS):
+        # password is asked once for all paths
+        with CommandExecutor(args.j) as executor:
+            results = run_batch_args(args, executor, pswd_input_func, backend, output_format)
+        if results != None: print_summary(results)
+        result = results != None and False not in results.values()
+    elif args.ei != None:
+        result = ec.encrypt_dir_incremental(args.ei, pswd_input_func=new_pswd_input_func, backend=backend,
+                output_format=output_format, walker=create_walker(args))
+    elif args.di != None:
+        result = ec.decrypt_dir_incremental(args.di, pswd_input_func=pswd_input_func, backend=backend)
+    elif args.l != None:
+        files = ec.list_container(args.l, pswd_input_func=pswd_input_func, backend=backend)
+        if files != None:
+            for rel_path, size in files:
+                print('{0}\t{1}'.format(size, rel_path))
+        result = files != None
+    elif args.x != None:
+        container_path, member_path = args.x
+        result = ec.extract_from_container(container_path, member_path, os.getcwd(), pswd_input_func=pswd_input_func,
+                backend=backend)
+    elif args.r != None:
+        # current password is given by the agent, and the new one is given to it
+        result = ec.rotate_pswd(args.r, pswd_input_func=pswd_input_func, backend=backend)
+    elif args.k != None:
+        file_pswd = ec.get_file_key(args.k, pswd_input_func)
+        if file_pswd != None: print(file_pswd)
+        result = file_pswd != None
     else:
         print('No valid arguments! Input -h or --help flag for help.')
         result = True
 
+    for sink in stats_sinks:
+        Metrics.remove_sink(sink)
+        if isinstance(sink, MemorySink): print(sink.format_summary(), file=sys.stderr)
     if result == False:
         print('Failed to run script. Add -d flag to python command for running program in verbose mode. e.g. "python -d easy_crypter.py -g"')
     return result
 
 if __name__ == '__main__':
-    easy_crypter()
+    # 0 if all paths succeeded, otherwise 1
+    sys.exit(0 if easy_crypter() else 1)
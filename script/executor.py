@@ -0,0 +1,233 @@
+# coding:utf-8
+import os, sys, time, shlex, functools, threading
+import subprocess as sps
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Metrics
+
+class OperationTimeout(Exception):
+    """
+    Raised when an operation does not finish before its deadline (see Deadline).
+    Child processes are killed and partial outputs are removed before it is raised.
+    """
+    pass
+
+class Deadline:
+    """
+    Deadline of operations of the current thread, which is set by "with Deadline.start(timeout):".
+
+    Commands run by CommandExecutor and openssl processes of cipher streams are killed at the deadline,
+    in-process ciphers check it chunk by chunk, and jobs given to CommandExecutor.submit_func keep the deadline
+    of the thread which submitted them. Nested deadlines never extend the outer one.
+    """
+    _LOCAL = threading.local()
+
+    @staticmethod
+    def start(timeout):
+        """Context manager which sets the deadline timeout seconds later in its block. None means no (new) limit."""
+        if timeout == None: return _DeadlineScope(Deadline.get())
+        return _DeadlineScope(time.monotonic() + timeout)
+
+    @staticmethod
+    def get():
+        """Deadline of the current thread in time.monotonic(), or None if there is no deadline."""
+        return getattr(Deadline._LOCAL, 'deadline', None)
+
+    @staticmethod
+    def remaining():
+        """Seconds left until the deadline (0 if it has passed), or None if there is no deadline."""
+        deadline = Deadline.get()
+        if deadline == None: return None
+        return max(deadline - time.monotonic(), 0.0)
+
+    @staticmethod
+    def check():
+        """Raise OperationTimeout if the deadline has passed."""
+        if Deadline.remaining() == 0: raise OperationTimeout('deadline exceeded')
+
+    @staticmethod
+    def bounded(func):
+        """Decorator which adds keyword argument timeout (seconds, None for no limit) to func."""
+        @functools.wraps(func)
+        def bounded_func(*args, timeout=None, **kwargs):
+            with Deadline.start(timeout):
+                return func(*args, **kwargs)
+        return bounded_func
+
+    @staticmethod
+    def wrap(func):
+        """Returns func which runs with the deadline of the current thread in any thread."""
+        deadline = Deadline.get()
+        if deadline == None: return func
+        @functools.wraps(func)
+        def wrapped_func(*args, **kwargs):
+            with _DeadlineScope(deadline):
+                # jobs waiting in a queue over the deadline are not started
+                Deadline.check()
+                return func(*args, **kwargs)
+        return wrapped_func
+
+    @staticmethod
+    def watch(proc):
+        """
+        Kill proc when the deadline passes, for processes whose pipes are read and written piece by piece.
+        Returns watcher whose expired tells whether proc has been killed. cancel() it when proc has finished.
+        """
+        return _ProcessWatcher(proc, Deadline.remaining())
+
+class _DeadlineScope:
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __enter__(self):
+        self.outer_deadline = Deadline.get()
+        if self.outer_deadline != None and (self.deadline == None or self.outer_deadline < self.deadline):
+            self.deadline = self.outer_deadline
+        Deadline._LOCAL.deadline = self.deadline
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        Deadline._LOCAL.deadline = self.outer_deadline
+        return False
+
+class _ProcessWatcher:
+
+    def __init__(self, proc, seconds):
+        self.expired = False
+        self._proc = proc
+        self._timer = None
+        if seconds == None: return
+        self._timer = threading.Timer(seconds, self._kill)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _kill(self):
+        if self._proc.poll() != None: return
+        self.expired = True
+        self._proc.kill()
+
+    def cancel(self):
+        if self._timer != None: self._timer.cancel()
+
+class CommandResult:
+    """Result of a command executed by CommandExecutor."""
+
+    def __init__(self, args, returncode, stdout_bytes, stderr_bytes):
+        self.args = args
+        self.returncode = returncode
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+
+    @property
+    def succeeded(self):
+        """True if the command was started and exited with status 0."""
+        return self.returncode == 0
+
+class CommandExecutor:
+    """
+    Executor for external commands such as openssl.
+
+    Commands are given as argv lists and started directly without /bin/sh,
+    so each job costs exactly one process spawn and no shell quoting is involved.
+    Jobs can also be scheduled over a bounded pool of worker threads (submit, map),
+    each of them waiting on one child process, so the number of concurrent
+    child processes never exceeds max_workers.
+    """
+    OPENSSL = 'openssl'
+    OPENSSL_CIPHER = 'aes-256-cbc'
+    # digest of -k key derivation, fixed so that the result does not depend on openssl version
+    OPENSSL_DIGEST = 'sha256'
+
+    def __init__(self, max_workers=None):
+        if max_workers == None: max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    @staticmethod
+    def build_openssl_args(mode, in_path, pswd, out_path=None, base64_flg=True):
+        """
+        Build argv list of openssl for en/decrypting in_path.
+        mode is '-e' for encryption or '-d' for decryption.
+        If in_path is None, the input is read from stdin.
+        If out_path is None, the result is written to stdout.
+        If base64_flg is False, encrypted data is raw binary instead of base64.
+        """
+        args = [CommandExecutor.OPENSSL, CommandExecutor.OPENSSL_CIPHER, mode, '-md', CommandExecutor.OPENSSL_DIGEST]
+        if base64_flg: args.append('-base64')
+        if in_path != None: args += ['-in', in_path]
+        args += ['-k', pswd]
+        if out_path != None: args += ['-out', out_path]
+        return args
+
+    @staticmethod
+    def to_args(cmd):
+        """Convert command string to argv list. Lists are returned as is."""
+        if isinstance(cmd, str): return shlex.split(cmd)
+        return list(cmd)
+
+    @staticmethod
+    def run(cmd, input_bytes=None, stdin_file=None, stdout_file=None, timeout=None):
+        """
+        Run command synchronously and return CommandResult.
+        stdin_file and stdout_file are file objects which are connected to the command directly
+        (the command reads and writes from their current positions) instead of input_bytes and stdout_bytes.
+        If the command could not be started (e.g. not found), returncode of the result is None.
+        If the command does not finish in timeout seconds or before the deadline (see Deadline),
+        it is killed and OperationTimeout is raised.
+        """
+        with Deadline.start(timeout):
+            return CommandExecutor._run(CommandExecutor.to_args(cmd), input_bytes, stdin_file, stdout_file)
+
+    @staticmethod
+    def _run(args, input_bytes, stdin_file, stdout_file):
+        Deadline.check()
+        if sys.flags.debug: print(' '.join(args))
+        if stdin_file == None: stdin_file = sps.PIPE if input_bytes != None else sps.DEVNULL
+        if stdout_file == None: stdout_file = sps.PIPE # for getting output strings
+        try:
+            with Metrics.stage(Metrics.SPAWN, command=os.path.basename(args[0])):
+                proc = sps.Popen(args, stdin=stdin_file, stderr=sps.PIPE, stdout=stdout_file)
+        except OSError as e:
+            return CommandResult(args, None, b'', str(e).encode('utf-8'))
+        try:
+            stdout_bytes, stderr_bytes = proc.communicate(input_bytes, timeout=Deadline.remaining())
+        except sps.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise OperationTimeout('{0} did not finish before the deadline'.format(os.path.basename(args[0])))
+        return CommandResult(args, proc.returncode, stdout_bytes or b'', stderr_bytes)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool == None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def submit(self, cmd, input_bytes=None):
+        """Schedule command on the worker pool and return concurrent.futures.Future of CommandResult."""
+        return self._get_pool().submit(Deadline.wrap(CommandExecutor.run), cmd, input_bytes)
+
+    def submit_func(self, func, *args, **kwargs):
+        """
+        Schedule arbitrary function (e.g. one that runs commands) on the worker pool.
+        It runs with the deadline of the current thread (see Deadline).
+        """
+        return self._get_pool().submit(Deadline.wrap(func), *args, **kwargs)
+
+    def map(self, cmds):
+        """Run commands on the worker pool and return list of CommandResult in the same order as cmds."""
+        futures = [self.submit(cmd) for cmd in cmds]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        """Shut down worker pool. Executor can be used again after shutdown."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool != None: pool.shutdown(wait=wait)
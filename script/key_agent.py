@@ -0,0 +1,308 @@
+# coding:utf-8
+import os, sys, hmac, json, time, socket, hashlib, argparse, binascii, tempfile, threading, socketserver
+from collections import OrderedDict
+
+class KeyCache:
+    """
+    In-memory cache of passwords and derived keys (bytes) with time to live.
+    Expired entries are removed when the cache is accessed (or purged), and the least recently used entry
+    is evicted when there are more than max_entries entries. It can be shared among threads.
+    Entries are stored under HMAC of their keys with a random secret of the cache, which never leaves its memory,
+    so that the stored keys can not be used to check guesses of passwords they may be computed from.
+    """
+    DEFAULT_TTL = 15 * 60
+    DEFAULT_MAX_ENTRIES = 1024
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expiry, value) in the order of use
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+
+    def get(self, key):
+        """Returns value of key, or None if there is no such key or it has expired."""
+        key = self._entry_key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry == None: return None
+            expiry, value = entry
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        """Store value of key for ttl seconds (ttl of the cache if None)."""
+        if ttl == None: ttl = self.ttl
+        key = self._entry_key(key)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            self._purge()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, key):
+        key = self._entry_key(key)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def purge(self):
+        """Remove expired entries."""
+        with self._lock:
+            self._purge()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _entry_key(self, key):
+        return hmac.new(self._secret, key.encode('utf-8'), hashlib.sha256).digest()
+
+    def _purge(self):
+        now = time.monotonic()
+        for key in [key for key, (expiry, value) in self._entries.items() if expiry <= now]:
+            del self._entries[key]
+
+class KeyAgent:
+    """
+    Local agent process (like ssh-agent) which holds a KeyCache in memory and serves it on a unix socket,
+    so that passwords and derived keys are shared among EasyCrypt commands until they expire.
+
+    The socket is created in a directory only the user can access, and its path is given to clients
+    by SOCKET_ENV (EASYCRYPT_AGENT_SOCK). Keys of requests are stored under HMAC with the secret of its KeyCache,
+    which is created when the agent starts and is never sent. Requests and responses are lines of json:
+
+        {"op": "get", "key": key}                          -> {"value": hex or null}
+        {"op": "put", "key": key, "value": hex, "ttl": sec} -> {"ok": true}
+        {"op": "remove", "key": key} / {"op": "clear"} / {"op": "stop"}
+    """
+    SOCKET_ENV = 'EASYCRYPT_AGENT_SOCK'
+    SOCKET_NAME = 'agent.sock'
+    # interval of purging expired entries
+    PURGE_INTERVAL = 1.0
+
+    def __init__(self, socket_path=None, ttl=KeyCache.DEFAULT_TTL, max_entries=KeyCache.DEFAULT_MAX_ENTRIES):
+        if hasattr(socket, 'AF_UNIX') == False: raise OSError('unix socket is not available')
+        # temporary directory of the socket, which is removed when the agent stops
+        self._socket_dir = None
+        if socket_path == None:
+            self._socket_dir = tempfile.mkdtemp(prefix='easycrypt-')
+            socket_path = os.path.join(self._socket_dir, KeyAgent.SOCKET_NAME)
+        self.socket_path = socket_path
+        self.cache = KeyCache(ttl, max_entries)
+        self._server = _AgentServer(socket_path, self)
+
+    def serve_forever(self):
+        """Serve requests until "stop" is requested, and remove the socket."""
+        try:
+            self._server.serve_forever(KeyAgent.PURGE_INTERVAL)
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path): os.remove(self.socket_path)
+            if self._socket_dir != None and len(os.listdir(self._socket_dir)) == 0: os.rmdir(self._socket_dir)
+
+    def start(self):
+        """Serve requests on a daemon thread and returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def handle_request(self, request):
+        """Returns response dict of request dict."""
+        op = request.get('op')
+        if op == 'get':
+            value = self.cache.get(request['key'])
+            return {'value': binascii.hexlify(value).decode('ascii') if value != None else None}
+        if op == 'put':
+            self.cache.put(request['key'], binascii.unhexlify(request['value']), request.get('ttl'))
+        elif op == 'remove':
+            self.cache.remove(request['key'])
+        elif op == 'clear':
+            self.cache.clear()
+        elif op == 'stop':
+            self.cache.clear()
+            # shutdown() waits for serve_forever, which is waiting for this request
+            threading.Thread(target=self._server.shutdown).start()
+        else:
+            return {'error': 'unknown op: {0}'.format(op)}
+        return {'ok': True}
+
+class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, agent):
+        self.agent = agent
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _AgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def service_actions(self):
+        self.agent.cache.purge()
+
+class _AgentRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.handle_request(json.loads(line.decode('utf-8')))
+            except (ValueError, KeyError, TypeError, binascii.Error) as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class KeyAgentClient:
+    """
+    Client of KeyAgent, which has the same get/put interface as KeyCache.
+    If the agent is not running, nothing is cached (get returns None and put does nothing),
+    so that it can be used whether the agent has been started or not.
+
+    Besides derived keys, the agent holds the master password itself (in plaintext, under PSWD_KEY) until it expires,
+    so that commands do not ask it again. Passwords typed by input functions of this client are given to the agent
+    only after a header has accepted them or has been written with them (see accept_pswd).
+    """
+    PSWD_KEY = 'master_password'
+    TIMEOUT = 5.0
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        # passwords typed by input functions of this client, which have not been accepted yet
+        self._typed_pswds = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_env():
+        """Client of the agent given by KeyAgent.SOCKET_ENV, or None if it is not set."""
+        socket_path = os.environ.get(KeyAgent.SOCKET_ENV)
+        if socket_path == None or hasattr(socket, 'AF_UNIX') == False: return None
+        return KeyAgentClient(socket_path)
+
+    def request(self, request):
+        """Send request dict and returns response dict, or None if the agent is not available."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(KeyAgentClient.TIMEOUT)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+                with sock.makefile('rb') as sock_file:
+                    line = sock_file.readline()
+        except OSError as e:
+            if sys.flags.debug: print('[error]: ' + str(e))
+            return None
+        try:
+            return json.loads(line.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def is_running(self):
+        return self.request({'op': 'get', 'key': ''}) != None
+
+    def get(self, key):
+        response = self.request({'op': 'get', 'key': key})
+        if response == None or response.get('value') == None: return None
+        return binascii.unhexlify(response['value'])
+
+    def put(self, key, value, ttl=None):
+        request = {'op': 'put', 'key': key, 'value': binascii.hexlify(value).decode('ascii')}
+        if ttl != None: request['ttl'] = ttl
+        self.request(request)
+
+    def remove(self, key):
+        self.request({'op': 'remove', 'key': key})
+
+    def clear(self):
+        self.request({'op': 'clear'})
+
+    def stop(self):
+        self.request({'op': 'stop'})
+
+    def accept_pswd(self, pswd):
+        """
+        Give pswd to the agent if it has been typed by input functions of this client.
+        Called by CipherBackend (as KEY_CACHE) when a header accepts pswd or is written with it.
+        """
+        with self._lock:
+            if pswd not in self._typed_pswds: return
+            self._typed_pswds.remove(pswd)
+        self.put(KeyAgentClient.PSWD_KEY, pswd.encode('utf-8'))
+
+    def _typed(self, pswd):
+        with self._lock:
+            self._typed_pswds.add(pswd)
+        return pswd
+
+    def pswd_input_func(self, input_func):
+        """
+        Returns pswd_input_func for decryption, which returns the password held by the agent at the first call
+        instead of asking it by input_func. A password typed by input_func is given to the agent when a header
+        accepts it, so the next commands do not ask it again and a mistyped one does not replace the held one.
+        If the first password is wrong, the following calls ask it.
+        """
+        state = {'first': True}
+        def agent_pswd_input_func(msg):
+            if state['first']:
+                state['first'] = False
+                pswd = self.get(KeyAgentClient.PSWD_KEY)
+                if pswd != None: return pswd.decode('utf-8')
+            return self._typed(input_func(msg))
+        return agent_pswd_input_func
+
+    def new_pswd_input_func(self, input_func):
+        """
+        Returns pswd_input_func for a new password (asked twice by EasyCrypt.confirm_pswd), which returns the password
+        held by the agent at every call, so that it is neither asked nor confirmed again.
+        If the agent holds no password, it is asked by input_func and given to the agent when files are encrypted with it.
+        """
+        state = {}
+        def agent_new_pswd_input_func(msg):
+            if 'pswd' not in state:
+                pswd = self.get(KeyAgentClient.PSWD_KEY)
+                state['pswd'] = pswd.decode('utf-8') if pswd != None else None
+            if state['pswd'] != None: return state['pswd']
+            return self._typed(input_func(msg))
+        return agent_new_pswd_input_func
+
+def key_agent():
+    parser = argparse.ArgumentParser(description='Agent which holds the master password (in plaintext) and derived keys of EasyCrypt in memory.')
+    parser.add_argument('-t', type=float, metavar='seconds', default=KeyCache.DEFAULT_TTL, help='Time to live of keys.')
+    parser.add_argument('-n', type=int, metavar='entries', default=KeyCache.DEFAULT_MAX_ENTRIES, help='Max number of keys.')
+    parser.add_argument('-s', type=str, metavar='socket_path', help='Path of unix socket (in a new temporary directory if not specified).')
+    parser.add_argument('-k', action='store_true', help='Stop the agent given by {0}.'.format(KeyAgent.SOCKET_ENV))
+    parser.add_argument('-f', action='store_true', help='Run in foreground.')
+    args = parser.parse_args()
+    if args.k:
+        client = KeyAgentClient.from_env()
+        if client == None or client.is_running() == False: return False
+        client.stop()
+        print('unset {0};'.format(KeyAgent.SOCKET_ENV))
+        return True
+    agent = KeyAgent(args.s, args.t, args.n)
+    env_line = '{0}={1}; export {0};'.format(KeyAgent.SOCKET_ENV, agent.socket_path)
+    # eval "$(python key_agent.py)" like ssh-agent
+    if args.f == False and hasattr(os, 'fork'):
+        if os.fork() != 0:
+            print(env_line)
+            return True
+        # detach from the terminal and the output which is read by eval
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3): os.dup2(devnull, fd)
+    else:
+        print(env_line, flush=True)
+    agent.serve_forever()
+    return True
+
+if __name__ == '__main__':
+    key_agent()
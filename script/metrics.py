@@ -0,0 +1,306 @@
+# coding:utf-8
+import os, json, time, functools, threading
+
+class Metrics:
+    """
+    Instrumentation of timings and byte counts of the stages of EasyCrypt operations.
+
+    Nothing is recorded unless a sink is added (add_sink), so that instrumentation costs almost nothing by default.
+    Each measured piece of work is given to the sinks as a record dict:
+
+        {'stage': 'zip', 'seconds': 0.12, 'bytes': 1048576, 'ok': True, 'time': 1476781200.0, ...labels}
+
+    Stages overlap when data is streamed (e.g. zip includes the time its output waits for the cipher),
+    while a stage inside the same stage (e.g. stream writes inside cipher of encrypt_file) is not recorded again.
+    Sinks are objects with emit(record) and close(), e.g. MemorySink, JsonLinesSink and PrometheusTextfileSink.
+    """
+    WALK = 'walk'
+    ZIP = 'zip'
+    TMP_WRITE = 'tmp_write'
+    SPAWN = 'spawn'
+    CIPHER = 'cipher'
+    UNZIP = 'unzip'
+    CLEANUP = 'cleanup'
+    STAGES = (WALK, ZIP, TMP_WRITE, SPAWN, CIPHER, UNZIP, CLEANUP)
+    SINKS = []
+    _LOCK = threading.Lock()
+    # stages which are being measured in each thread
+    _LOCAL = threading.local()
+
+    @staticmethod
+    def add_sink(sink):
+        with Metrics._LOCK:
+            Metrics.SINKS = Metrics.SINKS + [sink]
+        return sink
+
+    @staticmethod
+    def remove_sink(sink):
+        """Stop giving records to sink and close it."""
+        with Metrics._LOCK:
+            Metrics.SINKS = [added_sink for added_sink in Metrics.SINKS if added_sink is not sink]
+        sink.close()
+
+    @staticmethod
+    def enabled():
+        return len(Metrics.SINKS) > 0
+
+    @staticmethod
+    def record(stage, seconds, nbytes=0, ok=True, **labels):
+        """Give a record of stage to all sinks."""
+        sinks = Metrics.SINKS
+        if len(sinks) == 0: return
+        record = {'stage': stage, 'seconds': seconds, 'bytes': nbytes, 'ok': ok, 'time': time.time()}
+        record.update(labels)
+        with Metrics._LOCK:
+            for sink in sinks: sink.emit(record)
+
+    @staticmethod
+    def stage(stage, nbytes=0, **labels):
+        """
+        Context manager which records the time of its block as stage.
+        Bytes can be added by add_bytes() of the returned object. The record has ok False if the block raised.
+        """
+        if Metrics.enabled() == False: return _NULL_TIMER
+        return _StageTimer(stage, nbytes, labels)
+
+    @staticmethod
+    def timer(stage, **labels):
+        """
+        Returns timer which sums up the time of many blocks (measure()) as one record of stage,
+        which is given to sinks by close(). It is used for streams which are written or read piece by piece.
+        """
+        if Metrics.enabled() == False: return _NULL_TIMER
+        return _StageTimer(stage, 0, labels)
+
+    @staticmethod
+    def timed(stage, path_arg=None):
+        """
+        Decorator which records each call of the function as stage (labeled with op of the function name).
+        If path_arg is given, the size of the file of args[path_arg] is recorded as bytes.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def timed_func(*args, **kwargs):
+                if Metrics.enabled() == False: return func(*args, **kwargs)
+                with Metrics.stage(stage, op=func.__name__) as timer:
+                    if path_arg != None and path_arg < len(args) and os.path.isfile(args[path_arg]):
+                        timer.add_bytes(os.path.getsize(args[path_arg]))
+                    res = func(*args, **kwargs)
+                    # failures reported by False or None
+                    if res == False or res == None: timer.ok = False
+                    return res
+            return timed_func
+        return decorator
+
+    @staticmethod
+    def iterate(stage, iterable, size_func=None, **labels):
+        """
+        Iterate iterable recording time spent to get its items (not the time of the consumer) as one record of stage.
+        size_func returns bytes of an item. Returns iterable as is if nothing is recorded.
+        """
+        if Metrics.enabled() == False: return iterable
+        return Metrics._iterate(Metrics.timer(stage, **labels), iterable, size_func)
+
+    @staticmethod
+    def _iterate(timer, iterable, size_func):
+        iterator = iter(iterable)
+        try:
+            while True:
+                with timer.measure():
+                    item = next(iterator, _END)
+                if item is _END: break
+                if size_func != None: timer.add_bytes(size_func(item))
+                timer.add_count()
+                yield item
+        finally:
+            timer.close()
+
+    @staticmethod
+    def _active_stages():
+        if hasattr(Metrics._LOCAL, 'stages') == False: Metrics._LOCAL.stages = []
+        return Metrics._LOCAL.stages
+
+_END = object()
+
+class _StageTimer:
+    """Measures blocks of stage which is not being measured already in the same thread."""
+
+    def __init__(self, stage, nbytes, labels):
+        self.stage = stage
+        self.nbytes = nbytes
+        self.labels = labels
+        self.seconds = 0.0
+        self.count = 0
+        self.ok = True
+        self.measured = False
+        self._closed = False
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def add_count(self, count=1):
+        self.count += count
+
+    def measure(self):
+        return _Measure(self)
+
+    def close(self, ok=None):
+        """Give the record to sinks if any block has been measured."""
+        if self._closed: return
+        self._closed = True
+        if ok != None: self.ok = ok
+        if self.measured == False: return
+        labels = dict(self.labels)
+        if self.count > 0: labels['count'] = self.count
+        Metrics.record(self.stage, self.seconds, self.nbytes, self.ok, **labels)
+
+    def __enter__(self):
+        self._measure = self.measure()
+        self._measure.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._measure.__exit__(exc_type, exc_value, traceback)
+        self.close(False if exc_type != None else None)
+        return False
+
+class _Measure:
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.stages = Metrics._active_stages()
+        # nested blocks of the same stage are measured by the outer one
+        self.nested = self.timer.stage in self.stages
+        self.stages.append(self.timer.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.stages.pop()
+        if self.nested == False:
+            self.timer.seconds += seconds
+            self.timer.measured = True
+        return False
+
+class _NullTimer:
+    """Timer which records nothing, used when there is no sink."""
+    ok = True
+
+    def add_bytes(self, nbytes): pass
+
+    def add_count(self, count=1): pass
+
+    def measure(self):
+        return self
+
+    def close(self, ok=None): pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def _add_to_summary(summary, record):
+    stage_summary = summary.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'failures': 0})
+    stage_summary['calls'] += 1
+    stage_summary['seconds'] += record['seconds']
+    stage_summary['bytes'] += record['bytes']
+    if record['ok'] == False: stage_summary['failures'] += 1
+
+class MemorySink:
+    """Sink which keeps records in memory, for library users."""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def summary(self):
+        """Returns dict of stage -> dict of calls, seconds, bytes and failures in total."""
+        summary = {}
+        for record in self.records: _add_to_summary(summary, record)
+        return summary
+
+    def clear(self):
+        self.records = []
+
+    def close(self):
+        pass
+
+    def format_summary(self):
+        """Summary as a text table."""
+        lines = ['{0:<10} {1:>8} {2:>10} {3:>12} {4:>10} {5:>8}'.format('stage', 'calls', 'seconds', 'MB', 'MB/s', 'failures')]
+        summary = self.summary()
+        for stage in [stage for stage in Metrics.STAGES if stage in summary] + sorted(set(summary) - set(Metrics.STAGES)):
+            stage_summary = summary[stage]
+            mega_bytes = stage_summary['bytes'] / (1024 * 1024)
+            throughput = '{0:.2f}'.format(mega_bytes / stage_summary['seconds']) if stage_summary['seconds'] > 0 and stage_summary['bytes'] > 0 else '-'
+            lines.append('{0:<10} {1:>8} {2:>10.4f} {3:>12.2f} {4:>10} {5:>8}'.format(stage, stage_summary['calls'],
+                    stage_summary['seconds'], mega_bytes, throughput, stage_summary['failures']))
+        return '\n'.join(lines)
+
+class JsonLinesSink:
+    """Sink which writes each record as a line of json to a file path (appended) or a writable text file object."""
+
+    def __init__(self, dst):
+        self._own_file = isinstance(dst, str)
+        self._file = open(dst, 'a') if self._own_file else dst
+
+    def emit(self, record):
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._own_file: self._file.close()
+
+class PrometheusTextfileSink:
+    """
+    Sink which writes totals of each stage in Prometheus text format to file_path (for the textfile collector
+    of node_exporter). The file is replaced atomically by flush() and close().
+    Totals are of this sink only (e.g. of one command of easy_crypter.py) and the next run replaces them,
+    so they are written as gauges (easycrypt_stage_seconds etc.) which tell about the last run, not as counters.
+    Use rate() of them only if a single long-running process keeps the sink.
+    """
+    PREFIX = 'easycrypt_stage'
+    METRICS = [('calls', 'Number of measured calls of each stage in the last run.'),
+            ('seconds', 'Seconds spent in each stage in the last run.'),
+            ('bytes', 'Bytes processed in each stage in the last run.'),
+            ('failures', 'Number of failed calls of each stage in the last run.')]
+
+    def __init__(self, file_path, labels=None):
+        self.file_path = file_path
+        self.labels = labels if labels != None else {}
+        self._summary = {}
+
+    def emit(self, record):
+        _add_to_summary(self._summary, record)
+
+    def flush(self):
+        lines = []
+        for name, help_str in PrometheusTextfileSink.METRICS:
+            metric_name = '{0}_{1}'.format(PrometheusTextfileSink.PREFIX, name)
+            lines.append('# HELP {0} {1}'.format(metric_name, help_str))
+            lines.append('# TYPE {0} gauge'.format(metric_name))
+            for stage, stage_summary in sorted(self._summary.items()):
+                labels = dict(self.labels, stage=stage)
+                label_str = ','.join('{0}="{1}"'.format(key, PrometheusTextfileSink._escape(value))
+                        for key, value in sorted(labels.items()))
+                lines.append('{0}{{{1}}} {2}'.format(metric_name, label_str, stage_summary[name]))
+        tmp_file_path = self.file_path + '.tmp'
+        with open(tmp_file_path, 'w') as prom_file:
+            prom_file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_file_path, self.file_path)
+
+    def close(self):
+        self.flush()
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,183 @@
+# coding:utf-8
+import os, sys, re, time
+from metrics import Metrics
+if os.name == 'nt': # for windows
+    import win32api, win32con
+
+class TreeWalker:
+    """
+    Walker of files under a directory, which is used for archiving and encrypting directories.
+
+    Directories are read by os.scandir, so that the stat result of each entry is taken at most once
+    and excluded directories are never entered. Files can be selected by gitignore-style patterns
+    (include, exclude), size and age thresholds. Patterns are matched with paths relative to the root
+    separated by '/':
+
+        *.log       any file (or directory) named *.log at any depth
+        /build      build only right under the root (a pattern with '/' is anchored to the root)
+        cache/      directories only
+        **/tmp/*    '**' matches any number of directories
+        !keep.log   exclude patterns starting with '!' include again what preceding patterns excluded
+
+    Symlinks are handled according to symlinks policy:
+    SYMLINK_SKIP ignores them, SYMLINK_FILES follows links to files but not to directories (same as os.walk),
+    and SYMLINK_FOLLOW follows links to directories as well (each directory is walked only once).
+    """
+    SYMLINK_SKIP = 'skip'
+    SYMLINK_FILES = 'files'
+    SYMLINK_FOLLOW = 'follow'
+    SYMLINK_POLICIES = (SYMLINK_SKIP, SYMLINK_FILES, SYMLINK_FOLLOW)
+
+    def __init__(self, include=None, exclude=None, ignore_hidden_files=True, min_size=None, max_size=None,
+            min_age=None, max_age=None, symlinks=SYMLINK_FILES):
+        """
+        include and exclude are lists of patterns. If include is given, only files matching it are walked.
+        ignore_hidden_files skips hidden files (hidden directories are walked unless excluded).
+        min_size, max_size are in bytes and min_age, max_age are seconds since the last modification.
+        """
+        if symlinks not in TreeWalker.SYMLINK_POLICIES: raise ValueError('unknown symlink policy: {0}'.format(symlinks))
+        self.include = _PatternList(include) if include else None
+        self.exclude = _PatternList(exclude) if exclude else None
+        self.ignore_hidden_files = ignore_hidden_files
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_age = min_age
+        self.max_age = max_age
+        self.symlinks = symlinks
+
+    @staticmethod
+    def is_hidden(path):
+        """
+        Returns whether a specified path is hidden or not
+        """
+        if os.name == 'nt': # for windows
+            attribute = win32api.GetFileAttributes(path)
+            return attribute & (win32con.FILE_ATTRIBUTE_HIDDEN | win32con.FILE_ATTRIBUTE_SYSTEM) != 0
+        else:
+            dirname, filename = os.path.split(path)
+            return filename.startswith('.') #linux, mac
+
+    def walk(self, root_dir_path):
+        """
+        Yields (relative path separated by '/', path, os.stat_result) of files under root_dir_path
+        in the order of names, so that archives of the same tree are the same.
+        Time spent in walking and the size of walked files are recorded as Metrics.WALK.
+        """
+        return Metrics.iterate(Metrics.WALK, self._walk(root_dir_path), lambda item: item[2].st_size)
+
+    def _walk(self, root_dir_path):
+        now = time.time()
+        visited_dirs = set()
+        if self.symlinks == TreeWalker.SYMLINK_FOLLOW:
+            root_stat = os.stat(root_dir_path)
+            visited_dirs.add((root_stat.st_dev, root_stat.st_ino))
+        # stack of (relative path of directory, path of directory)
+        dir_stack = [('', root_dir_path)]
+        while len(dir_stack) > 0:
+            rel_dir_path, dir_path = dir_stack.pop()
+            try:
+                with os.scandir(dir_path) as scanner:
+                    entries = sorted(scanner, key=lambda entry: entry.name)
+            except OSError as e:
+                if sys.flags.debug: print('[error]: ' + str(e))
+                continue
+            sub_dirs = []
+            for entry in entries:
+                rel_path = rel_dir_path + entry.name
+                is_link = entry.is_symlink()
+                if is_link and self.symlinks == TreeWalker.SYMLINK_SKIP: continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if is_link and self.symlinks != TreeWalker.SYMLINK_FOLLOW: continue
+                    if self.exclude != None and self.exclude.match(rel_path, True): continue
+                    if self.symlinks == TreeWalker.SYMLINK_FOLLOW:
+                        dir_stat = entry.stat()
+                        dir_key = (dir_stat.st_dev, dir_stat.st_ino)
+                        # symlinks may make loops
+                        if dir_key in visited_dirs: continue
+                        visited_dirs.add(dir_key)
+                    sub_dirs.append((rel_path + '/', entry.path))
+                    continue
+                if self.ignore_hidden_files and TreeWalker.is_hidden(entry.path): continue
+                if self.exclude != None and self.exclude.match(rel_path, False): continue
+                if self.include != None and self.include.match_file_or_parents(rel_path) == False: continue
+                try:
+                    # cached by DirEntry, and no system call is needed on Windows
+                    stat = entry.stat()
+                except OSError:
+                    continue # broken link
+                if self._accepts_stat(stat, now): yield rel_path, entry.path, stat
+            # directories are popped in the order of names
+            dir_stack.extend(reversed(sub_dirs))
+
+    def scan(self, root_dir_path):
+        """Returns dict of relative path (separated by '/') -> os.stat_result of files walked under root_dir_path."""
+        return dict((rel_path, stat) for rel_path, path, stat in self.walk(root_dir_path))
+
+    def _accepts_stat(self, stat, now):
+        if self.min_size != None and stat.st_size < self.min_size: return False
+        if self.max_size != None and stat.st_size > self.max_size: return False
+        age = now - stat.st_mtime
+        if self.min_age != None and age < self.min_age: return False
+        if self.max_age != None and age > self.max_age: return False
+        return True
+
+class _PatternList:
+    """gitignore-style patterns. The last pattern matching a path decides whether it matches."""
+
+    def __init__(self, patterns):
+        self._patterns = [_PatternList._compile(pattern) for pattern in patterns if len(pattern.strip()) > 0]
+
+    def match(self, rel_path, is_dir):
+        matched = False
+        for regex, negate, dir_only in self._patterns:
+            if dir_only and is_dir == False: continue
+            if regex.match(rel_path): matched = negate == False
+        return matched
+
+    def match_file_or_parents(self, rel_path):
+        """Whether file rel_path or one of its parent directories matches."""
+        if self.match(rel_path, False): return True
+        parts = rel_path.split('/')
+        return any(self.match('/'.join(parts[:i]), True) for i in range(1, len(parts)))
+
+    @staticmethod
+    def _compile(pattern):
+        """Returns (regex, negate, dir_only) of pattern."""
+        pattern = pattern.strip()
+        negate = pattern.startswith('!')
+        if negate: pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # a pattern with '/' at the beginning or in the middle is relative to the root
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+            elif pattern.startswith('**', i):
+                regex += '.*'
+                i += 2
+            elif pattern[i] == '*':
+                regex += '[^/]*'
+                i += 1
+            elif pattern[i] == '?':
+                regex += '[^/]'
+                i += 1
+            elif pattern[i] == '[' and pattern.find(']', i + 1) > 0:
+                end = pattern.find(']', i + 1)
+                char_class = pattern[i + 1:end]
+                if char_class.startswith('!'): char_class = '^' + char_class[1:]
+                regex += '[' + char_class.replace('\\', '\\\\') + ']'
+                i = end + 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+        if anchored == False: regex = '(?:.*/)?' + regex
+        return re.compile(regex + '$'), negate, dir_only
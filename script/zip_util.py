@@ -1,93 +1,367 @@
 # coding:utf-8
-import os, sys, zipfile, shutil
+import os, sys, time, zlib, zipfile, tarfile, shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from unicodedata import normalize
+from tree_walker import TreeWalker
+from metrics import Metrics
 
 class ZipUtil:
-    """Utility class to perform zip/unzip using python."""
-    if os.name == 'nt': # for windows
-        import win32api, win32con
+    """
+    Utility class to perform zip/unzip using python.
+    tar format is also supported since it can be written and extracted as a stream.
+    """
+    ZIP_EXT = '.zip'
+    TAR_EXT = '.tar'
+    # compression methods of zip members selectable by name
+    STORED = 'stored'
+    COMPRESSIONS = {STORED: zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED,
+            'bzip2': zipfile.ZIP_BZIP2, 'lzma': zipfile.ZIP_LZMA}
+    # files which are compressed already are stored as they are
+    INCOMPRESSIBLE_EXTS = frozenset(['.zip', '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.7z', '.rar', '.zst',
+            '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac',
+            '.mp4', '.m4a', '.m4v', '.mov', '.avi', '.mkv', '.webm', '.enc', '.docx', '.xlsx', '.pptx', '.jar'])
+    # larger members are compressed by zipfile in this process, so that they are never held in memory
+    PARALLEL_MAX_MEMBER_SIZE = 16 * 1024 * 1024
+    # compressed members waiting to be written per worker process
+    PENDING_MEMBERS_PER_WORKER = 4
+    # total size of members which are being compressed or waiting to be written, regardless of the number of workers
+    PARALLEL_MAX_PENDING_BYTES = 128 * 1024 * 1024
     
     @staticmethod
     def is_hidden(path):
         """
         Returns whether a specified path is hidden or not 
         """
-        if os.name == 'nt': # for windows
-            attribute = win32api.GetFileAttributes(path)
-            return attribute & (win32con.FILE_ATTRIBUTE_HIDDEN | win32con.FILE_ATTRIBUTE_SYSTEM)
-        else:
-            dirname, filename = os.path.split(path)
-            return filename.startswith('.') #linux, mac
+        return TreeWalker.is_hidden(path)
 
     @staticmethod
     def utf8mac_to_sjis(mac_path_str):
         """
         A method for handling japanese "濁点" of mac string and convert it to shift-jis.
         If you didn't handle, it will raise an exception that you can't convert "濁点" to sjis.
+        mac_path_str is str (or utf-8 bytes) and sjis bytes are returned,
+        which can be given to zip_dir_conv as path_sanitize_func to make zip files for Windows.
         """
-        norm_path = normalize('NFC', unicode(mac_path_str,'utf8'))
+        if isinstance(mac_path_str, bytes): mac_path_str = mac_path_str.decode('utf8')
+        norm_path = normalize('NFC', mac_path_str)
         return norm_path.encode('sjis')
 
     @staticmethod
     def sjis_to_utf8mac(sjis_path_str):
         """
-        Vice versa method of utf8mac_to_sjis.
+        Vice versa method of utf8mac_to_sjis. sjis bytes are converted to str in the decomposed form of mac.
         """
-        uni_path = unicode(sjis_path_str, 'sjis')
-        return uni_path.encode('utf8')
+        uni_path = sjis_path_str.decode('sjis')
+        return normalize('NFD', uni_path)
 
     @staticmethod
-    def zip_dir_conv(src_dir_path, path_sanitize_func = lambda path_str: path_str, ignore_hidden_files = False):
+    def zip_dir_conv(src_dir_path, path_sanitize_func = lambda path_str: path_str, ignore_hidden_files = False, dst = None,
+            compression = None, max_workers = None, walker = None):
         """ 
         This method is for converting an encode of files' name and zip them.
         path_sanitize_func is a method for sanitizing (converting encode) a path (Do nothing for default).
+        It is given archived path separated by '/' and returns str, or bytes (e.g. utf8mac_to_sjis) which are written
+        as the name as they are without UTF-8 flag. Only names in the archive are converted and no file is copied.
+        dst is a path of zip file or a writable file object (it does not need to be seekable) the archive is written to.
+        If dst is None, the archive is written to src_dir_path + '.zip'.
+        compression is a name in COMPRESSIONS (STORED if None). Members are compressed by max_workers processes
+        (number of CPUs if None) and written in order. Files with INCOMPRESSIBLE_EXTS, and files which do not get
+        smaller, are stored as they are.
+        walker is a TreeWalker which selects files to archive. If None, all files (except hidden files
+        if ignore_hidden_files is True) are archived.
+        Archived paths start with the name of the directory. Files are read by absolute paths and the working directory
+        is never changed, so that this method (and zip_dir) can be called from many threads at the same time
+        as long as their dst are different.
         """
+        if compression == None: compression = ZipUtil.STORED
+        if compression not in ZipUtil.COMPRESSIONS: return False
         if os.path.exists(src_dir_path) == False: return False
-        # remove final slash that is included in src_dir_path if exists.
-        if src_dir_path.endswith(os.sep): src_dir_path = src_dir_path[0:-1]
-        src_parent_path, src_dirname = os.path.split(src_dir_path)
-        # IMPORTANT : change directory fot not creating zip file with full path files.
-        os.chdir(src_parent_path)
-
-        with zipfile.ZipFile(src_dirname + '.zip', 'w') as zip_file:
-            for parent_path, dirs, files in os.walk(src_dirname):
-                conv_dir_path = path_sanitize_func(parent_path)
-                if os.path.exists(conv_dir_path) == False:
-                    os.makedirs(conv_dir_path)
-                for fname in files:
-                    if ignore_hidden_files and ZipUtil.is_hidden(fname): continue
-                    file_path = os.sep.join((parent_path, fname)) # path of original file
-                    if sys.flags.debug: print('zipping : {0}'.format(file_path))
-                    conv_file_path = path_sanitize_func(file_path)
-                    if file_path == conv_file_path:
-                        # file name does not need to be sanitized
-                        zip_file.write(file_path)
-                    else:
-                        shutil.copyfile(file_path, conv_file_path) # copy file in sjis file name
-                        zip_file.write(conv_file_path)
-                        os.remove(conv_file_path) # remove tmp file for sanitation
-                # path is converted if it is not same
-                if conv_dir_path != parent_path:
-                    # remove temporary parent folder for sanitation
-                    shutil.rmtree(conv_dir_path)
+        src_dir_path = os.path.abspath(src_dir_path) # final slash is removed as well
+        if dst == None: dst = src_dir_path + ZipUtil.ZIP_EXT
+        if isinstance(dst, str): dst = os.path.abspath(dst)
+        src_dirname = os.path.basename(src_dir_path)
+        if walker == None: walker = TreeWalker(ignore_hidden_files=ignore_hidden_files)
+
+        with Metrics.stage(Metrics.ZIP, format='zip', compression=compression) as timer, \
+                zipfile.ZipFile(dst, 'w') as zip_file, \
+                _ParallelZipWriter(zip_file, ZipUtil.COMPRESSIONS[compression], max_workers) as member_writer:
+            for rel_path, file_path, stat in walker.walk(src_dir_path):
+                if sys.flags.debug: print('zipping : {0}'.format(file_path))
+                # the file is archived under the converted name
+                member_writer.write(file_path, path_sanitize_func(src_dirname + '/' + rel_path), stat)
+                timer.add_bytes(stat.st_size)
         return True
 
     @staticmethod
-    def zip_dir(src_dir_path, ignore_hidden_files = True):
-        """Zip specified directory's path and return True if succeeded."""
-        return ZipUtil.zip_dir_conv(src_dir_path, ignore_hidden_files=ignore_hidden_files)
+    def zip_dir(src_dir_path, ignore_hidden_files = True, dst = None, compression = None, max_workers = None, walker = None):
+        """
+        Zip specified directory's path and return True if succeeded.
+        dst is a path or a writable file object for the archive (src_dir_path + '.zip' if None).
+        compression, max_workers and walker are the same as zip_dir_conv.
+        """
+        return ZipUtil.zip_dir_conv(src_dir_path, ignore_hidden_files=ignore_hidden_files, dst=dst,
+                compression=compression, max_workers=max_workers, walker=walker)
+
+    @staticmethod
+    def make_zip_info(file_path, arcname=None, stat=None):
+        """
+        ZipInfo of file_path archived as arcname (str, or bytes which are written as they are without UTF-8 flag).
+        If os.stat_result of file_path is given as stat, the file is not stat again.
+        """
+        if stat == None: stat = os.stat(file_path)
+        zinfo_cls = _RawNameZipInfo if isinstance(arcname, bytes) else zipfile.ZipInfo
+        if arcname == None: arcname = file_path
+        if isinstance(arcname, str):
+            # same as ZipInfo.from_file
+            arcname = os.path.normpath(os.path.splitdrive(arcname)[1]).lstrip(os.sep + (os.altsep or ''))
+            zinfo = zinfo_cls(arcname, time.localtime(stat.st_mtime)[0:6])
+        else:
+            zinfo = zinfo_cls('', time.localtime(stat.st_mtime)[0:6])
+            zinfo.raw_filename = arcname.lstrip(b'/')
+            # name in str is used only in this process (e.g. for checking duplicates)
+            zinfo.filename = zinfo.raw_filename.decode('latin-1')
+        zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16 # Unix attributes
+        zinfo.file_size = stat.st_size
+        return zinfo
+
+    @staticmethod
+    def choose_compress_type(file_path, compress_type):
+        """Returns ZIP_STORED for files which are compressed already (by extension), else compress_type."""
+        if os.path.splitext(file_path)[1].lower() in ZipUtil.INCOMPRESSIBLE_EXTS: return zipfile.ZIP_STORED
+        return compress_type
 
     @staticmethod
-    def unzip_dir(zip_file_path, dst_dir_path = None):
-        """Unzip (extract) specified zip_file_path to dst_dir_path. Returns True if succeeded."""
+    def unzip_dir(zip_file_path, dst_dir_path = None, max_workers = None):
+        """
+        Unzip (extract) specified zip_file_path to dst_dir_path. Returns True if succeeded.
+        Members are extracted by max_workers threads (number of CPUs if None), each of them with its own handle
+        of the archive, since decompression and file writes release GIL. Directories are created beforehand.
+        """
         if os.path.exists(zip_file_path) == False: return False
         if dst_dir_path != None and os.path.exists(dst_dir_path): return False
         if dst_dir_path == None:
             dirname, filename = os.path.split(zip_file_path)
             dst_dir_path = dirname # extract in the same folder
+        if max_workers == None: max_workers = os.cpu_count() or 1
+
+        with Metrics.stage(Metrics.UNZIP, format='zip') as timer:
+            return ZipUtil._unzip_members(zip_file_path, dst_dir_path, max_workers, timer)
 
+    @staticmethod
+    def _unzip_members(zip_file_path, dst_dir_path, max_workers, timer):
         with zipfile.ZipFile(zip_file_path, 'r') as zip_file:
-            for member in zip_file.infolist(): # list all zipped files path
+            members = zip_file.infolist() # list all zipped files path
+            timer.add_bytes(sum(member.file_size for member in members))
+            max_workers = min(max_workers, len(members))
+            if max_workers <= 1:
+                for member in members:
+                    zip_file.extract(member, dst_dir_path)
+                return True
+        # workers must not race on creating the same directory
+        for member_dir_path in set(ZipUtil._member_dir_path(member, dst_dir_path) for member in members):
+            os.makedirs(member_dir_path, exist_ok=True)
+        # members are distributed by size so that workers get about the same amount of data
+        member_groups = [[] for i in range(max_workers)]
+        group_sizes = [0] * max_workers
+        for member in sorted(members, key=lambda member: member.file_size, reverse=True):
+            i = group_sizes.index(min(group_sizes))
+            member_groups[i].append(member)
+            group_sizes[i] += member.file_size
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(ZipUtil._extract_members, zip_file_path, group, dst_dir_path) for group in member_groups]
+            for future in futures: future.result()
+        return True
+
+    @staticmethod
+    def _extract_members(zip_file_path, members, dst_dir_path):
+        with zipfile.ZipFile(zip_file_path, 'r') as zip_file:
+            for member in members:
+                if sys.flags.debug: print('extracting : {0}'.format(member.filename))
                 zip_file.extract(member, dst_dir_path)
+
+    @staticmethod
+    def _member_dir_path(member, dst_dir_path):
+        """Directory which ZipFile.extract writes member into (absolute, drive and '..' are removed in the same way)."""
+        arcname = member.filename.replace('/', os.sep)
+        if os.altsep: arcname = arcname.replace(os.altsep, os.sep)
+        arcname = os.path.splitdrive(arcname)[1]
+        parts = [part for part in arcname.split(os.sep) if part not in ('', os.curdir, os.pardir)]
+        if member.is_dir() == False: parts = parts[:-1]
+        return os.path.join(dst_dir_path, *parts)
+
+    @staticmethod
+    def tar_dir(src_dir_path, ignore_hidden_files = True, dst = None, walker = None):
+        """
+        Archive specified directory's path in tar format and return True if succeeded.
+        Same as zip_dir, archived paths start with the name of the directory and empty directories are not archived.
+        dst is a path or a writable file object (it does not need to be seekable) for the archive.
+        If dst is None, the archive is written to src_dir_path + '.tar'.
+        walker is a TreeWalker which selects files to archive (same as zip_dir_conv).
+        """
+        if os.path.exists(src_dir_path) == False: return False
+        # remove final slash that is included in src_dir_path if exists.
+        if src_dir_path.endswith(os.sep): src_dir_path = src_dir_path[0:-1]
+        if dst == None: dst = src_dir_path + ZipUtil.TAR_EXT
+        src_parent_path, src_dirname = os.path.split(src_dir_path)
+        if walker == None: walker = TreeWalker(ignore_hidden_files=ignore_hidden_files)
+        # links which are walked are archived as the files they point to
+        dereference = walker.symlinks != TreeWalker.SYMLINK_SKIP
+        if isinstance(dst, str):
+            tar_file = tarfile.open(dst, 'w', dereference=dereference)
+        else:
+            tar_file = tarfile.open(fileobj=dst, mode='w|', dereference=dereference)
+        with Metrics.stage(Metrics.ZIP, format='tar') as timer, tar_file:
+            for rel_path, file_path, stat in walker.walk(src_dir_path):
+                if sys.flags.debug: print('archiving : {0}'.format(file_path))
+                tar_file.add(file_path, arcname=src_dirname + '/' + rel_path, recursive=False)
+                timer.add_bytes(stat.st_size)
         return True
 
+    @staticmethod
+    def untar_stream(src_stream, dst_dir_path):
+        """
+        Extract tar archive from readable file object (it does not need to be seekable) to dst_dir_path
+        member by member, so that the archive never needs to be stored.
+        Returns True if succeeded, False if the stream is not a valid tar archive or dst_dir_path already exists.
+        """
+        if os.path.exists(dst_dir_path): return False
+        try:
+            with Metrics.stage(Metrics.UNZIP, format='tar') as timer, tarfile.open(fileobj=src_stream, mode='r|') as tar_file:
+                for member in tar_file:
+                    if sys.flags.debug: print('extracting : {0}'.format(member.name))
+                    timer.add_bytes(member.size)
+                    # 'data' filter refuses absolute paths, links to outside and special files
+                    if hasattr(tarfile, 'data_filter'):
+                        tar_file.extract(member, dst_dir_path, filter='data')
+                    elif member.isreg() and ZipUtil._is_safe_member_name(member.name):
+                        tar_file.extract(member, dst_dir_path)
+        except tarfile.TarError as e:
+            if sys.flags.debug: print('[error]: ' + str(e))
+            return False
+        return True
+
+    @staticmethod
+    def _is_safe_member_name(member_name):
+        """Whether archived member path stays inside the destination directory."""
+        norm_name = os.path.normpath(member_name)
+        return os.path.isabs(norm_name) == False and norm_name.split(os.sep)[0] != os.pardir
+
+def _compress_member(file_path, compress_type):
+    """
+    Compress file in the same way as zipfile and returns (compress_type, CRC, file size, compressed data).
+    If compressed data is not smaller, the file is stored as it is.
+    Module level function so that it can be run in worker processes.
+    """
+    with open(file_path, 'rb') as rfile:
+        data = rfile.read()
+    crc = zlib.crc32(data)
+    # same compressor as ZipFile.write (lzma needs zipfile's own header)
+    compressor = zipfile._get_compressor(compress_type)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data): return zipfile.ZIP_STORED, crc, len(data), data
+    return compress_type, crc, len(data), compressed
+
+class _ParallelZipWriter:
+    """
+    Writes files into zipfile.ZipFile in the given order, compressing them on a pool of worker processes.
+    Compressed members are written by _write_compressed, since ZipFile only writes data it compresses itself.
+    Stored members and large members are written through ZipFile.open after the preceding members.
+    Members on the fly are limited to PARALLEL_MAX_PENDING_BYTES in total, so that memory usage does not grow
+    with the number of workers. If zipfile does not have the internals _write_compressed needs,
+    all members are written through ZipFile.open.
+    """
+
+    def __init__(self, zip_file, compress_type, max_workers=None):
+        if max_workers == None: max_workers = os.cpu_count() or 1
+        self._zip_file = zip_file
+        self._compress_type = compress_type
+        self._max_workers = max_workers
+        self._max_pending = max_workers * ZipUtil.PENDING_MEMBERS_PER_WORKER
+        self._raw_write = _can_write_compressed(zip_file)
+        self._pool = None
+        self._pending = deque()
+        self._pending_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type == None)
+
+    def write(self, file_path, arcname=None, stat=None):
+        """Add file_path to the archive as arcname (see ZipUtil.make_zip_info)."""
+        compress_type = ZipUtil.choose_compress_type(file_path, self._compress_type)
+        zinfo = ZipUtil.make_zip_info(file_path, arcname, stat)
+        if self._raw_write == False or compress_type == zipfile.ZIP_STORED or \
+                zinfo.file_size > ZipUtil.PARALLEL_MAX_MEMBER_SIZE:
+            self._flush()
+            # same as ZipFile.write, which does not take ZipInfo
+            zinfo.compress_type = compress_type
+            with open(file_path, 'rb') as src_file, self._zip_file.open(zinfo, 'w') as member_file:
+                shutil.copyfileobj(src_file, member_file, 1024 * 1024)
+            return
+        if self._max_workers <= 1:
+            self._flush()
+            _write_compressed(self._zip_file, zinfo, *_compress_member(file_path, compress_type))
+            return
+        # make room for this member before it is read by a worker
+        self._flush(self._max_pending - 1, ZipUtil.PARALLEL_MAX_PENDING_BYTES - zinfo.file_size)
+        if self._pool == None: self._pool = ProcessPoolExecutor(max_workers=self._max_workers)
+        self._pending.append((zinfo, self._pool.submit(_compress_member, os.path.abspath(file_path), compress_type)))
+        self._pending_bytes += zinfo.file_size
+
+    def _flush(self, max_pending=0, max_pending_bytes=0):
+        """Write compressed members in order until at most max_pending members of max_pending_bytes in total are left."""
+        while len(self._pending) > 0 and (len(self._pending) > max_pending or self._pending_bytes > max_pending_bytes):
+            zinfo, future = self._pending.popleft()
+            self._pending_bytes -= zinfo.file_size
+            _write_compressed(self._zip_file, zinfo, *future.result())
+
+    def close(self, flush=True):
+        try:
+            if flush: self._flush()
+        finally:
+            for zinfo, future in self._pending: future.cancel()
+            self._pending.clear()
+            self._pending_bytes = 0
+            if self._pool != None: self._pool.shutdown()
+            self._pool = None
+
+# internals of zipfile (CPython 3.6 or later) which _compress_member and _write_compressed depend on
+_ZIPFILE_INTERNALS = ('_lock', '_writing', '_writecheck', '_didModify', '_seekable', 'start_dir', 'fp')
+
+def _can_write_compressed(zip_file):
+    """Whether members compressed by _compress_member can be written into zip_file by _write_compressed."""
+    if sys.version_info < (3, 6) or hasattr(zipfile, '_get_compressor') == False: return False
+    return all(hasattr(zip_file, name) for name in _ZIPFILE_INTERNALS)
+
+def _write_compressed(zip_file, zinfo, compress_type, crc, file_size, data):
+    """
+    Write member whose data has been compressed already into zip_file, in the same way as ZipFile.write.
+    It uses internals of zipfile, so check _can_write_compressed(zip_file) before calling it.
+    """
+    with zip_file._lock:
+        if zip_file._writing: raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+        zinfo.compress_type = compress_type
+        zinfo.file_size = file_size
+        zinfo.compress_size = len(data)
+        zinfo.CRC = crc
+        # sizes are known beforehand, so data descriptor is not needed even if the output is not seekable
+        zinfo.flag_bits = 0x02 if compress_type == zipfile.ZIP_LZMA else 0x00 # lzma data has end-of-stream marker
+        if zip_file._seekable: zip_file.fp.seek(zip_file.start_dir)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        zip_file.fp.write(zinfo.FileHeader())
+        zip_file.fp.write(data)
+        zip_file.start_dir = zip_file.fp.tell()
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
+
+class _RawNameZipInfo(zipfile.ZipInfo):
+    """ZipInfo whose name is written as raw_filename bytes (e.g. sjis for Windows) without UTF-8 flag."""
+    __slots__ = ('raw_filename',)
+
+    def _encodeFilenameFlags(self):
+        return self.raw_filename, self.flag_bits & ~0x800
@@ -0,0 +1,127 @@
+# coding:utf-8
+import unittest, os, shutil, sys, asyncio
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from async_easy_crypt import AsyncEasyCrypt as aec
+from easy_crypt import EasyCrypt as ec
+
+class AsyncEasyCryptTest(unittest.TestCase):
+    """Test class for AsyncEasyCrypt"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_async_easy_crypt'
+    TEST_MASTER_PSWD = 'test_mst_pswd'
+    TEST_FILE_COUNT = 8
+    BACKENDS = ['openssl', 'auto']
+
+    test_tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        os.makedirs(cls.test_tmp_dir, exist_ok=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(cls.test_tmp_dir)
+
+    def write_files(self, name):
+        paths = [os.path.join(self.test_tmp_dir, '{0}{1}.txt'.format(name, i)) for i in range(self.TEST_FILE_COUNT)]
+        for path in paths:
+            with open(path, 'w') as test_file:
+                test_file.write(path)
+        return paths
+
+    def pswd_provider(self, pswds):
+        """Async password provider which gives pswds in order."""
+        async def provider(msg):
+            await asyncio.sleep(0)
+            return pswds.pop(0)
+        return provider
+
+    # ========================== test methods ==========================
+
+    def test_encrypt_decrypt_files(self):
+        for backend in self.BACKENDS:
+            paths = self.write_files('files_' + backend)
+            enc_paths = [path + ec.ENCRYPTED_EXT for path in paths]
+
+            async def run():
+                limiter = asyncio.Semaphore(3)
+                res = await asyncio.gather(*[aec.encrypt_file(path, self.TEST_MASTER_PSWD, backend=backend, limiter=limiter)
+                        for path in paths])
+                for path in paths: os.remove(path)
+                pswds = ['wrong_pswd', self.TEST_MASTER_PSWD] + [self.TEST_MASTER_PSWD] * (len(paths) - 1)
+                provider = self.pswd_provider(pswds)
+                res += await asyncio.gather(*[aec.decrypt_file(path, pswd_input_func=provider, backend=backend,
+                        limiter=limiter) for path in enc_paths])
+                return res
+            expected = [True] * len(paths) * 2
+            actual = asyncio.run(run())
+            self.assertEqual(expected, actual)
+            for path in paths:
+                with open(path, 'r') as dec_file:
+                    self.assertEqual(path, dec_file.read())
+
+            expected = paths[0]
+            actual = asyncio.run(aec.get_decrypted_txt(enc_paths[0], backend=backend,
+                    pswd_input_func=self.pswd_provider(['wrong_pswd', self.TEST_MASTER_PSWD])))
+            self.assertEqual(expected, actual)
+            # normal function can be given as well
+            actual = asyncio.run(aec.get_decrypted_txt(enc_paths[0], backend=backend,
+                    pswd_input_func=lambda msg: self.TEST_MASTER_PSWD))
+            self.assertEqual(expected, actual)
+            self.assertEqual(False, asyncio.run(aec.encrypt_file(paths[0] + '.no_exist', self.TEST_MASTER_PSWD)))
+
+    def test_encrypt_decrypt_dir(self):
+        for archive_format in [ec.ZIP_FORMAT, ec.TAR_FORMAT]:
+            dir_path = os.path.join(self.test_tmp_dir, 'dir_' + archive_format)
+            os.makedirs(dir_path)
+            with open(os.path.join(dir_path, 'a.txt'), 'w') as test_file:
+                test_file.write('a')
+            enc_path = dir_path + '.{0}{1}'.format(archive_format, ec.ENCRYPTED_EXT)
+
+            expected = True
+            actual = asyncio.run(aec.encrypt_dir(dir_path, pswd_input_func=self.pswd_provider([self.TEST_MASTER_PSWD] * 2),
+                    archive_format=archive_format))
+            self.assertEqual(expected, actual)
+            dst_dir_path = dir_path + '_dec'
+            actual = asyncio.run(aec.decrypt_dir(enc_path, dst_dir_path,
+                    pswd_input_func=self.pswd_provider(['wrong_pswd', self.TEST_MASTER_PSWD])))
+            self.assertEqual(expected, actual)
+            dec_files = [os.path.join(root, name) for root, dirs, names in os.walk(dst_dir_path) for name in names]
+            self.assertEqual(True, any(path.endswith('a.txt') for path in dec_files))
+
+    def test_cancel(self):
+        paths = self.write_files('cancel')
+        for backend in self.BACKENDS:
+            enc_path = paths[0] + ec.ENCRYPTED_EXT
+
+            async def cancel_encrypt():
+                task = asyncio.ensure_future(aec.encrypt_file(paths[0], self.TEST_MASTER_PSWD, backend=backend))
+                await asyncio.sleep(0)
+                task.cancel()
+                await task
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(cancel_encrypt())
+            self.assertEqual(False, os.path.exists(enc_path))
+
+            # cancelled while waiting for password
+            self.assertEqual(True, asyncio.run(aec.encrypt_file(paths[0], self.TEST_MASTER_PSWD, backend=backend)))
+            async def cancel_decrypt():
+                never = asyncio.Event()
+                async def provider(msg):
+                    await never.wait()
+                task = asyncio.ensure_future(aec.decrypt_file(enc_path, paths[0] + '.dec', pswd_input_func=provider,
+                        backend=backend))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                await task
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(cancel_decrypt())
+            self.assertEqual(False, os.path.exists(paths[0] + '.dec'))
+            os.remove(enc_path)
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
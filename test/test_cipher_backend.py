@@ -0,0 +1,329 @@
+# coding:utf-8
+import unittest, os, shutil, sys
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from cipher_backend import BackendRegistry, CipherBackend, CryptographyBackend, OpensslBackend, ChunkedGcmBackend, DecryptError
+from key_agent import KeyCache
+
+class CipherBackendTest(unittest.TestCase):
+    """Test class for cipher backends"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_cipher_backend'
+    TEST_FILE_NAME = 'test.bin'
+    TEST_MASTER_PSWD = 'mst_pswd'
+    # not a multiple of block size nor of base64 line length
+    TEST_FILE_CONTENT = os.urandom(100 * 1000 + 7)
+
+    test_tmp_dir = None
+    test_file_path = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        if os.path.exists(cls.test_tmp_dir) == False:
+            os.makedirs(cls.test_tmp_dir)
+        cls.test_file_path = os.path.join(cls.test_tmp_dir, cls.TEST_FILE_NAME)
+        with open(cls.test_file_path, 'wb') as test_file:
+            test_file.write(cls.TEST_FILE_CONTENT)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(cls.test_tmp_dir)
+
+    def read_file(self, path):
+        with open(path, 'rb') as rfile:
+            return rfile.read()
+
+    def check_round_trip(self, enc_backend, dec_backend, output_format=None):
+        enc_path = self.test_file_path + '.enc'
+        dec_path = self.test_file_path + '.dec'
+        self.assertEqual(True, enc_backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, output_format))
+        expected_format = output_format if output_format != None else CipherBackend.DEFAULT_FORMAT
+        self.assertEqual(expected_format, CipherBackend.detect_format(enc_path))
+        self.assertEqual(True, dec_backend.decrypt_file(enc_path, self.TEST_MASTER_PSWD, dec_path))
+        self.assertEqual(self.TEST_FILE_CONTENT, self.read_file(dec_path))
+        self.assertEqual(self.TEST_FILE_CONTENT, dec_backend.decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(None, dec_backend.decrypt_bytes(enc_path, 'wrong_pswd'))
+        os.remove(enc_path)
+        os.remove(dec_path)
+
+    # ========================== test methods ==========================
+
+    def test_openssl_backend(self):
+        self.check_round_trip(OpensslBackend(), OpensslBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_cryptography_backend(self):
+        self.check_round_trip(CryptographyBackend(), CryptographyBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_backend_compatibility(self):
+        self.check_round_trip(CryptographyBackend(), OpensslBackend())
+        self.check_round_trip(OpensslBackend(), CryptographyBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_base64_format(self):
+        for enc_backend in [OpensslBackend(), CryptographyBackend()]:
+            for dec_backend in [OpensslBackend(), CryptographyBackend()]:
+                self.check_round_trip(enc_backend, dec_backend, CipherBackend.BASE64_FORMAT)
+
+    def test_binary_format_size(self):
+        enc_path = self.test_file_path + '.enc'
+        OpensslBackend().encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, key_check=False)
+        # magic and salt (16 bytes) + padded content, without base64 overhead
+        content_len = len(self.TEST_FILE_CONTENT)
+        expected_len = 16 + content_len + 16 - content_len % 16
+        self.assertEqual(expected_len, os.path.getsize(enc_path))
+        self.assertEqual(CipherBackend.SALT_MAGIC, self.read_file(enc_path)[:8])
+        OpensslBackend().encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+        self.assertEqual(CipherBackend.ENVELOPE_HEADER_LEN + expected_len, os.path.getsize(enc_path))
+        os.remove(enc_path)
+
+    def check_key_check(self, backend, headless_backend=OpensslBackend()):
+        enc_path = self.test_file_path + '.enc'
+        dec_path = self.test_file_path + '.dec'
+        backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+        self.assertEqual(True, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(False, CipherBackend.check_key(enc_path, 'wrong_pswd'))
+        # rejected before creating output
+        self.assertEqual(False, backend.decrypt_file(enc_path, 'wrong_pswd', dec_path))
+        self.assertEqual(False, os.path.exists(dec_path))
+        with self.assertRaises(DecryptError):
+            backend.open_decrypt_stream('wrong_pswd', enc_path)
+        # openssl command (or headless_backend) decrypts the file without its first line with the file key
+        with open(enc_path, 'rb') as efile:
+            efile.readline()
+            with open(dec_path, 'wb') as dfile:
+                dfile.write(efile.read())
+        file_pswd = CipherBackend.read_file_key(enc_path, self.TEST_MASTER_PSWD)
+        self.assertEqual(None, CipherBackend.read_file_key(enc_path, 'wrong_pswd'))
+        self.assertEqual(self.TEST_FILE_CONTENT, headless_backend.decrypt_bytes(dec_path, file_pswd))
+        self.assertEqual(None, headless_backend.decrypt_bytes(dec_path, self.TEST_MASTER_PSWD))
+        # files without the header have no key check value
+        backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, key_check=False)
+        self.assertEqual(None, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD))
+        os.remove(enc_path)
+        os.remove(dec_path)
+
+    def test_openssl_key_check(self):
+        self.check_key_check(OpensslBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_cryptography_key_check(self):
+        self.check_key_check(CryptographyBackend())
+
+    def test_rotate_key(self):
+        enc_path = self.test_file_path + '.enc'
+        new_pswd = 'new_mst_pswd'
+        OpensslBackend().encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+        enc_bytes = self.read_file(enc_path)
+        self.assertEqual(False, CipherBackend.rotate_key(enc_path, 'wrong_pswd', new_pswd))
+        self.assertEqual(enc_bytes, self.read_file(enc_path))
+        self.assertEqual(True, CipherBackend.rotate_key(enc_path, self.TEST_MASTER_PSWD, new_pswd))
+        # only the header is rewritten
+        rotated_bytes = self.read_file(enc_path)
+        self.assertEqual(len(enc_bytes), len(rotated_bytes))
+        self.assertEqual(enc_bytes[CipherBackend.ENVELOPE_HEADER_LEN:], rotated_bytes[CipherBackend.ENVELOPE_HEADER_LEN:])
+        self.assertEqual(False, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(None, OpensslBackend().decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(self.TEST_FILE_CONTENT, OpensslBackend().decrypt_bytes(enc_path, new_pswd))
+
+        # files of older versions (with key check header) and of openssl command have to be encrypted again
+        OpensslBackend().encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, key_check=False)
+        self.assertEqual(None, CipherBackend.rotate_key(enc_path, self.TEST_MASTER_PSWD, new_pswd))
+        enc_bytes = self.read_file(enc_path)
+        with open(enc_path, 'wb') as efile:
+            efile.write(CipherBackend.create_key_check_header(self.TEST_MASTER_PSWD) + enc_bytes)
+        self.assertEqual(None, CipherBackend.rotate_key(enc_path, self.TEST_MASTER_PSWD, new_pswd))
+        self.assertEqual(True, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(False, CipherBackend.check_key(enc_path, 'wrong_pswd'))
+        self.assertEqual(self.TEST_FILE_CONTENT, OpensslBackend().decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        os.remove(enc_path)
+
+    def test_kdf(self):
+        kdf, params = CipherBackend.parse_kdf_spec(CipherBackend.calibrate_kdf(CipherBackend.KDF_PBKDF2, 0.001))
+        self.assertEqual(CipherBackend.KDF_PBKDF2, kdf)
+        self.assertEqual(True, params[0] >= CipherBackend.PBKDF2_MIN_ITERATIONS)
+        self.assertEqual('scrypt-16384-8-1', CipherBackend.calibrate_kdf(CipherBackend.KDF_SCRYPT, 0.001))
+        for kdf_spec in ['pbkdf2-sha256-0', 'pbkdf2-md5-1000', 'scrypt-1000-8-1', 'scrypt-{0}-8-1'.format(2 ** 30), 'bcrypt-10']:
+            with self.assertRaises(ValueError):
+                CipherBackend.parse_kdf_spec(kdf_spec)
+
+        enc_path = self.test_file_path + '.enc'
+        default_kdf, default_cache = CipherBackend.KDF, CipherBackend.KEY_CACHE
+        CipherBackend.KDF = CipherBackend.KDF_SCRYPT
+        try:
+            OpensslBackend().encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+            # parameters are read from the header
+            CipherBackend.KEY_CACHE = None
+            with open(enc_path, 'rb') as efile:
+                kdf_spec, salt, nonce, wrapped_key, tag = CipherBackend.read_envelope_header(efile)
+            self.assertEqual(CipherBackend.KDF_SCRYPT, CipherBackend.parse_kdf_spec(kdf_spec)[0])
+            self.assertEqual(self.TEST_FILE_CONTENT, OpensslBackend().decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+            self.assertEqual(False, CipherBackend.check_key(enc_path, 'wrong_pswd'))
+        finally:
+            CipherBackend.KDF, CipherBackend.KEY_CACHE = default_kdf, default_cache
+
+        # files of a process share the kdf salt, but not the wrapping key
+        header, file_pswd = CipherBackend.create_file_header(self.TEST_MASTER_PSWD)
+        other_header, other_file_pswd = CipherBackend.create_file_header(self.TEST_MASTER_PSWD)
+        self.assertEqual(header.split()[2], other_header.split()[2])
+        self.assertNotEqual(header.split()[3], other_header.split()[3])
+        self.assertEqual(CipherBackend.ENVELOPE_HEADER_LEN, len(header))
+
+        # too costly parameters in a header are rejected
+        enc_bytes = self.read_file(enc_path)
+        header_len = CipherBackend.ENVELOPE_HEADER_LEN
+        fields = enc_bytes[len(CipherBackend.ENVELOPE_MAGIC):header_len].split()
+        fields[0] = b'pbkdf2-sha256-99999999999'
+        with open(enc_path, 'wb') as efile:
+            efile.write(CipherBackend.ENVELOPE_MAGIC + b' '.join(fields).ljust(header_len - len(CipherBackend.ENVELOPE_MAGIC) - 1)
+                    + b'\n' + enc_bytes[header_len:])
+        self.assertEqual(False, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD))
+        self.assertEqual(None, OpensslBackend().decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        os.remove(enc_path)
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_cryptography_decrypt_file_failed(self):
+        enc_path = self.test_file_path + '.enc'
+        dec_path = self.test_file_path + '.dec'
+        backend = CryptographyBackend()
+        backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+        # partial output must not be left
+        self.assertEqual(False, backend.decrypt_file(enc_path, 'wrong_pswd', dec_path))
+        self.assertEqual(False, os.path.exists(dec_path))
+        # not an encrypted file
+        self.assertEqual(False, backend.decrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, dec_path))
+        os.remove(enc_path)
+
+    def check_encrypt_stream(self, backend):
+        enc_path = self.test_file_path + '.enc'
+        enc_stream = backend.open_encrypt_stream(self.TEST_MASTER_PSWD, enc_path)
+        enc_stream.write(self.TEST_FILE_CONTENT[:10])
+        enc_stream.write(self.TEST_FILE_CONTENT[10:])
+        enc_stream.close()
+        self.assertEqual(True, enc_stream.succeeded)
+        self.assertEqual(self.TEST_FILE_CONTENT, OpensslBackend().decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        # aborted stream does not leave output
+        enc_stream = backend.open_encrypt_stream(self.TEST_MASTER_PSWD, enc_path)
+        enc_stream.write(self.TEST_FILE_CONTENT)
+        enc_stream.abort()
+        self.assertEqual(False, os.path.exists(enc_path))
+
+    def test_openssl_encrypt_stream(self):
+        self.check_encrypt_stream(OpensslBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_cryptography_encrypt_stream(self):
+        self.check_encrypt_stream(CryptographyBackend())
+
+    def check_decrypt_stream(self, backend):
+        self.check_decrypt_stream_of(OpensslBackend(), backend)
+
+    def check_decrypt_stream_of(self, enc_backend, backend):
+        enc_path = self.test_file_path + '.enc'
+        # without key check, wrong password is noticed while reading
+        enc_backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, key_check=False)
+        dec_stream = backend.open_decrypt_stream(self.TEST_MASTER_PSWD, enc_path)
+        actual = dec_stream.read(10) + dec_stream.read()
+        dec_stream.close()
+        self.assertEqual(self.TEST_FILE_CONTENT, actual)
+
+        dec_stream = backend.open_decrypt_stream('wrong_pswd', enc_path)
+        with self.assertRaises(DecryptError):
+            dec_stream.read()
+        dec_stream.close()
+        # closing before the end is possible
+        dec_stream = backend.open_decrypt_stream(self.TEST_MASTER_PSWD, enc_path)
+        dec_stream.read(10)
+        dec_stream.close()
+        os.remove(enc_path)
+
+    def test_openssl_decrypt_stream(self):
+        self.check_decrypt_stream(OpensslBackend())
+
+    @unittest.skipUnless(CryptographyBackend.is_available(), 'cryptography is not installed')
+    def test_cryptography_decrypt_stream(self):
+        self.check_decrypt_stream(CryptographyBackend())
+
+    @unittest.skipUnless(ChunkedGcmBackend.is_available(), 'cryptography is not installed')
+    def test_chunked_gcm_backend(self):
+        # small chunks so that the file is split among worker threads
+        backend = ChunkedGcmBackend(max_workers=2, chunk_size=4096)
+        self.check_round_trip(backend, backend)
+        self.check_round_trip(backend, backend, CipherBackend.BASE64_FORMAT)
+        # decrypted without selecting the backend
+        self.check_round_trip(backend, CryptographyBackend())
+        self.check_key_check(backend, backend)
+        self.check_decrypt_stream_of(backend, backend)
+
+        enc_path = self.test_file_path + '.enc'
+        raw_path = self.test_file_path + '.raw'
+        for content in [b'', b'a', b'a' * 4096, b'a' * 4096 * 3]:
+            with open(raw_path, 'wb') as rfile:
+                rfile.write(content)
+            self.assertEqual(True, backend.encrypt_file(raw_path, self.TEST_MASTER_PSWD, enc_path))
+            self.assertEqual(content, backend.decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        os.remove(raw_path)
+
+        # truncated or modified files are rejected
+        backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+        enc_bytes = self.read_file(enc_path)
+        record_len = 4096 + ChunkedGcmBackend.TAG_LEN
+        for broken_bytes in [enc_bytes[:-record_len], enc_bytes[:-1], enc_bytes[:-5] + b'xxxxx']:
+            with open(enc_path, 'wb') as efile:
+                efile.write(broken_bytes)
+            self.assertEqual(None, backend.decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+
+        # data key is derived from the random file key by HKDF, and only keys of the master password are cached
+        default_cache = CipherBackend.KEY_CACHE
+        CipherBackend.KEY_CACHE = KeyCache()
+        try:
+            for i in range(3):
+                backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path)
+                with open(enc_path, 'rb') as efile:
+                    self.assertNotEqual(None, CipherBackend.read_envelope_header(efile))
+                    self.assertEqual(ChunkedGcmBackend.GCM_FILE_KEY_MAGIC, efile.read(len(ChunkedGcmBackend.GCM_FILE_KEY_MAGIC)))
+                self.assertEqual(self.read_file(self.test_file_path), backend.decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+            self.assertEqual(1, len(CipherBackend.KEY_CACHE._entries))
+        finally:
+            CipherBackend.KEY_CACHE = default_cache
+        # without envelope header, the key is derived from the password by PBKDF2
+        backend.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, enc_path, key_check=False)
+        self.assertEqual(ChunkedGcmBackend.GCM_MAGIC, self.read_file(enc_path)[:len(ChunkedGcmBackend.GCM_MAGIC)])
+        self.assertEqual(self.read_file(self.test_file_path), backend.decrypt_bytes(enc_path, self.TEST_MASTER_PSWD))
+        os.remove(enc_path)
+
+    def test_evp_bytes_to_key(self):
+        # key and iv printed by "openssl enc -aes-256-cbc -md sha256 -k mst_pswd -S 0001020304050607 -P"
+        key, iv = CryptographyBackend.evp_bytes_to_key(self.TEST_MASTER_PSWD, bytes(range(8)))
+        self.assertEqual('386E27413A311D79A079AAF8002AE34F35673FCD33E449CF4007A113C311370B', key.hex().upper())
+        self.assertEqual('F93535519A1CC846A730E6DBF9A9CC49', iv.hex().upper())
+
+    def test_registry(self):
+        self.assertEqual(None, BackendRegistry.get('no_such_backend'))
+        self.assertEqual(True, isinstance(BackendRegistry.get('openssl'), OpensslBackend))
+        self.assertEqual(True, isinstance(BackendRegistry.get(), CipherBackend))
+        backend = OpensslBackend()
+        self.assertEqual(backend, BackendRegistry.get(backend))
+        self.assertEqual(True, 'openssl' in BackendRegistry.names())
+        self.assertEqual(True, BackendRegistry.AUTO in BackendRegistry.names())
+        # backends which are not auto_selectable are skipped by 'auto' whatever the registration order is
+        self.assertEqual(False, ChunkedGcmBackend.auto_selectable)
+        backends = BackendRegistry.BACKENDS.copy()
+        try:
+            BackendRegistry.BACKENDS.clear()
+            BackendRegistry.register(ChunkedGcmBackend)
+            BackendRegistry.register(OpensslBackend)
+            self.assertEqual(True, isinstance(BackendRegistry.get(BackendRegistry.AUTO), OpensslBackend))
+            BackendRegistry.BACKENDS.clear()
+            BackendRegistry.register(ChunkedGcmBackend)
+            self.assertEqual(None, BackendRegistry.get(BackendRegistry.AUTO))
+        finally:
+            BackendRegistry.BACKENDS.clear()
+            BackendRegistry.BACKENDS.update(backends)
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
@@ -0,0 +1,142 @@
+# coding:utf-8
+import unittest, os, shutil, sys
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from dir_container import DirContainer as dc
+
+class DirContainerTest(unittest.TestCase):
+    """Test class for DirContainer"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_dir_container'
+    RAW_DIR_NAME = 'raw_dir'
+    TEST_MASTER_PSWD = 'mst_pswd'
+    TEST_FILES = {'a.txt': 'a', 'sub/b.txt': 'b', 'sub/c.txt': 'c'}
+
+    test_tmp_dir = None
+    raw_dir = None
+    container = None
+    restored_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        cls.raw_dir = os.path.join(cls.test_tmp_dir, cls.RAW_DIR_NAME)
+        cls.container = cls.raw_dir + dc.CONTAINER_EXT
+        cls.restored_dir = os.path.join(cls.test_tmp_dir, 'restored')
+
+    def setUp(self):
+        for rel_path, content in self.TEST_FILES.items():
+            self.write_file(rel_path, content)
+
+    def tearDown(self):
+        if os.path.exists(self.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(self.test_tmp_dir)
+
+    def write_file(self, rel_path, content, dir_path=None):
+        if dir_path == None: dir_path = self.raw_dir
+        file_path = os.path.join(dir_path, rel_path)
+        if os.path.exists(os.path.dirname(file_path)) == False:
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as wfile:
+            wfile.write(content)
+
+    def read_files(self, dir_path):
+        files = {}
+        for rel_path in dc.scan_dir(dir_path):
+            with open(os.path.join(dir_path, rel_path), 'r') as rfile:
+                files[rel_path] = rfile.read()
+        return files
+
+    # ========================== test methods ==========================
+
+    def test_update(self):
+        expected = None
+        actual = dc.update(os.path.join(self.test_tmp_dir, 'ghost'), self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        actual = dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual(sorted(self.TEST_FILES.keys()), actual['added'])
+        objects_before = dc.read_manifest(self.container, self.TEST_MASTER_PSWD)['files']
+
+        # nothing changed
+        actual = dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual(sorted(self.TEST_FILES.keys()), actual['unchanged'])
+
+        self.write_file('sub/b.txt', 'bb')
+        self.write_file('d.txt', 'd')
+        os.remove(os.path.join(self.raw_dir, 'sub', 'c.txt'))
+        # touched but content is the same
+        os.utime(os.path.join(self.raw_dir, 'a.txt'), ns=(1, 1))
+        actual = dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual({'added': ['d.txt'], 'updated': ['sub/b.txt'], 'removed': ['sub/c.txt'], 'unchanged': ['a.txt']}, actual)
+        objects_after = dc.read_manifest(self.container, self.TEST_MASTER_PSWD)['files']
+        self.assertEqual(objects_before['a.txt']['object'], objects_after['a.txt']['object'])
+        self.assertNotEqual(objects_before['sub/b.txt']['object'], objects_after['sub/b.txt']['object'])
+        # objects of removed or updated files are deleted
+        expected = sorted(entry['object'] + dc.OBJECT_EXT for entry in objects_after.values())
+        actual = sorted(os.listdir(os.path.join(self.container, dc.OBJECTS_DIR_NAME)))
+        self.assertEqual(expected, actual)
+
+        # wrong password
+        expected = None
+        actual = dc.update(self.raw_dir, self.container, 'wrong_pswd')
+        self.assertEqual(expected, actual)
+
+    def test_restore(self):
+        expected = False
+        actual = dc.restore(self.container, self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        expected = False
+        actual = dc.restore(self.container, self.restored_dir, 'wrong_pswd')
+        self.assertEqual(expected, actual)
+        self.assertEqual(False, os.path.exists(self.restored_dir))
+
+        expected = True
+        actual = dc.restore(self.container, self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        self.assertEqual(self.TEST_FILES, self.read_files(self.restored_dir))
+        # mtime is restored, so restored directory can be updated incrementally
+        self.assertEqual(os.stat(os.path.join(self.raw_dir, 'a.txt')).st_mtime_ns,
+                os.stat(os.path.join(self.restored_dir, 'a.txt')).st_mtime_ns)
+
+    def test_list_files(self):
+        expected = None
+        actual = dc.list_files(self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        expected = [('a.txt', 1), ('sub/b.txt', 1), ('sub/c.txt', 1)]
+        actual = dc.list_files(self.container, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        expected = None
+        actual = dc.list_files(self.container, 'wrong_pswd')
+        self.assertEqual(expected, actual)
+
+    def test_extract(self):
+        dc.update(self.raw_dir, self.container, self.TEST_MASTER_PSWD)
+        expected = False
+        actual = dc.extract(self.container, 'no_such_file', self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        expected = True
+        actual = dc.extract(self.container, 'sub/b.txt', self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        self.assertEqual({'sub/b.txt': 'b'}, self.read_files(self.restored_dir))
+
+        # existing files are not overwritten
+        expected = False
+        actual = dc.extract(self.container, 'sub', self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        shutil.rmtree(self.restored_dir)
+
+        expected = True
+        actual = dc.extract(self.container, 'sub/', self.restored_dir, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        self.assertEqual({'sub/b.txt': 'b', 'sub/c.txt': 'c'}, self.read_files(self.restored_dir))
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
@@ -1,8 +1,11 @@
 # coding:utf-8
-import os, sys, argparse, unittest, shutil
+import os, sys, argparse, unittest, shutil, stat, hashlib
+from unittest import mock
 # to import script from other folder
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
 from easy_crypt import EasyCrypt as ec
+from cipher_backend import BackendRegistry, CipherBackend, DecryptError
+from executor import CommandExecutor, OperationTimeout
 
 class EasyCryptTest(unittest.TestCase):
     """docstring for EasyCryptTest"""
@@ -168,6 +171,25 @@ class EasyCryptTest(unittest.TestCase):
 
     # def test_confirm_pswd_print(self):
 
+    def test_encrypt_file_with_header(self):
+        expected = False
+        actual = ec.encrypt_file_with_header(self.test_no_exist_path, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        new_pswd = 'new_mst_pswd'
+        encrypt_file_path = self.test_file_path + ec.ENCRYPTED_EXT
+        for stream in [True, False]:
+            expected = True
+            actual = ec.encrypt_file_with_header(self.test_file_path, new_pswd, stream=stream)
+            self.assertEqual(expected, actual)
+            # old header is replaced with new one
+            expected = ec.create_header(new_pswd) + os.linesep + self.TEST_FILE_NAME
+            actual = ec.get_decrypted_txt(encrypt_file_path, pswd_input_func=lambda msg: new_pswd).rstrip()
+            self.assertEqual(expected, actual)
+            os.remove(encrypt_file_path)
+        # plaintext temporary file is not left
+        self.assertEqual(False, os.path.exists(self.test_file_path + '.tmp'))
+
     def test_encrypt_file(self):
         expected = False
         actual = ec.encrypt_file(self.test_no_exist_path, self.TEST_MASTER_PSWD)
@@ -184,6 +206,101 @@ class EasyCryptTest(unittest.TestCase):
         self.assertEqual(expected, actual)
         os.remove(tmp_enc_export_path)
 
+        expected = False
+        actual = ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, backend='no_such_backend')
+        self.assertEqual(expected, actual)
+
+        expected = True
+        actual = ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, backend='openssl')
+        self.assertEqual(expected, actual)
+        os.remove(self.test_file_path + ec.ENCRYPTED_EXT)
+
+    def test_encrypt_files(self):
+        tmp_paths = [os.path.join(self.test_main_dir_path, 'batch{0}.txt'.format(i)) for i in range(4)]
+        for path in tmp_paths:
+            with open(path, 'w') as tmp_file:
+                tmp_file.write(path)
+        expected = dict((path, True) for path in tmp_paths)
+        expected[self.test_no_exist_path] = False
+        actual = ec.encrypt_files(tmp_paths + [self.test_no_exist_path], self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        enc_paths = [path + ec.ENCRYPTED_EXT for path in tmp_paths]
+        for path in tmp_paths: os.remove(path)
+        expected = dict((path, True) for path in enc_paths)
+        actual = ec.decrypt_files(enc_paths, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        for path in tmp_paths:
+            with open(path, 'r') as tmp_file:
+                self.assertEqual(path, tmp_file.read())
+            os.remove(path)
+
+        expected = dict((path, False) for path in enc_paths)
+        actual = ec.decrypt_files(enc_paths, 'wrong_pswd')
+        self.assertEqual(expected, actual)
+        self.assertEqual([False] * len(tmp_paths), [os.path.exists(path) for path in tmp_paths])
+        for path in enc_paths: os.remove(path)
+
+    def test_encrypt_files_key_scope(self):
+        tmp_paths = [os.path.join(self.test_main_dir_path, 'scope{0}.txt'.format(i)) for i in range(4)]
+        for path in tmp_paths:
+            with open(path, 'w') as tmp_file:
+                tmp_file.write(path)
+        enc_paths = [path + ec.ENCRYPTED_EXT for path in tmp_paths]
+        # calibrated once per process
+        iterations = CipherBackend.parse_kdf_spec(CipherBackend.kdf_spec())[1][0]
+        self.assertEqual(None, CipherBackend.KEY_CACHE)
+        with mock.patch('hashlib.pbkdf2_hmac', wraps=hashlib.pbkdf2_hmac) as pbkdf2_hmac:
+            kdf_calls = lambda: len([args for args, kwargs in pbkdf2_hmac.call_args_list if args[3] == iterations])
+            # the key of the password is derived once for all files of an operation
+            self.assertEqual(dict((path, True) for path in tmp_paths), ec.encrypt_files(tmp_paths, self.TEST_MASTER_PSWD))
+            self.assertEqual(1, kdf_calls())
+            self.assertEqual(dict((path, True) for path in enc_paths), ec.decrypt_files(enc_paths, self.TEST_MASTER_PSWD))
+            self.assertEqual(2, kdf_calls())
+            # and once for each call out of key scope
+            for path in tmp_paths: ec.encrypt_file(path, self.TEST_MASTER_PSWD)
+            self.assertEqual(2 + len(tmp_paths), kdf_calls())
+            with CipherBackend.key_scope():
+                for path in tmp_paths: ec.encrypt_file(path, self.TEST_MASTER_PSWD)
+            self.assertEqual(3 + len(tmp_paths), kdf_calls())
+        # keys are not kept after the operation
+        self.assertEqual(None, CipherBackend._SCOPE_CACHE)
+        for path in tmp_paths + enc_paths: os.remove(path)
+
+    def test_decrypt_batch(self):
+        tmp_paths = [os.path.join(self.test_main_dir_path, 'batch_txt{0}.txt'.format(i)) for i in range(3)]
+        for path in tmp_paths:
+            with open(path, 'w') as tmp_file:
+                tmp_file.write(path)
+        ec.encrypt_files(tmp_paths, self.TEST_MASTER_PSWD)
+        enc_paths = [path + ec.ENCRYPTED_EXT for path in tmp_paths]
+        for path in tmp_paths: os.remove(path)
+
+        # asked until the first file accepts the password
+        pswds = ['wrong_pswd', self.TEST_MASTER_PSWD]
+        expected = self.TEST_MASTER_PSWD
+        actual = ec.input_pswd([self.test_no_exist_path] + enc_paths, pswd_input_func=lambda msg: pswds.pop(0))
+        self.assertEqual(expected, actual)
+        self.assertEqual(None, ec.input_pswd([self.test_no_exist_path]))
+
+        expected = dict((path, True) for path in enc_paths)
+        actual = ec.decrypt_txt_files(enc_paths, self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        for path in tmp_paths:
+            with open(path, 'r') as tmp_file:
+                self.assertEqual(path, tmp_file.read())
+            os.remove(path)
+        expected = dict((path, False) for path in enc_paths)
+        actual = ec.decrypt_txt_files(enc_paths, 'wrong_pswd')
+        self.assertEqual(expected, actual)
+
+        # password is given only once
+        pswd_input_func = ec.once_pswd_input_func('wrong_pswd')
+        with self.assertRaises(DecryptError):
+            ec.decrypt_file(enc_paths[0], pswd_input_func=pswd_input_func)
+        self.assertEqual(False, os.path.exists(tmp_paths[0]))
+        for path in enc_paths: os.remove(path)
+
     def test_get_master_pswd_from_txt(self):
         expected = None
         actual = ec.get_master_pswd_from_txt(self.test_file_path, None)
@@ -216,12 +333,147 @@ class EasyCryptTest(unittest.TestCase):
         actual = ec.encrypt_dir(self.test_zip_dir_path, pswd_input_func=None)
         self.assertEqual(expected, actual)
 
+        # zip file may be left by other tests
+        if os.path.exists(self.test_zip_dir_path + '.zip'): os.remove(self.test_zip_dir_path + '.zip')
         expected = True
         encrypted_dir_path = self.test_zip_dir_path + '.zip' + ec.ENCRYPTED_EXT
         actual = ec.encrypt_dir(self.test_zip_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
         self.assertEqual(expected, actual)
+        # plaintext zip is not written when streaming
+        self.assertEqual(False, os.path.exists(self.test_zip_dir_path + '.zip'))
         os.remove(encrypted_dir_path)
 
+        for backend in ['openssl', 'auto']:
+            expected = True
+            actual = ec.encrypt_dir(self.test_zip_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, backend=backend)
+            self.assertEqual(expected, actual)
+            zip_bytes = ec.get_decrypted_txt(encrypted_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, encode='latin-1')
+            self.assertEqual(True, zip_bytes.startswith('PK'))
+            os.remove(encrypted_dir_path)
+
+        expected = True
+        actual = ec.encrypt_dir(self.test_zip_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, stream=False)
+        self.assertEqual(expected, actual)
+        self.assertEqual(True, os.path.exists(self.test_zip_dir_path + '.zip'))
+        os.remove(self.test_zip_dir_path + '.zip')
+        os.remove(encrypted_dir_path)
+
+    def test_encrypt_dir_incremental(self):
+        expected = False
+        actual = ec.encrypt_dir_incremental(self.test_no_exist_path)
+        self.assertEqual(expected, actual)
+
+        inc_dir_path = os.path.join(self.test_main_dir_path, 'inc_test')
+        os.makedirs(inc_dir_path)
+        with open(os.path.join(inc_dir_path, self.TEST_ZIP_DIR_FILE_NAME), 'w') as test_file:
+            test_file.write('CONTENT')
+        container_path = inc_dir_path + '.encdir'
+        expected = True
+        for i in range(2):
+            actual = ec.encrypt_dir_incremental(inc_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+            self.assertEqual(expected, actual)
+        shutil.rmtree(inc_dir_path)
+
+        pswds = ['wrong_pswd', self.TEST_MASTER_PSWD]
+        actual = ec.decrypt_dir_incremental(container_path, pswd_input_func=lambda msg: pswds.pop(0))
+        self.assertEqual(expected, actual)
+        with open(os.path.join(inc_dir_path, self.TEST_ZIP_DIR_FILE_NAME), 'r') as dec_file:
+            self.assertEqual('CONTENT', dec_file.read())
+        shutil.rmtree(inc_dir_path)
+
+        expected = [(ec.MASTER_PASS_TXT, len(ec.create_header(self.TEST_MASTER_PSWD))), (self.TEST_ZIP_DIR_FILE_NAME, len('CONTENT'))]
+        actual = ec.list_container(container_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+
+        expected = True
+        actual = ec.extract_from_container(container_path, self.TEST_ZIP_DIR_FILE_NAME, inc_dir_path,
+                pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        self.assertEqual([self.TEST_ZIP_DIR_FILE_NAME], os.listdir(inc_dir_path))
+        shutil.rmtree(inc_dir_path)
+
+        # decrypt_dir handles containers too
+        expected = True
+        actual = ec.decrypt_dir(container_path, remove_enc_file=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        self.assertEqual(False, os.path.exists(container_path))
+        shutil.rmtree(inc_dir_path)
+
+    def test_encrypt_dir_files(self):
+        expected = False
+        actual = ec.encrypt_dir_files(self.test_no_exist_path)
+        self.assertEqual(expected, actual)
+
+        files_dir_path = os.path.join(self.test_main_dir_path, 'files_test')
+        rel_paths = ['a.txt', os.path.join('sub', 'b.txt'), os.path.join('sub', 'sub2', 'c.txt')]
+        for rel_path in rel_paths:
+            file_path = os.path.join(files_dir_path, rel_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as test_file:
+                test_file.write(rel_path)
+        enc_dir_path = files_dir_path + ec.MIRROR_EXT
+        expected = True
+        actual = ec.encrypt_dir(files_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, archive_format=ec.MIRROR_FORMAT)
+        self.assertEqual(expected, actual)
+        for rel_path in rel_paths:
+            self.assertEqual(True, os.path.exists(os.path.join(enc_dir_path, rel_path) + ec.ENCRYPTED_EXT))
+        # output is not overwritten
+        expected = False
+        actual = ec.encrypt_dir_files(files_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        shutil.rmtree(files_dir_path)
+
+        expected = True
+        pswds = ['wrong_pswd', self.TEST_MASTER_PSWD]
+        actual = ec.decrypt_dir(enc_dir_path, remove_enc_file=True, pswd_input_func=lambda msg: pswds.pop(0))
+        self.assertEqual(expected, actual)
+        self.assertEqual(False, os.path.exists(enc_dir_path))
+        for rel_path in rel_paths:
+            with open(os.path.join(files_dir_path, rel_path), 'r') as dec_file:
+                self.assertEqual(rel_path, dec_file.read())
+        self.assertEqual(True, os.path.exists(os.path.join(files_dir_path, ec.MASTER_PASS_TXT)))
+        shutil.rmtree(files_dir_path)
+
+    def test_rotate_pswd(self):
+        new_pswd = 'new_mst_pswd'
+        files_dir_path = os.path.join(self.test_main_dir_path, 'rotate_test')
+        os.makedirs(os.path.join(files_dir_path, 'sub'))
+        for rel_path in ['a.txt', os.path.join('sub', 'b.txt')]:
+            with open(os.path.join(files_dir_path, rel_path), 'w') as test_file:
+                test_file.write(rel_path)
+        enc_dir_path = files_dir_path + ec.MIRROR_EXT
+        ec.encrypt_dir_files(files_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        shutil.rmtree(files_dir_path)
+        # a file encrypted by openssl command is encrypted again with envelope header
+        legacy_path = os.path.join(enc_dir_path, 'legacy.txt' + ec.ENCRYPTED_EXT)
+        BackendRegistry.get('openssl').encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, legacy_path,
+                CipherBackend.BASE64_FORMAT, key_check=False)
+
+        pswds = ['wrong_pswd', self.TEST_MASTER_PSWD, new_pswd, new_pswd]
+        expected = True
+        actual = ec.rotate_pswd(enc_dir_path, pswd_input_func=lambda msg: pswds.pop(0))
+        self.assertEqual(expected, actual)
+        self.assertEqual(True, CipherBackend.check_key(legacy_path, new_pswd))
+        self.assertEqual(CipherBackend.BASE64_FORMAT, CipherBackend.detect_format(legacy_path))
+        self.assertEqual(False, os.path.exists(legacy_path + '.tmp'))
+        # wrong old password
+        expected = {legacy_path: False}
+        actual = ec.rotate_files([legacy_path], self.TEST_MASTER_PSWD, new_pswd)
+        self.assertEqual(expected, actual)
+
+        expected = True
+        actual = ec.decrypt_dir(enc_dir_path, remove_enc_file=True, pswd_input_func=lambda msg: new_pswd)
+        self.assertEqual(expected, actual)
+        with open(os.path.join(files_dir_path, 'sub', 'b.txt'), 'r') as dec_file:
+            self.assertEqual(os.path.join('sub', 'b.txt'), dec_file.read())
+        with open(os.path.join(files_dir_path, 'legacy.txt'), 'r') as dec_file:
+            self.assertEqual(self.TEST_FILE_CONTENT, dec_file.read())
+        shutil.rmtree(files_dir_path)
+
+        expected = False
+        actual = ec.rotate_pswd(self.test_no_exist_path)
+        self.assertEqual(expected, actual)
+
     def test_get_decrypted_txt(self):
         expected = None
         actual = ec.get_decrypted_txt(self.test_no_exist_path)
@@ -237,6 +489,18 @@ class EasyCryptTest(unittest.TestCase):
         encrypt_file_path = self.test_file_path + ec.ENCRYPTED_EXT
         actual = ec.get_decrypted_txt(encrypt_file_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
         self.assertEqual(expected, actual)
+        actual = ec.get_decrypted_txt(encrypt_file_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, backend='openssl')
+        self.assertEqual(expected, actual)
+        os.remove(encrypt_file_path)
+
+        # base64 format is detected on decryption
+        ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, output_format=ec.BASE64_FORMAT)
+        with open(encrypt_file_path, 'rb') as enc_file:
+            enc_file.readline() # key check header
+            self.assertEqual(b'U2FsdGVkX1', enc_file.read(10))
+        for backend in [None, 'openssl']:
+            actual = ec.get_decrypted_txt(encrypt_file_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, backend=backend)
+            self.assertEqual(expected, actual)
         os.remove(encrypt_file_path)
 
     def test_decrypt_txt_file(self):
@@ -254,6 +518,38 @@ class EasyCryptTest(unittest.TestCase):
         encrypt_file_path = self.test_file_path + ec.ENCRYPTED_EXT
         actual = ec.decrypt_txt_file(encrypt_file_path, remove_enc_file=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
         self.assertEqual(expected, actual)
+
+    def test_decrypt_txt_file_stream(self):
+        # multi byte characters over chunk boundaries and both kinds of line endings
+        raw_txt = ''.join('{0} あいう\r\n{0} えお\n'.format(i) for i in range(20000))
+        raw_file_path = os.path.join(self.test_main_dir_path, 'stream_test.txt')
+        encrypt_file_path = raw_file_path + ec.ENCRYPTED_EXT
+        with open(raw_file_path, 'w', encoding='utf-8', newline='') as raw_file:
+            raw_file.write(raw_txt)
+        for backend in [None, 'openssl']:
+            for key_check in [True, False]:
+                BackendRegistry.get(backend).encrypt_file(raw_file_path, self.TEST_MASTER_PSWD, encrypt_file_path, key_check=key_check)
+                expected = raw_txt
+                actual = ''.join(ec.iter_decrypted_txt(encrypt_file_path, self.TEST_MASTER_PSWD, backend=backend, chunk_size=1000))
+                self.assertEqual(expected, actual)
+
+                expected = raw_txt.splitlines(True)
+                actual = list(ec.iter_decrypted_txt(encrypt_file_path, self.TEST_MASTER_PSWD, backend=backend, lines=True))
+                self.assertEqual(expected, actual)
+
+                # the original file is kept while the password is wrong
+                pswds = iter(['wrong_pswd', self.TEST_MASTER_PSWD])
+                expected = True
+                actual = ec.decrypt_txt_file(encrypt_file_path, pswd_input_func=lambda msg: next(pswds), backend=backend,
+                        handle_decrypted_chunk_func=lambda line: line.upper(), lines=True, remove_enc_file=True)
+                self.assertEqual(expected, actual)
+                self.assertEqual(False, os.path.exists(encrypt_file_path))
+                self.assertEqual(False, os.path.exists(raw_file_path + '.tmp'))
+                with open(raw_file_path, 'r', encoding='utf-8', newline='') as raw_file:
+                    self.assertEqual(raw_txt.upper(), raw_file.read())
+                with open(raw_file_path, 'w', encoding='utf-8', newline='') as raw_file:
+                    raw_file.write(raw_txt)
+        os.remove(raw_file_path)
         
     def test_decrypt_file(self):
         expected = False
@@ -270,7 +566,51 @@ class EasyCryptTest(unittest.TestCase):
         encrypt_file_path = self.test_file_path + ec.ENCRYPTED_EXT
         actual = ec.decrypt_file(encrypt_file_path, remove_enc_file=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
         self.assertEqual(expected, actual)
+
+        # chunked gcm files are decrypted by the default backend
+        ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, backend='gcm')
+        actual = ec.decrypt_file(encrypt_file_path, remove_enc_file=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        self.assertEqual(expected, actual)
+        with open(self.test_file_path, 'r') as test_file:
+            self.assertEqual(self.TEST_FILE_CONTENT, test_file.read())
     
+    def test_timeout_and_max_attempts(self):
+        encrypt_file_path = self.test_file_path + ec.ENCRYPTED_EXT
+        ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD)
+        pswds = ['wrong_pswd'] * 3
+        expected = False
+        actual = ec.decrypt_file(encrypt_file_path, self.test_file_path + '.dec', pswd_input_func=lambda msg: pswds.pop(0),
+                max_attempts=2)
+        self.assertEqual(expected, actual)
+        self.assertEqual(1, len(pswds))
+        expected = None
+        actual = ec.get_decrypted_txt(encrypt_file_path, pswd_input_func=lambda msg: 'wrong_pswd', max_attempts=1)
+        self.assertEqual(expected, actual)
+
+        # openssl which hangs
+        hang_openssl_path = os.path.join(self.test_main_dir_path, 'hang_openssl')
+        with open(hang_openssl_path, 'w') as hang_file:
+            hang_file.write('#!/bin/sh\nexec sleep 10\n')
+        os.chmod(hang_openssl_path, stat.S_IRWXU)
+        CommandExecutor.OPENSSL = hang_openssl_path
+        try:
+            with self.assertRaises(OperationTimeout):
+                ec.encrypt_file(self.test_file_path, self.TEST_MASTER_PSWD, self.test_file_path + '.enc2',
+                        backend='openssl', timeout=0.2)
+            self.assertEqual(False, os.path.exists(self.test_file_path + '.enc2'))
+            with self.assertRaises(OperationTimeout):
+                ec.decrypt_file(encrypt_file_path, self.test_file_path + '.dec', backend='openssl',
+                        pswd_input_func=lambda msg: self.TEST_MASTER_PSWD, timeout=0.2)
+            self.assertEqual(False, os.path.exists(self.test_file_path + '.dec'))
+            encrypted_dir_path = self.test_zip_dir_path + '.tar' + ec.ENCRYPTED_EXT
+            with self.assertRaises(OperationTimeout):
+                ec.encrypt_dir(self.test_zip_dir_path, encrypted_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD,
+                        backend='openssl', archive_format=ec.TAR_FORMAT, timeout=0.2)
+            self.assertEqual(False, os.path.exists(encrypted_dir_path))
+        finally:
+            CommandExecutor.OPENSSL = 'openssl'
+        os.remove(encrypt_file_path)
+
     def test_decrypt_dir(self):
         expected = False
         # fails because it is dir
@@ -290,6 +630,31 @@ class EasyCryptTest(unittest.TestCase):
         actual = ec.decrypt_dir(encrypted_dir_path, remove_enc_file=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
         self.assertEqual(expected, actual)
 
+    def test_decrypt_dir_tar(self):
+        # other tests modify test_zip_dir_path, so use a dedicated directory
+        tar_dir_path = os.path.join(self.test_main_dir_path, 'tar_test')
+        os.makedirs(tar_dir_path)
+        with open(os.path.join(tar_dir_path, self.TEST_ZIP_DIR_FILE_NAME), 'w') as test_file:
+            test_file.write('CONTENT')
+        encrypted_dir_path = tar_dir_path + '.tar' + ec.ENCRYPTED_EXT
+        dst_dir_path = os.path.join(self.test_main_dir_path, 'tar_dst')
+        for backend in ['openssl', 'auto']:
+            expected = True
+            actual = ec.encrypt_dir(tar_dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD,
+                    backend=backend, archive_format=ec.TAR_FORMAT)
+            self.assertEqual(expected, actual)
+            self.assertEqual(False, os.path.exists(tar_dir_path + '.tar'))
+            # first password is wrong
+            pswds = ['wrong_pswd', self.TEST_MASTER_PSWD]
+            actual = ec.decrypt_dir(encrypted_dir_path, dst_dir_path, remove_enc_file=True,
+                    pswd_input_func=lambda msg: pswds.pop(0), backend=backend)
+            self.assertEqual(expected, actual)
+            with open(os.path.join(dst_dir_path, 'tar_test', self.TEST_ZIP_DIR_FILE_NAME), 'r') as dec_file:
+                self.assertEqual('CONTENT', dec_file.read())
+            self.assertEqual(False, os.path.exists(encrypted_dir_path))
+            shutil.rmtree(dst_dir_path)
+        shutil.rmtree(tar_dir_path)
+
     def test_gen_rnd_pswd(self):
         expected = 'iK2ZWeqh'
         actual = ec.gen_rnd_pswd(8, include_simbols=False, rnd_seed=1)
@@ -0,0 +1,77 @@
+# coding:utf-8
+import unittest, os, sys, time
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from executor import CommandExecutor, Deadline, OperationTimeout
+
+class CommandExecutorTest(unittest.TestCase):
+    """Test class for CommandExecutor"""
+
+    TEST_ECHO_ARGS = ['echo', 'EasyCryptTest']
+    TEST_ECHO_RESULT = b'EasyCryptTest' + os.linesep.encode()
+    TEST_FAIL_ARGS = ['echoEasyCryptTest']
+
+    # ========================== test methods ==========================
+
+    def test_build_openssl_args(self):
+        expected = ['openssl', 'aes-256-cbc', '-e', '-md', 'sha256', '-base64', '-in', 'in file', '-k', 'pa"ss']
+        actual = CommandExecutor.build_openssl_args('-e', 'in file', 'pa"ss')
+        self.assertEqual(expected, actual)
+
+        expected = ['openssl', 'aes-256-cbc', '-d', '-md', 'sha256', '-base64', '-in', 'a', '-k', 'b', '-out', 'c']
+        actual = CommandExecutor.build_openssl_args('-d', 'a', 'b', 'c')
+        self.assertEqual(expected, actual)
+
+        expected = ['openssl', 'aes-256-cbc', '-e', '-md', 'sha256', '-k', 'b']
+        actual = CommandExecutor.build_openssl_args('-e', None, 'b', base64_flg=False)
+        self.assertEqual(expected, actual)
+
+    def test_to_args(self):
+        expected = ['echo', 'a b']
+        actual = CommandExecutor.to_args('echo "a b"')
+        self.assertEqual(expected, actual)
+
+    def test_run(self):
+        result = CommandExecutor.run(self.TEST_FAIL_ARGS)
+        self.assertEqual(False, result.succeeded)
+        self.assertEqual(None, result.returncode)
+
+        result = CommandExecutor.run(self.TEST_ECHO_ARGS)
+        self.assertEqual(True, result.succeeded)
+        self.assertEqual(self.TEST_ECHO_RESULT, result.stdout_bytes)
+
+        result = CommandExecutor.run(['cat'], input_bytes=b'stdin')
+        self.assertEqual(b'stdin', result.stdout_bytes)
+
+    def test_submit_and_map(self):
+        with CommandExecutor(max_workers=2) as executor:
+            future = executor.submit(self.TEST_ECHO_ARGS)
+            self.assertEqual(self.TEST_ECHO_RESULT, future.result().stdout_bytes)
+
+            cmds = [['echo', str(i)] for i in range(10)]
+            actual = [result.stdout_bytes.strip() for result in executor.map(cmds)]
+            expected = [str(i).encode() for i in range(10)]
+            self.assertEqual(expected, actual)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(OperationTimeout):
+            CommandExecutor.run(['sleep', '10'], timeout=0.2)
+        self.assertEqual(True, time.monotonic() - start < 5)
+
+        self.assertEqual(None, Deadline.remaining())
+        with Deadline.start(10):
+            # nested deadline never extends the outer one
+            with Deadline.start(100):
+                self.assertEqual(True, Deadline.remaining() <= 10)
+            with CommandExecutor(max_workers=1) as executor:
+                actual = executor.submit_func(Deadline.remaining).result()
+                self.assertEqual(True, actual != None and actual <= 10)
+        self.assertEqual(None, Deadline.remaining())
+
+        with Deadline.start(0), CommandExecutor(max_workers=1) as executor:
+            with self.assertRaises(OperationTimeout):
+                executor.submit(self.TEST_ECHO_ARGS).result()
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
@@ -0,0 +1,159 @@
+# coding:utf-8
+import unittest, os, shutil, sys, time, socket, hashlib
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from key_agent import KeyCache, KeyAgent, KeyAgentClient
+from cipher_backend import CipherBackend, OpensslBackend
+from easy_crypt import EasyCrypt as ec
+
+class KeyAgentTest(unittest.TestCase):
+    """Test class for KeyCache and KeyAgent"""
+
+    TEST_MASTER_PSWD = 'mst_pswd'
+
+    def test_key_cache(self):
+        cache = KeyCache(ttl=60, max_entries=2)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        self.assertEqual(b'1', cache.get('a'))
+        # least recently used one is evicted
+        cache.put('c', b'3')
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertEqual(b'3', cache.get('c'))
+        # expired
+        cache.put('d', b'4', ttl=0.01)
+        time.sleep(0.02)
+        self.assertEqual(None, cache.get('d'))
+        cache.put('e', b'5', ttl=0.01)
+        time.sleep(0.02)
+        cache.purge()
+        self.assertEqual(1, len(cache))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_key_cache_default(self):
+        # derived keys are kept in memory only if the caller opts in
+        self.assertEqual(None, CipherBackend.KEY_CACHE)
+
+    def test_derive_key_cached(self):
+        calls = []
+        def derive():
+            calls.append(1)
+            return b'key'
+        default_cache = CipherBackend.KEY_CACHE
+        CipherBackend.KEY_CACHE = KeyCache()
+        try:
+            for i in range(3):
+                self.assertEqual(b'key', CipherBackend.derive_key_cached('kdf', self.TEST_MASTER_PSWD, b'salt', derive))
+            self.assertEqual(1, len(calls))
+            CipherBackend.derive_key_cached('kdf', 'other_pswd', b'salt', derive)
+            CipherBackend.derive_key_cached('kdf', self.TEST_MASTER_PSWD, b'other_salt', derive)
+            self.assertEqual(3, len(calls))
+            # the cache does not have the password
+            for expiry, value in CipherBackend.KEY_CACHE._entries.values():
+                self.assertEqual(False, self.TEST_MASTER_PSWD.encode('utf-8') in value)
+            # nor the hash of the password and the public salt, which would be a fast verifier of the password
+            cache_key = hashlib.sha256(b'kdf\0salt' + self.TEST_MASTER_PSWD.encode('utf-8')).hexdigest()
+            self.assertEqual(False, cache_key in CipherBackend.KEY_CACHE._entries)
+            self.assertEqual(False, cache_key.encode('ascii') in CipherBackend.KEY_CACHE._entries)
+            self.assertEqual(b'key', CipherBackend.KEY_CACHE.get(cache_key))
+            # entries are keyed with the secret of each cache
+            other_cache = KeyCache()
+            other_cache.put(cache_key, b'key')
+            self.assertEqual(set(), set(other_cache._entries.keys()) & set(CipherBackend.KEY_CACHE._entries.keys()))
+        finally:
+            CipherBackend.KEY_CACHE = default_cache
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'unix socket is not available')
+    def test_key_agent(self):
+        default_cache = CipherBackend.KEY_CACHE
+        agent = KeyAgent(ttl=60)
+        socket_dir = os.path.dirname(agent.socket_path)
+        thread = agent.start()
+        try:
+            # only the user can connect
+            self.assertEqual(0, os.stat(agent.socket_path).st_mode & 0o077)
+            client = KeyAgentClient(agent.socket_path)
+            self.assertEqual(True, client.is_running())
+            self.assertEqual(None, client.get('a'))
+            client.put('a', b'\x00\x01')
+            self.assertEqual(b'\x00\x01', client.get('a'))
+            client.remove('a')
+            self.assertEqual(None, client.get('a'))
+            client.put('b', b'2', ttl=0.01)
+            time.sleep(0.02)
+            self.assertEqual(None, client.get('b'))
+
+            CipherBackend.KEY_CACHE = client
+            test_file_path = os.path.join(socket_dir, 'test.txt')
+            with open(test_file_path, 'wb') as test_file:
+                test_file.write(b'test')
+            enc_path = test_file_path + '.enc'
+            # passwords not typed through the agent are not given to it
+            OpensslBackend().encrypt_file(test_file_path, self.TEST_MASTER_PSWD, enc_path)
+            self.assertEqual(None, client.get(KeyAgentClient.PSWD_KEY))
+
+            # typed password is given to the agent only when the header accepts it
+            typed = ['wrong_pswd', self.TEST_MASTER_PSWD]
+            asked = []
+            def input_func(msg):
+                asked.append(msg)
+                return typed[min(len(asked), len(typed)) - 1]
+            pswd_input_func = client.pswd_input_func(input_func)
+            self.assertEqual('wrong_pswd', pswd_input_func('Input master password: '))
+            self.assertEqual(None, client.get(KeyAgentClient.PSWD_KEY))
+            self.assertEqual(False, CipherBackend.check_key(enc_path, 'wrong_pswd'))
+            self.assertEqual(None, client.get(KeyAgentClient.PSWD_KEY))
+            self.assertEqual(self.TEST_MASTER_PSWD, pswd_input_func('Input master password: '))
+            self.assertEqual(None, client.get(KeyAgentClient.PSWD_KEY))
+            self.assertEqual(True, CipherBackend.check_key(enc_path, self.TEST_MASTER_PSWD) != False)
+            self.assertEqual(self.TEST_MASTER_PSWD.encode('utf-8'), client.get(KeyAgentClient.PSWD_KEY))
+            # and is not asked again among commands
+            self.assertEqual(self.TEST_MASTER_PSWD, client.pswd_input_func(input_func)('Input master password: '))
+            self.assertEqual(2, len(asked))
+            # a mistyped password does not replace the one held by the agent
+            typed[:] = ['typo_pswd']
+            pswd_input_func = client.pswd_input_func(input_func)
+            pswd_input_func('Input master password: ')
+            self.assertEqual('typo_pswd', pswd_input_func('Input master password: '))
+            self.assertEqual(3, len(asked))
+            self.assertEqual(False, CipherBackend.check_key(enc_path, 'typo_pswd'))
+            self.assertEqual(self.TEST_MASTER_PSWD.encode('utf-8'), client.get(KeyAgentClient.PSWD_KEY))
+
+            # new password held by the agent is neither asked nor confirmed
+            self.assertEqual(self.TEST_MASTER_PSWD, ec.confirm_pswd(client.new_pswd_input_func(input_func)))
+            self.assertEqual(3, len(asked))
+            # a new password is given to the agent when files are encrypted with it
+            client.remove(KeyAgentClient.PSWD_KEY)
+            typed[:] = ['new_pswd']
+            self.assertEqual('new_pswd', ec.confirm_pswd(client.new_pswd_input_func(input_func)))
+            self.assertEqual(5, len(asked))
+            self.assertEqual(None, client.get(KeyAgentClient.PSWD_KEY))
+            CipherBackend.create_file_header('new_pswd')
+            self.assertEqual(b'new_pswd', client.get(KeyAgentClient.PSWD_KEY))
+
+            # derived keys are kept by the agent
+            cache_len = len(agent.cache)
+            header, file_pswd = CipherBackend.create_file_header('other_pswd')
+            self.assertEqual(cache_len + 1, len(agent.cache))
+            OpensslBackend().encrypt_file(test_file_path, self.TEST_MASTER_PSWD, test_file_path + '.enc')
+            self.assertEqual(b'test', OpensslBackend().decrypt_bytes(test_file_path + '.enc', self.TEST_MASTER_PSWD))
+            self.assertEqual(None, OpensslBackend().decrypt_bytes(test_file_path + '.enc', 'wrong_pswd'))
+
+            client.stop()
+            thread.join(5)
+            self.assertEqual(False, thread.is_alive())
+            self.assertEqual(False, os.path.exists(agent.socket_path))
+            # nothing is cached without the agent
+            self.assertEqual(False, client.is_running())
+            client.put('a', b'1')
+            self.assertEqual(None, client.get('a'))
+            self.assertEqual(b'test', OpensslBackend().decrypt_bytes(test_file_path + '.enc', self.TEST_MASTER_PSWD))
+        finally:
+            CipherBackend.KEY_CACHE = default_cache
+            agent.shutdown()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
@@ -0,0 +1,115 @@
+# coding:utf-8
+import unittest, os, shutil, sys, io, json
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from metrics import Metrics, MemorySink, JsonLinesSink, PrometheusTextfileSink
+from cipher_backend import BackendRegistry
+from easy_crypt import EasyCrypt as ec
+
+class MetricsTest(unittest.TestCase):
+    """Test class for Metrics"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_metrics'
+    TEST_MASTER_PSWD = 'test_mst_pswd'
+    TEST_FILE_SIZE = 100000
+
+    test_tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        os.makedirs(os.path.join(cls.test_tmp_dir, 'dir'), exist_ok=True)
+        for i in range(3):
+            with open(os.path.join(cls.test_tmp_dir, 'dir', 'file{0}.bin'.format(i)), 'wb') as test_file:
+                test_file.write(os.urandom(cls.TEST_FILE_SIZE))
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(cls.test_tmp_dir)
+
+    def setUp(self):
+        self.sink = Metrics.add_sink(MemorySink())
+
+    def tearDown(self):
+        for sink in Metrics.SINKS: Metrics.remove_sink(sink)
+
+    # ========================== test methods ==========================
+
+    def test_stage(self):
+        with Metrics.stage(Metrics.ZIP, format='zip') as timer:
+            timer.add_bytes(10)
+            # same stage inside is measured by the outer one
+            with Metrics.stage(Metrics.ZIP):
+                pass
+        with self.assertRaises(ValueError):
+            with Metrics.stage(Metrics.UNZIP):
+                raise ValueError()
+        expected = [(Metrics.ZIP, 10, True, 'zip'), (Metrics.UNZIP, 0, False, None)]
+        actual = [(record['stage'], record['bytes'], record['ok'], record.get('format')) for record in self.sink.records]
+        self.assertEqual(expected, actual)
+
+        expected = {'calls': 1, 'bytes': 10, 'failures': 0}
+        actual = self.sink.summary()[Metrics.ZIP]
+        self.assertEqual(expected, dict((key, actual[key]) for key in expected))
+
+        # nothing is recorded without sinks
+        Metrics.remove_sink(self.sink)
+        self.sink.clear()
+        with Metrics.stage(Metrics.ZIP):
+            pass
+        self.assertEqual([], self.sink.records)
+        self.assertEqual([1, 2], list(Metrics.iterate(Metrics.WALK, [1, 2])))
+
+    def test_cipher_stages(self):
+        raw_path = os.path.join(self.test_tmp_dir, 'dir', 'file0.bin')
+        for backend in ['openssl', 'auto']:
+            self.sink.clear()
+            ec.encrypt_file(raw_path, self.TEST_MASTER_PSWD, raw_path + '.enc', backend=backend)
+            # stream of encrypt_file is not recorded again
+            expected = [(Metrics.CIPHER, 'encrypt_file', self.TEST_FILE_SIZE)]
+            actual = [(record['stage'], record.get('op'), record['bytes']) for record in self.sink.records
+                    if record['stage'] == Metrics.CIPHER]
+            self.assertEqual(expected, actual)
+            os.remove(raw_path + '.enc')
+        self.assertEqual(True, Metrics.SPAWN in self.sink.summary() or BackendRegistry.get('auto').name != 'openssl')
+
+    def test_dir_stages(self):
+        dir_path = os.path.join(self.test_tmp_dir, 'dir')
+        enc_path = dir_path + '.zip.enc'
+        dst_dir_path = os.path.join(self.test_tmp_dir, 'dst')
+        ec.encrypt_dir(dir_path, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        ec.decrypt_dir(enc_path, dst_dir_path, remove_zip=True, pswd_input_func=lambda msg: self.TEST_MASTER_PSWD)
+        summary = self.sink.summary()
+        for stage in [Metrics.WALK, Metrics.ZIP, Metrics.CIPHER, Metrics.UNZIP, Metrics.CLEANUP]:
+            self.assertEqual(True, stage in summary)
+        self.assertEqual(True, summary[Metrics.ZIP]['bytes'] >= self.TEST_FILE_SIZE * 3)
+        self.assertEqual(0, sum(stage_summary['failures'] for stage_summary in summary.values()))
+        os.remove(enc_path)
+        shutil.rmtree(dst_dir_path)
+
+    def test_sinks(self):
+        json_file = io.StringIO()
+        prom_path = os.path.join(self.test_tmp_dir, 'stats.prom')
+        json_sink = Metrics.add_sink(JsonLinesSink(json_file))
+        prom_sink = Metrics.add_sink(PrometheusTextfileSink(prom_path, {'job': 'test'}))
+        Metrics.record(Metrics.CIPHER, 0.5, 1024, op='encrypt_file')
+        Metrics.record(Metrics.CIPHER, 0.25, 1024, ok=False)
+        Metrics.remove_sink(json_sink)
+        Metrics.remove_sink(prom_sink)
+
+        records = [json.loads(line) for line in json_file.getvalue().splitlines()]
+        expected = [(Metrics.CIPHER, 0.5, 1024, True, 'encrypt_file'), (Metrics.CIPHER, 0.25, 1024, False, None)]
+        actual = [(record['stage'], record['seconds'], record['bytes'], record['ok'], record.get('op')) for record in records]
+        self.assertEqual(expected, actual)
+
+        with open(prom_path, 'r') as prom_file:
+            lines = prom_file.read().splitlines()
+        self.assertEqual(True, 'easycrypt_stage_seconds{job="test",stage="cipher"} 0.75' in lines)
+        self.assertEqual(True, 'easycrypt_stage_failures{job="test",stage="cipher"} 1' in lines)
+        self.assertEqual(True, '# TYPE easycrypt_stage_bytes gauge' in lines)
+        self.assertEqual(False, any('_total' in line for line in lines))
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
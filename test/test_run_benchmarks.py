@@ -0,0 +1,78 @@
+# coding:utf-8
+import unittest, os, shutil, sys, json, subprocess
+# to import benchmarks from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../bench')
+import run_benchmarks as rb
+
+class RunBenchmarksTest(unittest.TestCase):
+    """Test class for run_benchmarks"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_run_benchmarks'
+
+    test_tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        os.makedirs(cls.test_tmp_dir, exist_ok=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(cls.test_tmp_dir)
+
+    def test_parse_size(self):
+        self.assertEqual(1000, rb.parse_size('1000'))
+        self.assertEqual(65536, rb.parse_size('64K'))
+        self.assertEqual(65536, rb.parse_size(' 64k '))
+        self.assertEqual(1536 * 1024, rb.parse_size('1.5M'))
+        self.assertEqual(4 * 1024 ** 3, rb.parse_size('4G'))
+        self.assertRaises(ValueError, rb.parse_size, '64X')
+        for size in ['1K', '64K', '1M', '4G', '1000']:
+            self.assertEqual(size, rb.format_size(rb.parse_size(size)))
+
+    def test_summarize(self):
+        actual = rb.summarize([0.1, 0.3, 0.2, 0.4], 4 * 1024 * 1024, 8)
+        self.assertEqual(4, actual['calls'])
+        self.assertEqual(8, actual['files'])
+        self.assertEqual(4.0, actual['throughput_mb_s'])
+        self.assertEqual(125.0, actual['amortized_ms_per_file'])
+        self.assertEqual(300.0, actual['latency_ms']['p50'])
+        self.assertEqual(400.0, actual['latency_ms']['max'])
+
+    def test_compare(self):
+        baseline = {'a': rb.summarize([1.0], 10 * 1024 * 1024, 1), 'b': rb.summarize([1.0], 10 * 1024 * 1024, 1)}
+        # within threshold
+        results = {'a': rb.summarize([1.05], 10 * 1024 * 1024, 1), 'new': rb.summarize([1.0], 1024, 1)}
+        self.assertEqual([], rb.compare(results, baseline, 0.1))
+        # slower than threshold
+        results = {'a': rb.summarize([1.05], 10 * 1024 * 1024, 1), 'b': rb.summarize([1.5], 10 * 1024 * 1024, 1)}
+        self.assertEqual(['b'], rb.compare(results, baseline, 0.1))
+        self.assertEqual([], rb.compare(results, baseline, 0.6))
+
+    def test_exit_code(self):
+        result_path = os.path.join(self.test_tmp_dir, 'result.json')
+        baseline_path = os.path.join(self.test_tmp_dir, 'baseline.json')
+        # baseline which is much faster than any machine
+        baseline = {'results': {'file_1K/encrypt_file': rb.summarize([1e-9], 1024 ** 3, 1)}}
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(baseline, baseline_file)
+        cmd = [sys.executable, rb.__file__, '-g', 'file', '-s', '1K', '-r', '1', '-b', 'openssl',
+                '-w', self.test_tmp_dir, '-o', result_path, '-c', baseline_path]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE)
+        self.assertEqual(1, proc.returncode)
+        self.assertEqual(True, b'REGRESSION' in proc.stdout)
+        with open(result_path, 'r') as result_file:
+            actual = json.load(result_file)
+        self.assertEqual(['file_1K/decrypt_file', 'file_1K/decrypt_files', 'file_1K/encrypt_file', 'file_1K/encrypt_files'],
+                sorted(actual['results'].keys()))
+        # peak RSS is reported once for the group
+        self.assertEqual(['file_1K'], list(actual['groups'].keys()))
+        self.assertEqual(True, 'peak_rss_kb' in actual['groups']['file_1K'])
+        self.assertEqual(False, 'peak_rss_kb' in actual['results']['file_1K/encrypt_file'])
+        # no regression against itself with a generous threshold
+        self.assertEqual([], rb.compare(actual['results'], actual['results'], 0.1))
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
@@ -0,0 +1,118 @@
+# coding:utf-8
+import unittest, os, shutil, sys, time
+# to import script from other folder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
+from tree_walker import TreeWalker
+
+class TreeWalkerTest(unittest.TestCase):
+    """Test class for TreeWalker"""
+
+    TEST_TMP_DIR_NAME = 'test_tmp_tree_walker'
+    TEST_FILES = {
+        'a.txt': 10,
+        'b.log': 100,
+        '.hidden.txt': 10,
+        'src/main.py': 1000,
+        'src/keep.log': 10,
+        'src/build/out.o': 10,
+        'build/out.o': 10,
+        'node_modules/pkg/index.js': 10,
+    }
+
+    test_tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.TEST_TMP_DIR_NAME)
+        for rel_path, size in cls.TEST_FILES.items():
+            file_path = os.path.join(cls.test_tmp_dir, *rel_path.split('/'))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as test_file:
+                test_file.write(b'x' * size)
+        # old file
+        old_time = time.time() - 10 * 24 * 60 * 60
+        os.utime(os.path.join(cls.test_tmp_dir, 'a.txt'), (old_time, old_time))
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.test_tmp_dir):
+            # careful for the path because this is dangerous process
+            shutil.rmtree(cls.test_tmp_dir)
+
+    def walk(self, walker):
+        return [rel_path for rel_path, path, stat in walker.walk(self.test_tmp_dir)]
+
+    # ========================== test methods ==========================
+
+    def test_walk(self):
+        expected = sorted(rel_path for rel_path in self.TEST_FILES.keys() if rel_path.startswith('.') == False)
+        actual = self.walk(TreeWalker())
+        self.assertEqual(expected, sorted(actual))
+        # same order every time
+        self.assertEqual(actual, self.walk(TreeWalker()))
+        rel_path, path, stat = next(TreeWalker().walk(self.test_tmp_dir))
+        self.assertEqual(os.path.join(self.test_tmp_dir, *rel_path.split('/')), path)
+        self.assertEqual(self.TEST_FILES[rel_path], stat.st_size)
+
+        expected = sorted(self.TEST_FILES.keys())
+        actual = sorted(self.walk(TreeWalker(ignore_hidden_files=False)))
+        self.assertEqual(expected, actual)
+
+    def test_patterns(self):
+        expected = ['.hidden.txt', 'a.txt', 'src/keep.log', 'src/main.py']
+        actual = sorted(self.walk(TreeWalker(exclude=['*.log', '!keep.log', 'build/', '/node_modules'], ignore_hidden_files=False)))
+        self.assertEqual(expected, actual)
+
+        expected = ['build/out.o']
+        actual = sorted(self.walk(TreeWalker(exclude=['src/**/*.o', 'src/*', 'node_modules', '*.*t', 'b.*'])))
+        self.assertEqual(expected, actual)
+
+        expected = ['src/build/out.o', 'src/keep.log', 'src/main.py']
+        actual = sorted(self.walk(TreeWalker(include=['/src/'])))
+        self.assertEqual(expected, actual)
+
+        expected = ['build/out.o', 'src/build/out.o', 'src/main.py']
+        actual = sorted(self.walk(TreeWalker(include=['*.py', '**/build/*.o'])))
+        self.assertEqual(expected, actual)
+
+    def test_thresholds(self):
+        expected = ['b.log', 'src/main.py']
+        actual = sorted(self.walk(TreeWalker(min_size=100)))
+        self.assertEqual(expected, actual)
+
+        expected = ['b.log']
+        actual = sorted(self.walk(TreeWalker(min_size=11, max_size=999)))
+        self.assertEqual(expected, actual)
+
+        expected = ['a.txt']
+        actual = sorted(self.walk(TreeWalker(min_age=24 * 60 * 60)))
+        self.assertEqual(expected, actual)
+        self.assertEqual(False, 'a.txt' in self.walk(TreeWalker(max_age=24 * 60 * 60)))
+
+    @unittest.skipIf(os.name == 'nt', 'symlinks need privileges on windows')
+    def test_symlinks(self):
+        link_dir = os.path.join(self.test_tmp_dir, 'src', 'loop')
+        link_file = os.path.join(self.test_tmp_dir, 'link.txt')
+        os.symlink(self.test_tmp_dir, link_dir)
+        os.symlink(os.path.join(self.test_tmp_dir, 'a.txt'), link_file)
+        try:
+            actual = self.walk(TreeWalker())
+            self.assertEqual(True, 'link.txt' in actual)
+            self.assertEqual(False, any(rel_path.startswith('src/loop/') for rel_path in actual))
+
+            actual = self.walk(TreeWalker(symlinks=TreeWalker.SYMLINK_SKIP))
+            self.assertEqual(False, 'link.txt' in actual)
+
+            # loop is walked only once
+            actual = self.walk(TreeWalker(symlinks=TreeWalker.SYMLINK_FOLLOW))
+            self.assertEqual(False, any(rel_path.startswith('src/loop/') for rel_path in actual))
+            self.assertEqual(True, 'link.txt' in actual)
+        finally:
+            os.remove(link_dir)
+            os.remove(link_file)
+
+        with self.assertRaises(ValueError):
+            TreeWalker(symlinks='no_such_policy')
+
+if __name__ == '__main__':
+    unittest.main() # run unit test
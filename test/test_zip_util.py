@@ -1,8 +1,10 @@
 # coding:utf-8
-import unittest, os, shutil, sys
+import unittest, os, io, shutil, sys, zipfile
+from concurrent.futures import ThreadPoolExecutor
 # to import script from other folder
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../script')
 from zip_util import ZipUtil as zu
+import zip_util
 
 class ZipUtilTest(unittest.TestCase):
     """Test class for ZipUtil"""
@@ -80,10 +82,36 @@ class ZipUtilTest(unittest.TestCase):
         self.assertEqual(expected, actual)
 
     def test_utf8mac_to_sjis(self):
-        pass
+        # "ガ" in decomposed form of mac
+        expected = 'ガ.txt'.encode('sjis')
+        actual = zu.utf8mac_to_sjis('\u30ab\u3099.txt')
+        self.assertEqual(expected, actual)
+        actual = zu.utf8mac_to_sjis('\u30ab\u3099.txt'.encode('utf8'))
+        self.assertEqual(expected, actual)
 
     def test_sjis_to_utg8mac(self):
-        pass
+        expected = '\u30ab\u3099.txt'
+        actual = zu.sjis_to_utf8mac('ガ.txt'.encode('sjis'))
+        self.assertEqual(expected, actual)
+
+    def test_zip_dir_conv_sjis(self):
+        conv_dir = os.path.join(self.test_tmp_dir, 'conv_test_dir')
+        sub_dir = os.path.join(conv_dir, '\u30c6\u3099\u30fc\u30bf')
+        os.makedirs(sub_dir)
+        with open(os.path.join(sub_dir, '\u30ab\u3099.txt'), 'w') as test_file:
+            test_file.write('CONTENT')
+        expected = True
+        actual = zu.zip_dir_conv(conv_dir, path_sanitize_func=zu.utf8mac_to_sjis, compression='deflate')
+        self.assertEqual(expected, actual)
+        # no converted copy is left
+        self.assertEqual(['conv_test_dir'], [name for name in os.listdir(self.test_tmp_dir) if name.startswith('conv_test_dir') and name.endswith('.zip') == False])
+        self.assertEqual(['\u30c6\u3099\u30fc\u30bf'], os.listdir(conv_dir))
+        zip_path = conv_dir + '.zip'
+        with zipfile.ZipFile(zip_path, metadata_encoding='sjis') as zip_file:
+            self.assertEqual(['conv_test_dir/データ/ガ.txt'], zip_file.namelist())
+            self.assertEqual(b'CONTENT', zip_file.read('conv_test_dir/データ/ガ.txt'))
+        os.remove(zip_path)
+        shutil.rmtree(conv_dir)
 
     def test_zip_dir_conv(self):
         # false test for path that not exists
@@ -101,6 +129,26 @@ class ZipUtilTest(unittest.TestCase):
         self.assertEqual(expected, actual)
         os.remove(self.zip_test_dir + '.zip')
 
+    def test_zip_dir_concurrently(self):
+        cwd = os.getcwd()
+        src_dirs = [os.path.join(self.test_tmp_dir, 'concurrent{0}'.format(i)) for i in range(8)]
+        for src_dir in src_dirs:
+            os.makedirs(os.path.join(src_dir, 'sub'))
+            with open(os.path.join(src_dir, 'sub', self.TEST_FILE_NAME), 'w') as test_file:
+                test_file.write(src_dir)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            actual = list(pool.map(lambda src_dir: zu.zip_dir(src_dir, compression='deflate', max_workers=1), src_dirs))
+        self.assertEqual([True] * len(src_dirs), actual)
+        # working directory is not changed
+        self.assertEqual(cwd, os.getcwd())
+        for src_dir in src_dirs:
+            with zipfile.ZipFile(src_dir + '.zip') as zip_file:
+                member_name = os.path.basename(src_dir) + '/sub/' + self.TEST_FILE_NAME
+                self.assertEqual([member_name], zip_file.namelist())
+                self.assertEqual(src_dir.encode(), zip_file.read(member_name))
+            os.remove(src_dir + '.zip')
+            shutil.rmtree(src_dir)
+
     def test_zip_dir(self):
         # false test for path that not exists
         expected = False
@@ -112,6 +160,96 @@ class ZipUtilTest(unittest.TestCase):
         self.assertEqual(expected, actual)
         os.remove(self.zip_test_dir + '.zip')
 
+    def test_zip_dir_compression(self):
+        comp_dir = os.path.join(self.test_tmp_dir, 'comp_test_dir')
+        contents = {'a.txt': b'a' * 10000, 'b.jpg': b'b' * 10000, 'c.bin': os.urandom(1000)}
+        for i in range(10): contents['sub{0}.txt'.format(i)] = ('sub' * 1000 + str(i)).encode()
+        os.makedirs(comp_dir)
+        for fname, content in contents.items():
+            with open(os.path.join(comp_dir, fname), 'wb') as test_file:
+                test_file.write(content)
+        zip_path = comp_dir + '.zip'
+        self.assertEqual(False, zu.zip_dir(comp_dir, compression='no_such_compression'))
+        for compression in zu.COMPRESSIONS.keys():
+            for max_workers in [1, 2]:
+                expected = True
+                actual = zu.zip_dir(comp_dir, compression=compression, max_workers=max_workers)
+                self.assertEqual(expected, actual)
+                with zipfile.ZipFile(zip_path) as zip_file:
+                    self.assertEqual(None, zip_file.testzip())
+                    infos = dict((os.path.basename(info.filename), info) for info in zip_file.infolist())
+                    self.assertEqual(sorted(contents.keys()), sorted(infos.keys()))
+                    for fname, content in contents.items():
+                        self.assertEqual(content, zip_file.read(infos[fname]))
+                    # already compressed (by extension) and incompressible files are stored
+                    self.assertEqual(zipfile.ZIP_STORED, infos['b.jpg'].compress_type)
+                    self.assertEqual(zipfile.ZIP_STORED, infos['c.bin'].compress_type)
+                    self.assertEqual(zu.COMPRESSIONS[compression], infos['a.txt'].compress_type)
+                os.remove(zip_path)
+
+        # not seekable output
+        class WriteOnlyStream(io.RawIOBase):
+            def __init__(self): self.buf = io.BytesIO()
+            def writable(self): return True
+            def write(self, data): return self.buf.write(data)
+        stream = WriteOnlyStream()
+        self.assertEqual(True, zu.zip_dir(comp_dir, dst=stream, compression='deflate', max_workers=2))
+        with zipfile.ZipFile(io.BytesIO(stream.buf.getvalue())) as zip_file:
+            self.assertEqual(None, zip_file.testzip())
+            self.assertEqual(len(contents), len(zip_file.infolist()))
+
+        # members on the fly are limited by their total size
+        max_pending_bytes = zu.PARALLEL_MAX_PENDING_BYTES
+        zu.PARALLEL_MAX_PENDING_BYTES = 15000
+        try:
+            zip_buf = io.BytesIO()
+            with zipfile.ZipFile(zip_buf, 'w') as zip_file, \
+                    zip_util._ParallelZipWriter(zip_file, zipfile.ZIP_DEFLATED, max_workers=4) as member_writer:
+                for fname in sorted(contents.keys()):
+                    member_writer.write(os.path.join(comp_dir, fname), fname)
+                    self.assertEqual(True, member_writer._pending_bytes <= zu.PARALLEL_MAX_PENDING_BYTES)
+        finally:
+            zu.PARALLEL_MAX_PENDING_BYTES = max_pending_bytes
+        with zipfile.ZipFile(zip_buf) as zip_file:
+            self.assertEqual(None, zip_file.testzip())
+            self.assertEqual(sorted(contents.keys()), sorted(zip_file.namelist()))
+        shutil.rmtree(comp_dir)
+
+    def test_zip64_member_count(self):
+        # more members than the end of central directory record can count need zip64 records
+        file_path = os.path.join(self.test_tmp_dir, 'zip64.txt')
+        with open(file_path, 'wb') as test_file:
+            test_file.write(b'zip64' * 100)
+        member_count = zipfile.ZIP_FILECOUNT_LIMIT + 2
+        zip_buf = io.BytesIO()
+        with zipfile.ZipFile(zip_buf, 'w') as zip_file:
+            self.assertEqual(True, zip_util._can_write_compressed(zip_file))
+            with zip_util._ParallelZipWriter(zip_file, zipfile.ZIP_DEFLATED, max_workers=1) as member_writer:
+                for i in range(member_count):
+                    member_writer.write(file_path, 'zip64/{0}.txt'.format(i))
+        with zipfile.ZipFile(zip_buf) as zip_file:
+            self.assertEqual(None, zip_file.testzip())
+            infos = zip_file.infolist()
+            self.assertEqual(member_count, len(infos))
+            self.assertEqual(zipfile.ZIP_DEFLATED, infos[-1].compress_type)
+            self.assertEqual(b'zip64' * 100, zip_file.read(infos[-1]))
+        os.remove(file_path)
+
+    def test_zip_without_zipfile_internals(self):
+        # if zipfile internals are missing, members are written through ZipFile.open
+        can_write_compressed = zip_util._can_write_compressed
+        zip_util._can_write_compressed = lambda zip_file: False
+        try:
+            expected = True
+            actual = zu.zip_dir(self.zip_test_dir, dst=self.zip_test_dir + '.zip', compression='deflate', max_workers=2)
+            self.assertEqual(expected, actual)
+        finally:
+            zip_util._can_write_compressed = can_write_compressed
+        with zipfile.ZipFile(self.zip_test_dir + '.zip') as zip_file:
+            self.assertEqual(None, zip_file.testzip())
+            self.assertEqual(True, len(zip_file.infolist()) > 0)
+        os.remove(self.zip_test_dir + '.zip')
+
     def test_unzip_dir(self):
         # false test for path that not exists
         expected = False
@@ -128,5 +266,59 @@ class ZipUtilTest(unittest.TestCase):
         actual = zu.unzip_dir(zip_path)
         self.assertEqual(expected, actual)
 
+    def test_unzip_dir_parallel(self):
+        src_dir = os.path.join(self.test_tmp_dir, 'punzip_src')
+        rel_paths = [os.path.join('d{0}'.format(i % 3), 'e{0}'.format(i % 2), 'f{0}.txt'.format(i)) for i in range(20)]
+        for rel_path in rel_paths:
+            file_path = os.path.join(src_dir, rel_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as test_file:
+                test_file.write(rel_path * 100)
+        zu.zip_dir(src_dir, compression='deflate')
+        zip_path = src_dir + '.zip'
+        shutil.rmtree(src_dir)
+        dst_dir = os.path.join(self.test_tmp_dir, 'punzip_dst')
+        for max_workers in [1, 4]:
+            expected = True
+            actual = zu.unzip_dir(zip_path, dst_dir, max_workers=max_workers)
+            self.assertEqual(expected, actual)
+            for rel_path in rel_paths:
+                with open(os.path.join(dst_dir, 'punzip_src', rel_path), 'r') as test_file:
+                    self.assertEqual(rel_path * 100, test_file.read())
+            shutil.rmtree(dst_dir)
+        os.remove(zip_path)
+
+    def test_tar_dir_and_untar_stream(self):
+        expected = False
+        actual = zu.tar_dir(self.test_no_exist)
+        self.assertEqual(expected, actual)
+
+        expected = True
+        actual = zu.tar_dir(self.zip_test_dir)
+        self.assertEqual(expected, actual)
+        tar_path = self.zip_test_dir + '.tar'
+        dst_dir = os.path.join(self.test_tmp_dir, self.UNZIP_TEST_DIR_NAME)
+        with open(tar_path, 'rb') as tar_stream:
+            actual = zu.untar_stream(tar_stream, dst_dir)
+        self.assertEqual(expected, actual)
+        extracted_dir = os.path.join(dst_dir, self.ZIP_TEST_DIR_NAME)
+        self.assertEqual(True, os.path.exists(os.path.join(extracted_dir, self.TEST_FILE_NAME)))
+        # hidden files are ignored by default
+        self.assertEqual(False, os.path.exists(os.path.join(extracted_dir, self.TEST_HIDDEN_FILE_NAME)))
+
+        # destination already exists
+        expected = False
+        with open(tar_path, 'rb') as tar_stream:
+            actual = zu.untar_stream(tar_stream, dst_dir)
+        self.assertEqual(expected, actual)
+        shutil.rmtree(dst_dir)
+
+        # not a tar archive
+        expected = False
+        with open(self.zip_test_file, 'rb') as tar_stream:
+            actual = zu.untar_stream(tar_stream, dst_dir)
+        self.assertEqual(expected, actual)
+        os.remove(tar_path)
+
 if __name__ == '__main__':
     unittest.main() # run unit test